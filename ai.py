@@ -1,14 +1,39 @@
+import atexit
+import itertools
+import multiprocessing
+import queue
+import threading
 import time
 import chess
 import random
-from evaluation import evaluate_board
+from dataclasses import dataclass, field, fields
+from multiprocessing import shared_memory
+from bitbase import open_bitbases, WIN, DRAW
+from book import open_book
+from nativeboard import NativeBoard
+import evaluation
+from evaluation import EVALUATORS, material_pst_bitboard, material_pst_delta, terminal_score
+from transposition import EvaluationCache, TranspositionTable, TT_EXACT, TT_ALPHA, TT_BETA
 
 # Zobrist hashing setup
 ZOBRIST_PIECE_KEYS = {}
 ZOBRIST_CASTLING_KEYS = {}
 ZOBRIST_EP_KEYS = {}
 ZOBRIST_SIDE_TO_MOVE_KEY = 0
-transposition_table = {}
+
+TT_SIZE_MB = 16
+EVAL_CACHE_SIZE_MB = 4
+
+# Static evaluator used at the leaves; see evaluation.EVALUATORS.
+EVALUATION_BACKEND = "bitboard"
+evaluate_board = EVALUATORS[EVALUATION_BACKEND]
+transposition_table = TranspositionTable(TT_SIZE_MB)
+# Static evaluations of leaf positions, keyed like the transposition table.
+evaluation_cache = EvaluationCache(EVAL_CACHE_SIZE_MB)
+
+# When enabled, every incrementally updated hash is cross-checked against a
+# full recompute. Slow; meant for debugging the make/unmake bookkeeping.
+ZOBRIST_DEBUG = False
 
 
 def initialize_zobrist():
@@ -27,6 +52,21 @@ def initialize_zobrist():
     ZOBRIST_SIDE_TO_MOVE_KEY = random.getrandbits(64)
 
 
+def castling_index(board):
+    """Castling rights as a 4-bit index into ZOBRIST_CASTLING_KEYS."""
+    rights = board.clean_castling_rights()
+    c_val = 0
+    if rights & chess.BB_H1:
+        c_val |= 1
+    if rights & chess.BB_A1:
+        c_val |= 2
+    if rights & chess.BB_H8:
+        c_val |= 4
+    if rights & chess.BB_A8:
+        c_val |= 8
+    return c_val
+
+
 def compute_zobrist_hash(board):
     h = 0
     for square in chess.SQUARES:
@@ -38,17 +78,7 @@ def compute_zobrist_hash(board):
     if board.turn == chess.BLACK:
         h ^= ZOBRIST_SIDE_TO_MOVE_KEY
 
-    c_val = 0
-    if board.has_kingside_castling_rights(chess.WHITE):
-        c_val |= 1
-    if board.has_queenside_castling_rights(chess.WHITE):
-        c_val |= 2
-    if board.has_kingside_castling_rights(chess.BLACK):
-        c_val |= 4
-    if board.has_queenside_castling_rights(chess.BLACK):
-        c_val |= 8
-
-    h ^= ZOBRIST_CASTLING_KEYS[c_val]
+    h ^= ZOBRIST_CASTLING_KEYS[castling_index(board)]
 
     if board.ep_square is not None:
         file_ = chess.square_file(board.ep_square)
@@ -57,128 +87,979 @@ def compute_zobrist_hash(board):
     return h
 
 
+def make_move(board, move, hash_key):
+    """Push move onto board and return the incrementally updated hash.
+
+    Only the keys touched by the move are xored in and out, so this is O(1)
+    instead of the 64-square walk in compute_zobrist_hash. Unmaking is just
+    board.pop() with the caller keeping the parent's hash.
+    """
+    from_square = move.from_square
+    to_square = move.to_square
+    us = 0 if board.turn == chess.WHITE else 6
+    them = 6 - us
+    piece_type = board.piece_type_at(from_square)
+    h = hash_key ^ ZOBRIST_PIECE_KEYS[(from_square, piece_type + us)]
+
+    if piece_type == chess.KING and board.is_castling(move):
+        # Handles both e1g1 and the king-takes-rook (e1h1) encodings.
+        rank_start = from_square & ~7
+        if to_square > from_square:
+            king_to, rook_from, rook_to = rank_start + 6, rank_start + 7, rank_start + 5
+        else:
+            king_to, rook_from, rook_to = rank_start + 2, rank_start, rank_start + 3
+        h ^= ZOBRIST_PIECE_KEYS[(king_to, chess.KING + us)]
+        h ^= ZOBRIST_PIECE_KEYS[(rook_from, chess.ROOK + us)]
+        h ^= ZOBRIST_PIECE_KEYS[(rook_to, chess.ROOK + us)]
+    else:
+        if piece_type == chess.PAWN and to_square == board.ep_square and board.is_en_passant(move):
+            captured_square = to_square - 8 if us == 0 else to_square + 8
+            h ^= ZOBRIST_PIECE_KEYS[(captured_square, chess.PAWN + them)]
+        else:
+            captured = board.piece_type_at(to_square)
+            if captured:
+                h ^= ZOBRIST_PIECE_KEYS[(to_square, captured + them)]
+        h ^= ZOBRIST_PIECE_KEYS[(to_square, (move.promotion or piece_type) + us)]
+
+    h ^= ZOBRIST_CASTLING_KEYS[castling_index(board)]
+    if board.ep_square is not None:
+        h ^= ZOBRIST_EP_KEYS[board.ep_square & 7]
+
+    board.push(move)
+
+    h ^= ZOBRIST_CASTLING_KEYS[castling_index(board)]
+    if board.ep_square is not None:
+        h ^= ZOBRIST_EP_KEYS[board.ep_square & 7]
+    h ^= ZOBRIST_SIDE_TO_MOVE_KEY
+
+    if ZOBRIST_DEBUG:
+        expected = compute_zobrist_hash(board)
+        assert h == expected, f"incremental hash mismatch after {move.uci()} in {board.fen()}"
+    return h
+
+
+def make_null_move(board, hash_key):
+    """Pass the turn (for null-move pruning) and return the updated hash."""
+    if board.ep_square is not None:
+        hash_key ^= ZOBRIST_EP_KEYS[board.ep_square & 7]
+    board.push(chess.Move.null())
+    return hash_key ^ ZOBRIST_SIDE_TO_MOVE_KEY
+
+
 initialize_zobrist()
 
 
-def lookup_transposition(hash_key, alpha, beta, depth):
-    if hash_key in transposition_table:
-        stored_depth, stored_value, stored_flag = transposition_table[hash_key]
+def set_evaluation_backend(name):
+    """Switch the leaf evaluator, e.g. to "squares" to compare against the bitboard one."""
+    global EVALUATION_BACKEND, evaluate_board
+    evaluate_board = EVALUATORS[name]
+    EVALUATION_BACKEND = name
+    clear_evaluation_caches()
+
+
+def resize_transposition_table(size_mb):
+    """Replace the table with an empty one of size_mb megabytes."""
+    global transposition_table
+    transposition_table = TranspositionTable(size_mb)
+
+
+def clear_transposition_table():
+    transposition_table.clear()
+
+
+def resize_evaluation_cache(size_mb):
+    global evaluation_cache
+    evaluation_cache = EvaluationCache(size_mb)
+
+
+def clear_evaluation_caches():
+    """Empty the evaluation cache and the pawn hash table, e.g. after changing the evaluation."""
+    evaluation_cache.clear()
+    evaluation.pawn_hash_table.clear()
+
+
+def load_evaluation_parameters(path=None):
+    """Evaluate with the weights in path (e.g. written by tune.py); None restores the built-in ones.
+
+    Cached evaluations and transposition table scores came from the old
+    weights, so both are cleared.
+    """
+    if path is None:
+        evaluation.set_parameters(evaluation.DEFAULT_PARAMETERS)
+    else:
+        evaluation.load_parameters(path)
+    clear_evaluation_caches()
+    clear_transposition_table()
+
+
+# Fivefold repetition and the 75-move rule make a position's evaluation
+# depend on the game history; both need at least this many reversible plies.
+EVAL_CACHE_MAX_HALFMOVES = 16
+
+
+def cached_evaluation(board, hash_key, material_pst_score=None, stats=None):
+    """evaluate_board through the evaluation cache."""
+    value = evaluation_cache.probe(hash_key)
+    if stats is not None:
+        stats.eval_probes += 1
+        if value is not None:
+            stats.eval_hits += 1
+    if value is None:
+        value = evaluate_board(board, material_pst_score)
+        if board.halfmove_clock < EVAL_CACHE_MAX_HALFMOVES:
+            evaluation_cache.store(hash_key, value)
+    return value
+
+
+def lookup_transposition(hash_key, alpha, beta, depth, stats=None):
+    entry = transposition_table.probe(hash_key)
+    if stats is not None:
+        stats.tt_probes += 1
+    if entry is not None:
+        if stats is not None:
+            stats.tt_hits += 1
+        stored_depth, stored_value, stored_flag, _ = entry
+        value = None
         if stored_depth >= depth:
-            if stored_flag == "EXACT":
-                return stored_value
-            elif stored_flag == "ALPHA" and stored_value <= alpha:
-                return alpha
-            elif stored_flag == "BETA" and stored_value >= beta:
-                return beta
+            if stored_flag == TT_EXACT:
+                value = stored_value
+            elif stored_flag == TT_ALPHA and stored_value <= alpha:
+                value = alpha
+            elif stored_flag == TT_BETA and stored_value >= beta:
+                value = beta
+        if value is not None and stats is not None:
+            stats.tt_cutoffs += 1
+        return value
     return None
 
 
-def store_transposition(hash_key, depth, value, flag):
-    transposition_table[hash_key] = (depth, value, flag)
+def store_transposition(hash_key, depth, value, flag, best_move=None):
+    transposition_table.store(hash_key, depth, value, flag, best_move)
+
+
+# Nodes searched between polls of the clock (must be a power of two).
+TIME_CHECK_INTERVAL = 256
+# Fraction of max_time after which no new iteration is started.
+SOFT_TIME_FRACTION = 0.6
+MAX_SEARCH_DEPTH = 64
+
+# Scout searches use the window (alpha, alpha + NULL_WINDOW). Evaluation
+# scores are multiples of 0.05 (set_parameters and tune.py keep the tuned
+# mobility weight on that grid too), so no real score falls strictly inside it.
+NULL_WINDOW = 0.001
+# Initial half-width of the root aspiration window (same units as evaluate_board),
+# widened by ASPIRATION_GROWTH after every fail.
+ASPIRATION_WINDOW = 50.0
+ASPIRATION_GROWTH = 4.0
+
+# Selective search parameters. Margins are in evaluate_board units and are
+# compared against the incrementally tracked material/PST score.
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVES = 3
+FUTILITY_MARGINS = [0, 200, 500]  # indexed by remaining depth
+RAZOR_MARGIN = 600
+
+# Search features, individually switchable per search (see search()).
+DEFAULT_SEARCH_OPTIONS = {
+    "pvs": True,         # principal variation search: null-window scouts after the first move
+    "aspiration": True,  # root window around the previous iteration's score
+    "null_move": True,   # null-move pruning (not in check, not in pawn-only endings)
+    "lmr": True,         # late move reductions for quiet moves (on PVS scout searches)
+    "futility": True,    # skip quiet moves near the leaves that cannot raise alpha
+    "razoring": True,    # search hopeless pre-frontier nodes one ply shallower
+    "bitbases": True,    # exact results for KPK/KRK/KQK from the bitbases, when generated
+    "native_board": True,  # search on nativeboard.NativeBoard instead of a chess.Board copy
+    "instant_forced_move": True,  # play a single legal move at once, unsearched (score 0.0, depth 0)
+}
+
+# Bitbase wins score below a mate but above any material balance; the
+# progress terms in bitbase_score() steer the search toward the mate.
+BITBASE_WIN_SCORE = 10000.0
+
+
+class SearchTimeout(Exception):
+    """Raised from inside the search once the hard time limit has passed."""
+
+
+def parse_search_options(text):
+    """'pvs=0,lmr=1' -> {'pvs': False, 'lmr': True}, for command-line tools; '' -> {}."""
+    options = {}
+    for item in filter(None, text.split(",")):
+        name, _, value = item.partition("=")
+        if name not in DEFAULT_SEARCH_OPTIONS:
+            raise ValueError(f"unknown search option {name!r}")
+        options[name] = value not in ("0", "false", "off", "no")
+    return options
+
+
+class TimeManager:
+    """Soft and hard time limits for one search.
+
+    The hard limit is enforced inside the search, which polls expired()
+    every TIME_CHECK_INTERVAL nodes and unwinds with SearchTimeout. The soft
+    limit and the predicted cost of the next iteration decide whether
+    iterative deepening starts another iteration at all.
+    """
+
+    def __init__(self, max_time, stop_event=None, max_nodes=None):
+        self.start = time.monotonic()
+        # Setting stop_event ends the search early, as if the hard limit had passed.
+        self.stop_event = stop_event
+        # Node budget, checked at the same polls as the clock.
+        self.max_nodes = max_nodes
+        if max_time is None:
+            max_time = float("inf")
+        self.hard_deadline = self.start + max_time
+        self.soft_deadline = self.start + max_time * SOFT_TIME_FRACTION
+        self.iteration_times = []
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def expired(self, nodes=0):
+        return (time.monotonic() >= self.hard_deadline or self.stopped()
+                or (self.max_nodes is not None and nodes >= self.max_nodes))
+
+    def stopped(self):
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    def iteration_done(self, seconds):
+        self.iteration_times.append(seconds)
+
+    def can_start_iteration(self):
+        """False once past the soft limit or if the next iteration is not expected to finish."""
+        now = time.monotonic()
+        if now >= self.soft_deadline or self.stopped():
+            return False
+        times = self.iteration_times
+        if not times:
+            return True
+        # Assume the next iteration grows like the last one did, within sane bounds.
+        growth = times[-1] / times[-2] if len(times) >= 2 and times[-2] > 0 else 4.0
+        growth = min(max(growth, 2.0), 8.0)
+        return now + times[-1] * growth <= self.hard_deadline
 
 
-def order_moves(board):
+@dataclass
+class SearchStats:
+    """Counters kept by the search, for a whole search or one iteration."""
+    nodes: int = 0
+    tt_probes: int = 0
+    tt_hits: int = 0             # probes that found an entry for the position
+    tt_cutoffs: int = 0          # hits that decided the node without searching it
+    beta_cutoffs: int = 0
+    first_move_cutoffs: int = 0  # beta cutoffs caused by the first move searched
+    move_orderings: int = 0      # calls to order_moves
+    eval_probes: int = 0         # leaf evaluations looked up in the evaluation cache
+    eval_hits: int = 0
+    pawn_probes: int = 0         # pawn structure lookups in the pawn hash table
+    pawn_hits: int = 0
+
+    @property
+    def tt_hit_rate(self):
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+
+    @property
+    def tt_cutoff_rate(self):
+        return self.tt_cutoffs / self.tt_probes if self.tt_probes else 0.0
+
+    @property
+    def eval_hit_rate(self):
+        return self.eval_hits / self.eval_probes if self.eval_probes else 0.0
+
+    @property
+    def pawn_hit_rate(self):
+        return self.pawn_hits / self.pawn_probes if self.pawn_probes else 0.0
+
+    @property
+    def first_move_cutoff_rate(self):
+        """Share of beta cutoffs found on the first move: a measure of move ordering."""
+        return self.first_move_cutoffs / self.beta_cutoffs if self.beta_cutoffs else 0.0
+
+    def copy(self):
+        return SearchStats(**{f.name: getattr(self, f.name) for f in fields(self)})
+
+    def since(self, earlier):
+        """The counts accumulated after the snapshot earlier."""
+        return SearchStats(**{f.name: getattr(self, f.name) - getattr(earlier, f.name) for f in fields(self)})
+
+    @staticmethod
+    def total(stats):
+        return SearchStats(**{f.name: sum(getattr(s, f.name) for s in stats) for f in fields(SearchStats)})
+
+
+class SearchContext:
+    """State shared by all nodes of one search: move-ordering heuristics,
+    node count and the time manager that bounds it."""
+
+    def __init__(self, time_manager=None, options=None):
+        self.time_manager = time_manager
+        self.options = dict(DEFAULT_SEARCH_OPTIONS, **(options or {}))
+        self.nodes = 0
+        self.stats = SearchStats()
+        # ply -> [killer, killer]: quiet moves that caused a beta cutoff at that ply
+        self.killers = {}
+        # (side to move, from, to) -> accumulated depth^2 of quiet cutoffs
+        self.history = [0] * (2 * 64 * 64)
+        self.bitbases = get_bitbases() if self.options["bitbases"] else None
+        # The pawn hash table counts for the whole process; snapshots report the difference.
+        self._pawn_counts = (evaluation.pawn_hash_table.probes, evaluation.pawn_hash_table.hits)
+
+    def snapshot(self):
+        """Copy of the statistics so far, including the node and pawn hash counts."""
+        stats = self.stats.copy()
+        stats.nodes = self.nodes
+        stats.pawn_probes = evaluation.pawn_hash_table.probes - self._pawn_counts[0]
+        stats.pawn_hits = evaluation.pawn_hash_table.hits - self._pawn_counts[1]
+        return stats
+
+    def record_cutoff(self, board, move, depth):
+        """Remember a quiet move that refuted the position (call with the move not pushed)."""
+        if board.is_capture(move) or move.promotion:
+            return
+        ply = board.ply()
+        killers = self.killers.setdefault(ply, [None, None])
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        self.history[(board.turn * 64 + move.from_square) * 64 + move.to_square] += depth * depth
+
+
+# Move-ordering score bands; within a band moves are ranked by the detail score.
+ORDER_TT_MOVE = 1 << 30
+ORDER_CAPTURE = 1 << 26
+ORDER_KILLER = 1 << 25
+ORDER_CHECK = 1 << 24
+
+
+def order_moves(board, hash_key=None, ctx=None, moves=None):
     """Order moves to improve alpha-beta efficiency.
-    Simple heuristic: put captures and checks first."""
-    moves = list(board.legal_moves)
+
+    TT best move first, then captures by MVV-LVA (and promotions), killer
+    moves, quiet checks, and finally quiet moves by history score. Checks
+    are detected with gives_check instead of pushing every move. A list of
+    the legal moves the caller already generated is sorted in place.
+    """
+    tt_move = transposition_table.probe_move(hash_key) if hash_key is not None else None
+    if ctx is not None:
+        ctx.stats.move_orderings += 1
+        killers = ctx.killers.get(board.ply(), ())
+        history = ctx.history
+        side = board.turn * 64
+    else:
+        killers = ()
+        history = None
+    piece_type_at = board.piece_type_at
+
     def move_score(move):
-        # captures
-        if board.is_capture(move):
-            return 2
-        # checks
-        board.push(move)
-        in_check = board.is_check()
-        board.pop()
-        if in_check:
-            return 1
+        if move == tt_move:
+            return ORDER_TT_MOVE
+        victim = piece_type_at(move.to_square)
+        if victim or move.promotion or board.is_en_passant(move):
+            # most valuable victim, least valuable attacker
+            return ORDER_CAPTURE + (victim or chess.PAWN) * 16 + (move.promotion or 0) * 8 - piece_type_at(move.from_square)
+        if move in killers:
+            return ORDER_KILLER + (1 if move == killers[0] else 0)
+        if board.gives_check(move):
+            return ORDER_CHECK
+        if history is not None:
+            return history[(side + move.from_square) * 64 + move.to_square]
         return 0
+
+    if moves is None:
+        moves = list(board.legal_moves)
     moves.sort(key=move_score, reverse=True)
     return moves
 
 
-def minimax_alpha_beta(board, depth, alpha, beta, maximizing_player):
-    if depth == 0 or board.is_game_over():
-        return evaluate_board(board)
+def bitbase_score(board, result):
+    """Score for the side to move of a bitbase WIN, DRAW or LOSS.
 
-    hash_key = compute_zobrist_hash(board)
-    tt_val = lookup_transposition(hash_key, alpha, beta, depth)
+    Wins are worth more the closer the weak king is to the edge, the closer
+    the kings stand and the further a pawn has advanced, so the winning side
+    makes progress instead of shuffling between won positions.
+    """
+    if result == DRAW:
+        return 0.0
+    strong = board.turn if result == WIN else not board.turn
+    weak_king = board.king(not strong)
+    file_, rank = chess.square_file(weak_king), chess.square_rank(weak_king)
+    edge = max(3 - file_, file_ - 4) + max(3 - rank, rank - 4)
+    value = BITBASE_WIN_SCORE + 10 * edge - 4 * chess.square_manhattan_distance(weak_king, board.king(strong))
+    if board.pawns:
+        rank = chess.square_rank(chess.lsb(board.pawns))
+        value += 20 * (rank if strong == chess.WHITE else 7 - rank)
+    return value if result == WIN else -value
+
+
+def negamax(board, depth, alpha, beta, color, hash_key, material_pst_score, ctx):
+    """Principal variation search in negamax form.
+
+    Scores are from the point of view of color (1 maximizes evaluate_board,
+    -1 minimizes it). After the first move every move is searched with a
+    null window around alpha and only re-searched with the full window if it
+    unexpectedly beats alpha. Null-move pruning, late move reductions,
+    futility pruning and razoring are applied as enabled in ctx.options.
+    """
+    ctx.nodes += 1
+    if not ctx.nodes & (TIME_CHECK_INTERVAL - 1) and ctx.time_manager is not None and ctx.time_manager.expired(ctx.nodes):
+        raise SearchTimeout()
+
+    moves = None
+    if ctx.bitbases is not None and chess.popcount(board.occupied) == 3:
+        # A finished game takes precedence over the bitbases. The moves
+        # generated to tell are the ones searched below.
+        moves = list(board.legal_moves)
+        if terminal_score(board, len(moves)) is None:
+            result = ctx.bitbases.probe(board)
+            # Draws are final. Won positions are still searched above the leaves,
+            # since only the search can find the way to the mate.
+            if result == DRAW or (result is not None and depth <= 0):
+                return bitbase_score(board, result)
+
+    if depth <= 0:
+        return color * cached_evaluation(board, hash_key, material_pst_score, ctx.stats)
+
+    # Finished games are never stored, so a cutoff here needs no move generation.
+    tt_val = lookup_transposition(hash_key, alpha, beta, depth, ctx.stats)
     if tt_val is not None:
         return tt_val
 
-    if maximizing_player:
-        max_eval = float("-inf")
-        stored_flag = "ALPHA"
-        moves = order_moves(board)
-        for move in moves:
-            board.push(move)
-            eval_ = minimax_alpha_beta(board, depth - 1, alpha, beta, False)
-            board.pop()
-            if eval_ > max_eval:
-                max_eval = eval_
-            alpha = max(alpha, eval_)
-            if beta <= alpha:
-                break
-        if max_eval <= alpha:
-            stored_flag = "ALPHA"
-        elif max_eval >= beta:
-            stored_flag = "BETA"
+    # The one move generation of this node: it decides mate and stalemate here
+    # and is ordered and searched below.
+    if moves is None:
+        moves = list(board.legal_moves)
+    terminal = terminal_score(board, len(moves))
+    if terminal is not None:
+        return color * terminal
+
+    options = ctx.options
+    inf = float("inf")
+    in_check = board.is_check()
+    # Cheap static estimate for the pruning decisions below.
+    static_eval = color * material_pst_score
+
+    if not in_check and options["razoring"] and depth == 2 and static_eval + RAZOR_MARGIN <= alpha:
+        depth = 1
+
+    if (options["null_move"] and depth >= NULL_MOVE_MIN_DEPTH and not in_check and beta != inf
+            and static_eval >= beta and (not board.move_stack or board.move_stack[-1])
+            and board.occupied_co[board.turn] & ~(board.pawns | board.kings)):
+        # Even passing the turn fails high: a real move almost surely would too.
+        # Skipped without pieces, where zugzwang makes the assumption unsafe.
+        null_key = make_null_move(board, hash_key)
+        value = -negamax(board, depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + NULL_WINDOW, -color,
+                         null_key, material_pst_score, ctx)
+        board.pop()
+        if value >= beta:
+            return beta
+
+    futility = (options["futility"] and not in_check and depth < len(FUTILITY_MARGINS) and alpha != -inf
+                and static_eval + FUTILITY_MARGINS[depth] <= alpha)
+
+    alpha_orig = alpha
+    pvs = options["pvs"]
+    lmr = options["lmr"] and depth >= LMR_MIN_DEPTH and not in_check
+    best_value = -inf
+    best_move = None
+    for i, move in enumerate(order_moves(board, hash_key, ctx, moves)):
+        quiet = not move.promotion and not board.is_capture(move)
+        if futility and i > 0 and quiet and not board.gives_check(move):
+            # This move cannot bring the score up to alpha; count it as such.
+            best_value = max(best_value, static_eval + FUTILITY_MARGINS[depth])
+            continue
+        child_score = material_pst_score + material_pst_delta(board, move)
+        child_key = make_move(board, move, hash_key)
+        if i == 0 or not pvs:
+            value = -negamax(board, depth - 1, -beta, -alpha, -color, child_key, child_score, ctx)
         else:
-            stored_flag = "EXACT"
-        store_transposition(hash_key, depth, max_eval, stored_flag)
-        return max_eval
-    else:
-        min_eval = float("inf")
-        stored_flag = "BETA"
-        moves = order_moves(board)
-        for move in moves:
-            board.push(move)
-            eval_ = minimax_alpha_beta(board, depth - 1, alpha, beta, True)
-            board.pop()
-            if eval_ < min_eval:
-                min_eval = eval_
-            beta = min(beta, eval_)
-            if beta <= alpha:
+            reduction = 0
+            if lmr and i >= LMR_MIN_MOVES and quiet and not board.is_check():
+                reduction = 2 if i >= 2 * LMR_MIN_MOVES and depth >= 5 else 1
+            value = -negamax(board, depth - 1 - reduction, -alpha - NULL_WINDOW, -alpha, -color,
+                             child_key, child_score, ctx)
+            if reduction and value > alpha:
+                value = -negamax(board, depth - 1, -alpha - NULL_WINDOW, -alpha, -color, child_key, child_score, ctx)
+            if alpha < value < beta:
+                value = -negamax(board, depth - 1, -beta, -alpha, -color, child_key, child_score, ctx)
+        board.pop()
+        if value > best_value:
+            best_value = value
+            best_move = move
+        if value > alpha:
+            alpha = value
+            if alpha >= beta:
+                ctx.record_cutoff(board, move, depth)
+                ctx.stats.beta_cutoffs += 1
+                if i == 0:
+                    ctx.stats.first_move_cutoffs += 1
                 break
-        if min_eval <= alpha:
-            stored_flag = "ALPHA"
-        elif min_eval >= beta:
-            stored_flag = "BETA"
-        else:
-            stored_flag = "EXACT"
-        store_transposition(hash_key, depth, min_eval, stored_flag)
-        return min_eval
 
+    if best_value <= alpha_orig:
+        stored_flag = TT_ALPHA
+    elif best_value >= beta:
+        stored_flag = TT_BETA
+    else:
+        stored_flag = TT_EXACT
+    store_transposition(hash_key, depth, best_value, stored_flag, best_move)
+    return best_value
+
+
+def minimax_alpha_beta(board, depth, alpha, beta, maximizing_player, hash_key=None, material_pst_score=None, ctx=None):
+    """Alpha-beta search returning a White-relative score like evaluate_board.
+
+    maximizing_player must be True exactly when White is to move. This is a
+    thin wrapper over negamax() that fills in the incremental state.
+    """
+    if ctx is None:
+        ctx = SearchContext()
+    if hash_key is None:
+        hash_key = compute_zobrist_hash(board)
+    if material_pst_score is None:
+        material_pst_score = material_pst_bitboard(board)
+    if maximizing_player:
+        return negamax(board, depth, alpha, beta, 1, hash_key, material_pst_score, ctx)
+    return -negamax(board, depth, -beta, -alpha, -1, hash_key, material_pst_score, ctx)
+
+
+@dataclass
+class IterationInfo:
+    """One completed iteration of iterative deepening, as passed to on_iteration."""
+    depth: int
+    move: chess.Move
+    score: float             # White-relative
+    time: float              # seconds spent on this iteration
+    elapsed: float           # seconds since the search started
+    stats: SearchStats       # counts of this iteration alone
+    branching_factor: float  # nodes of this iteration / nodes of the previous one (0.0 for the first)
+
+
+@dataclass
+class SearchResult:
+    move: chess.Move = None
+    score: float = 0.0  # White-relative, like evaluate_board
+    depth: int = 0      # deepest iteration that produced the move
+    nodes: int = 0
+    time: float = 0.0
+    stats: SearchStats = field(default_factory=SearchStats)
+    iterations: list = field(default_factory=list)  # IterationInfo per completed iteration
+
+
+def search_root(board, depth, alpha, beta, color, root_key, root_score, ctx, result):
+    """Search every root move with the window (alpha, beta), carrying alpha
+    across moves. Returns (best value, best move) from color's point of view.
 
-def get_best_move_time_limited(board, max_time=2.0):
-    analysis_board = board.copy()
-    start_time = time.time()
+    result is updated whenever a move beats alpha, so a search interrupted by
+    SearchTimeout still leaves the best move found so far at this depth.
+    """
+    pvs = ctx.options["pvs"]
+    best_value = float("-inf")
     best_move = None
-    maximizing_player = analysis_board.turn
-    depth = 1
+    for i, move in enumerate(order_moves(board, root_key, ctx)):
+        child_score = root_score + material_pst_delta(board, move)
+        child_key = make_move(board, move, root_key)
+        if i == 0 or not pvs:
+            value = -negamax(board, depth - 1, -beta, -alpha, -color, child_key, child_score, ctx)
+        else:
+            value = -negamax(board, depth - 1, -alpha - NULL_WINDOW, -alpha, -color, child_key, child_score, ctx)
+            if alpha < value < beta:
+                value = -negamax(board, depth - 1, -beta, -alpha, -color, child_key, child_score, ctx)
+        board.pop()
+        if value > best_value or best_move is None:
+            # The first move stands in even if every move loses to a mate (-inf).
+            best_value = value
+            best_move = move
+        if value > alpha:
+            alpha = value
+            result.move, result.score, result.depth = move, color * value, depth
+            if alpha >= beta:
+                break
+    return best_value, best_move
+
+
+# When set to a path, every search runs under cProfile and the statistics of
+# the latest one are written there. Off by default: it slows the search down.
+PROFILE_SEARCH = None
+
 
-    while time.time() - start_time < max_time:
-        current_best_move = None
-        current_best_eval = float("-inf") if maximizing_player else float("inf")
+def search(board, max_time=2.0, max_depth=MAX_SEARCH_DEPTH, workers=1, stop_event=None, on_iteration=None,
+           max_nodes=None, **options):
+    """Iterative deepening search bounded by max_time seconds and max_depth plies.
+
+    max_time=None searches to max_depth regardless of time. Setting
+    stop_event (a threading.Event) ends the search from another thread with
+    the result so far. on_iteration is called with an IterationInfo after
+    every completed iteration (of worker 0 in a parallel search). max_nodes
+    caps the nodes searched. Keyword options
+    override DEFAULT_SEARCH_OPTIONS. With workers > 1 the search runs as
+    Lazy SMP in that many processes (see ParallelSearch).
+
+    Returns a SearchResult with the best move of the deepest iteration,
+    including a partially finished one: the root searches the previous best
+    move first, so any move that beat it at the new depth is at least as good
+    a choice.
+    """
+    moves = list(board.legal_moves)
+    if not moves:
+        return SearchResult(score=evaluate_board(board))
+    if len(moves) == 1 and options.get("instant_forced_move", True):
+        return SearchResult(move=moves[0])
+    if workers > 1:
+        result = get_parallel_search(workers).search(board, max_time, max_depth, options, stop_event, on_iteration,
+                                                     max_nodes)
+        if result.move is None:
+            # No worker answered in time; any legal move beats none.
+            result.move = moves[0]
+        return result
+    transposition_table.new_search()
+    args = (board, TimeManager(max_time, stop_event, max_nodes), max_depth, options, 0, on_iteration)
+    if PROFILE_SEARCH:
+        import cProfile
+        profiler = cProfile.Profile()
+        result = profiler.runcall(iterative_deepening, *args)
+        profiler.dump_stats(PROFILE_SEARCH)
+        return result
+    return iterative_deepening(*args)
+
+
+def iterative_deepening(board, time_manager, max_depth, options, worker_id=0, on_iteration=None):
+    """The iterative deepening loop behind search(), on the current transposition_table.
+
+    Helper workers of a parallel search (worker_id > 0) start with slightly
+    randomised history scores and odd ones skip the first iteration, so they
+    do not all walk the tree in lockstep with worker 0.
+    """
+    ctx = SearchContext(time_manager, options)
+    # The tree is walked on a private board; moves found on it are plain chess.Moves.
+    analysis_board = NativeBoard.from_board(board) if ctx.options["native_board"] else board.copy()
+    result = SearchResult()
+    color = 1 if analysis_board.turn == chess.WHITE else -1
+    root_key = compute_zobrist_hash(analysis_board)
+    root_score = material_pst_bitboard(analysis_board)
+    if worker_id:
+        rng = random.Random(worker_id)
+        ctx.history = [rng.randrange(8) for _ in ctx.history]
+    inf = float("inf")
+    scores = []
+    depth = 1 + (worker_id & 1)
+    before = ctx.snapshot()
+
+    while depth <= max_depth:
+        iteration_start = time.monotonic()
+        # The evaluation swings strongly between odd and even depths, so the
+        # window is centred on the last score of the same parity.
+        previous = scores[-2] if len(scores) >= 2 else None
+        if ctx.options["aspiration"] and previous is not None and abs(previous) != inf:
+            window = ASPIRATION_WINDOW
+            alpha, beta = previous - window, previous + window
+        else:
+            window = inf
+            alpha, beta = -inf, inf
         try:
-            moves = order_moves(analysis_board)
-            for move in moves:
-                analysis_board.push(move)
-                eval_ = minimax_alpha_beta(analysis_board, depth - 1, float("-inf"), float("inf"), not maximizing_player)
-                analysis_board.pop()
-                if maximizing_player and eval_ > current_best_eval:
-                    current_best_eval = eval_
-                    current_best_move = move
-                elif not maximizing_player and eval_ < current_best_eval:
-                    current_best_eval = eval_
-                    current_best_move = move
-        except Exception:
+            while True:
+                value, move = search_root(analysis_board, depth, alpha, beta, color, root_key, root_score, ctx, result)
+                # A fail against a finite bound means the window was too narrow.
+                if value <= alpha != -inf:
+                    window *= ASPIRATION_GROWTH
+                    alpha = previous - window if window < 1000 * ASPIRATION_WINDOW else -inf
+                elif value >= beta != inf:
+                    window *= ASPIRATION_GROWTH
+                    beta = previous + window if window < 1000 * ASPIRATION_WINDOW else inf
+                else:
+                    break
+        except SearchTimeout:
             break
 
-        if current_best_move is not None:
-            best_move = current_best_move
+        scores.append(value)
+        result.move, result.score, result.depth = move, color * value, depth
+        # Seed the next iteration's ordering with this iteration's choice.
+        store_transposition(root_key, depth, value, TT_EXACT, move)
 
+        iteration_time = time.monotonic() - iteration_start
+        time_manager.iteration_done(iteration_time)
+        now = ctx.snapshot()
+        stats = now.since(before)
+        previous_nodes = result.iterations[-1].stats.nodes if result.iterations else 0
+        info = IterationInfo(depth, move, result.score, iteration_time, time_manager.elapsed(), stats,
+                             stats.nodes / previous_nodes if previous_nodes else 0.0)
+        result.iterations.append(info)
+        before = now
+        if on_iteration is not None:
+            on_iteration(info)
+        if abs(value) == inf or not time_manager.can_start_iteration():
+            # Mates are scored +/-inf regardless of distance, so deeper iterations cannot improve on one.
+            break
         depth += 1
-        if time.time() - start_time >= max_time:
+
+    result.nodes = ctx.nodes
+    result.stats = ctx.snapshot()
+    result.time = time_manager.elapsed()
+    return result
+
+
+# Extra seconds a parallel search waits for its workers past max_time
+# before stopping them, and how long stopped workers get to report back.
+PARALLEL_TIMEOUT_GRACE = 10.0
+PARALLEL_STOP_GRACE = 1.0
+# How often the parent checks its stop event while waiting for results.
+PARALLEL_POLL_INTERVAL = 0.05
+
+
+class ParallelSearch:
+    """Lazy SMP: worker processes run iterative deepening on the same position
+    and share one transposition table placed in multiprocessing.shared_memory.
+
+    The workers only communicate through the table, which needs no locks:
+    every entry carries a check word (key ^ data ^ value), so a torn write
+    by another process reads as a miss. Each worker returns its own
+    SearchResult and the deepest one wins. The processes are long-lived and
+    reused for every search; close() shuts them down.
+
+    Every search gets an id, and a shared value holds the id of the search
+    the workers should be running. Workers poll it like a stop event, so
+    clearing it stops them, and results of any earlier search that arrive
+    late are discarded.
+    """
+
+    def __init__(self, workers, size_mb=TT_SIZE_MB):
+        mp = multiprocessing.get_context()
+        size = TranspositionTable.buffer_size(size_mb)
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self.table = TranspositionTable(buffer=self._shm.buf[:size])
+        self.table.clear()
+        self._results = mp.Queue()
+        self._current = mp.Value("q", 0, lock=False)
+        self._ids = itertools.count(1)
+        self._tasks = []
+        self._processes = []
+        for worker_id in range(workers):
+            tasks = mp.Queue()
+            process = mp.Process(target=_parallel_worker, daemon=True,
+                                 args=(worker_id, self._shm.name, size, tasks, self._results, self._current))
+            process.start()
+            self._tasks.append(tasks)
+            self._processes.append(process)
+
+    def search(self, board, max_time, max_depth, options, stop_event=None, on_iteration=None, max_nodes=None):
+        """Search board on all workers; the arguments are those of search().
+
+        max_nodes is shared out evenly among the workers, and on_iteration
+        gets the iterations of worker 0. If the workers have not all
+        answered PARALLEL_TIMEOUT_GRACE seconds past max_time, or once
+        stop_event is set, they are stopped and the results that arrived
+        within PARALLEL_STOP_GRACE are used; with none, the result has no move.
+        """
+        self.table.new_search()
+        search_id = next(self._ids)
+        self._current.value = search_id
+        worker_nodes = None if max_nodes is None else max(1, max_nodes // len(self._processes))
+        for tasks in self._tasks:
+            tasks.put((search_id, board, max_time, max_depth, options, self.table.generation, worker_nodes,
+                       on_iteration is not None))
+        deadline = None if max_time is None else time.monotonic() + max_time + PARALLEL_TIMEOUT_GRACE
+        stopped = False
+        results = {}
+        while len(results) < len(self._processes):
+            now = time.monotonic()
+            if stopped:
+                if now >= deadline:
+                    break
+            elif (stop_event is not None and stop_event.is_set()) or (deadline is not None and now >= deadline):
+                self._current.value = 0
+                stopped = True
+                deadline = now + PARALLEL_STOP_GRACE
+            try:
+                message_id, worker_id, kind, payload = self._results.get(timeout=PARALLEL_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if message_id != search_id:
+                continue
+            if kind == "iteration":
+                on_iteration(payload)
+            else:
+                results[worker_id] = payload
+        # Workers still running (stalled or stopped late) drop this search.
+        self._current.value = 0
+        if not results:
+            return SearchResult()
+        # Deepest result wins; on ties prefer the lower worker id (worker 0 is the main line).
+        best_id = max(results, key=lambda worker_id: (results[worker_id].depth, -worker_id))
+        best = results[best_id]
+        found = list(results.values())
+        return SearchResult(move=best.move, score=best.score, depth=best.depth,
+                            nodes=sum(r.nodes for r in found), time=max(r.time for r in found),
+                            stats=SearchStats.total([r.stats for r in found]), iterations=best.iterations)
+
+    def close(self):
+        self._current.value = 0
+        for tasks in self._tasks:
+            tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+        self.table.release()
+        self._shm.close()
+        self._shm.unlink()
+
+
+class _CurrentSearch:
+    """Stop event of a parallel worker: set once its search is no longer the current one."""
+
+    def __init__(self, current, search_id):
+        self.current = current
+        self.search_id = search_id
+
+    def is_set(self):
+        return self.current.value != self.search_id
+
+
+def _parallel_worker(worker_id, shm_name, size, tasks, results, current):
+    global transposition_table
+    shm = shared_memory.SharedMemory(name=shm_name)
+    transposition_table = TranspositionTable(buffer=shm.buf[:size])
+    while True:
+        task = tasks.get()
+        if task is None:
             break
+        search_id, board, max_time, max_depth, options, generation, max_nodes, report_iterations = task
+        if current.value != search_id:
+            # Queued behind a search that was given up on; nobody waits for it.
+            continue
+        transposition_table.generation = generation
+        on_iteration = None
+        if report_iterations and worker_id == 0:
+            def on_iteration(info):
+                results.put((search_id, worker_id, "iteration", info))
+        time_manager = TimeManager(max_time, _CurrentSearch(current, search_id), max_nodes)
+        result = iterative_deepening(board, time_manager, max_depth, options, worker_id, on_iteration)
+        results.put((search_id, worker_id, "result", result))
+    transposition_table.release()
+    shm.close()
+
+
+_parallel_searches = {}
+
+
+def get_parallel_search(workers):
+    """Shared ParallelSearch with this many workers, started on first use."""
+    if workers not in _parallel_searches:
+        _parallel_searches[workers] = ParallelSearch(workers)
+    return _parallel_searches[workers]
+
+
+@atexit.register
+def close_parallel_searches():
+    while _parallel_searches:
+        _parallel_searches.popitem()[1].close()
+
+
+class PonderSearch:
+    """Background search on the opponent's time.
+
+    Started with the opponent to move, it searches the position after the
+    reply the last search expects (the best move stored in the transposition
+    table), or, without a prediction, the opponent's own position so that
+    the table is warm for every reply. best_move() then either reuses the
+    ponder result on a hit or searches normally on the warmed table.
+
+    By default the search runs on its own thread. With background=False the
+    caller runs it with run(), which blocks until stop_event is set.
+    """
+
+    def __init__(self, board, stop_event=None, background=True):
+        self.position = board.copy()
+        self.move = transposition_table.probe_move(compute_zobrist_hash(board))
+        if self.move is not None and self.move in board.legal_moves:
+            self.position.push(self.move)
+        else:
+            self.move = None
+        self.result = None
+        self.stop_event = stop_event or threading.Event()
+        self.start = time.monotonic()
+        self.thread = None
+        if background:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def run(self):
+        self.result = search(self.position, max_time=None, stop_event=self.stop_event)
+
+    def stop(self):
+        """Stop pondering and wait for the search thread; returns the seconds pondered."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        return time.monotonic() - self.start
+
+    def hit(self, board):
+        """True if board is the position that was pondered on."""
+        return self.move is not None and board.fen() == self.position.fen()
+
+    def best_move(self, board, max_time=2.0, **options):
+        """Move for board (the opponent has moved), within max_time seconds.
+
+        On a hit the time already spent pondering counts toward max_time, so
+        the pondered best move is returned at once when pondering ran that long.
+        """
+        elapsed = self.stop()
+        if self.hit(board) and self.result is not None and self.result.move is not None:
+            if elapsed >= max_time:
+                return self.result.move
+            return get_best_move_time_limited(board, max_time - elapsed, **options)
+        return get_best_move_time_limited(board, max_time, **options)
+
+
+# Directory of KPK/KRK/KQK bitbases probed during the search; generated with bitbase.py.
+BITBASE_DIR = "bitbases"
+_bitbases = None
+_bitbases_loaded = False
+
+
+def set_bitbase_dir(directory):
+    """Probe the bitbases in directory from now on (None disables them)."""
+    global _bitbases, _bitbases_loaded
+    _bitbases = open_bitbases(directory)
+    _bitbases_loaded = True
+
+
+def get_bitbases():
+    """The bitbases, loaded from BITBASE_DIR on first use; None if there are none."""
+    if not _bitbases_loaded:
+        set_bitbase_dir(BITBASE_DIR)
+    return _bitbases
+
+
+# Polyglot opening book consulted before searching; built with book.py.
+BOOK_PATH = "book.bin"
+_opening_book = None
+_opening_book_loaded = False
+
+
+def set_opening_book(path):
+    """Use the book at path (None disables the book)."""
+    global _opening_book, _opening_book_loaded
+    if _opening_book is not None:
+        _opening_book.close()
+    _opening_book = open_book(path)
+    _opening_book_loaded = True
+
+
+def get_opening_book():
+    """The opening book, opened from BOOK_PATH on first use; None if there is none."""
+    if not _opening_book_loaded:
+        set_opening_book(BOOK_PATH)
+    return _opening_book
+
+
+def get_best_move_time_limited(board, max_time=2.0, workers=1, use_book=True, **options):
+    """Book move if there is one, else the best move found by search() within max_time seconds.
 
-    return best_move
+    Returns None if there are no legal moves.
+    """
+    book = get_opening_book() if use_book else None
+    if book is not None:
+        move = book.probe(board)
+        if move is not None:
+            return move
+    return search(board, max_time, workers=workers, **options).move
@@ -0,0 +1,214 @@
+"""Batch position analysis.
+
+    python batch.py positions.epd -o results.jsonl --time 1.0 --workers 8
+
+Streams positions from a FEN, EPD or PGN file, analyses them on a pool of
+worker processes and writes one JSON object per position to the output
+(best move, score, depth, nodes, time). Each worker keeps its own
+transposition table warm across the positions it is given. Results are
+written in input order by default, or as they complete with
+--order completion.
+
+The output doubles as the checkpoint: with --resume, positions whose index
+already appears in the output file are skipped and new results are appended;
+a line cut off by an interrupted run is dropped first.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import chess
+import chess.pgn
+
+import ai
+
+
+def read_positions(path, fmt=None):
+    """Yield (index, record) for every position in a FEN, EPD or PGN file.
+
+    record holds the FEN plus whatever identifies the position in its source
+    (EPD id operation, PGN game number and ply). PGN files yield every
+    position of every game, before each move is played.
+    """
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    index = 0
+    with open(path) as f:
+        if fmt == "pgn":
+            game_number = 0
+            while True:
+                game = chess.pgn.read_game(f)
+                if game is None:
+                    break
+                board = game.board()
+                for ply, move in enumerate(game.mainline_moves()):
+                    yield index, {"fen": board.fen(), "game": game_number, "ply": ply}
+                    index += 1
+                    board.push(move)
+                game_number += 1
+        elif fmt in ("fen", "epd"):
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if fmt == "epd":
+                    board, ops = chess.Board.from_epd(line)
+                    record = {"fen": board.fen()}
+                    if "id" in ops:
+                        record["id"] = ops["id"]
+                else:
+                    record = {"fen": chess.Board(line).fen()}
+                yield index, record
+                index += 1
+        else:
+            raise ValueError(f"unknown position format {fmt!r} (expected fen, epd or pgn)")
+
+
+def completed_indices(path):
+    """Indices already present in an output file (for --resume)."""
+    done = set()
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["index"])
+                except (ValueError, KeyError):
+                    # A line cut short by an interrupted run; it will be redone.
+                    continue
+    return done
+
+
+def drop_partial_line(path):
+    """Cut a line left unfinished by an interrupted run off the end of path.
+
+    Without this, the first record appended on --resume would be glued onto
+    it. Returns the number of bytes removed.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb+") as f:
+        size = end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - 4096)
+            f.seek(start)
+            block = f.read(end - start)
+            newline = block.rfind(b"\n")
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        f.truncate(end)
+    return size - end
+
+
+_worker_settings = {}
+
+
+def _init_worker(max_time, max_depth, tt_size_mb, options):
+    _worker_settings.update(max_time=max_time, max_depth=max_depth, options=options)
+    ai.resize_transposition_table(tt_size_mb)
+
+
+def score_fields(score):
+    """The "score" and "mate" fields of a JSON record for a White-relative search score.
+
+    JSON has no infinity, so a mate is reported as who is mating: score
+    None and mate 1 (White) or -1 (Black); otherwise mate is 0.
+    """
+    if math.isinf(score):
+        return {"score": None, "mate": 1 if score > 0 else -1}
+    return {"score": round(score, 2), "mate": 0}
+
+
+def analyse(index, record):
+    """Search one position in a worker; returns the JSON-ready result record."""
+    board = chess.Board(record["fen"])
+    # Forced moves are searched too, so their records carry a real score.
+    result = ai.search(board, _worker_settings["max_time"], _worker_settings["max_depth"],
+                       **{"instant_forced_move": False, **_worker_settings["options"]})
+    output = {"index": index, **record, "move": result.move.uci() if result.move else None,
+              **score_fields(result.score)}
+    output.update(depth=result.depth, nodes=result.nodes, time=round(result.time, 4))
+    return output
+
+
+def analyse_file(path, out, fmt=None, max_time=1.0, max_depth=ai.MAX_SEARCH_DEPTH, workers=None,
+                 ordered=True, skip=(), tt_size_mb=ai.TT_SIZE_MB, options=None):
+    """Analyse every position of path not in skip and write JSON lines to out.
+
+    At most a few tasks per worker are in flight, so arbitrarily large
+    inputs are streamed rather than loaded. Returns the number of positions
+    analysed.
+    """
+    workers = workers or os.cpu_count() or 1
+    window = 4 * workers
+    count = 0
+
+    def emit(future):
+        nonlocal count
+        out.write(json.dumps(future.result()) + "\n")
+        out.flush()
+        count += 1
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(max_time, max_depth, tt_size_mb, options or {})) as executor:
+        in_flight = deque()
+        for index, record in read_positions(path, fmt):
+            if index in skip:
+                continue
+            if len(in_flight) >= window:
+                if ordered:
+                    emit(in_flight.popleft())
+                else:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        in_flight.remove(future)
+                        emit(future)
+            in_flight.append(executor.submit(analyse, index, record))
+        if ordered:
+            while in_flight:
+                emit(in_flight.popleft())
+        else:
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_flight.remove(future)
+                    emit(future)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="FEN, EPD or PGN file")
+    parser.add_argument("-o", "--output", help="JSONL output file (default: stdout)")
+    parser.add_argument("--format", choices=["fen", "epd", "pgn"], help="input format (default: from extension)")
+    parser.add_argument("--time", type=float, default=1.0, help="seconds per position (0 = no limit)")
+    parser.add_argument("--depth", type=int, default=ai.MAX_SEARCH_DEPTH, help="maximum depth per position")
+    parser.add_argument("--workers", type=int, help="worker processes (default: all cores)")
+    parser.add_argument("--order", choices=["input", "completion"], default="input")
+    parser.add_argument("--resume", action="store_true", help="skip positions already in the output file")
+    parser.add_argument("--tt-mb", type=int, default=ai.TT_SIZE_MB, help="transposition table size per worker")
+    parser.add_argument("--options", default="", help="search option overrides, e.g. lmr=0,null_move=0")
+    args = parser.parse_args(argv)
+
+    if args.resume and not args.output:
+        parser.error("--resume needs --output")
+    if args.resume:
+        drop_partial_line(args.output)
+    skip = completed_indices(args.output) if args.resume else set()
+    out = open(args.output, "a" if args.resume else "w") if args.output else sys.stdout
+    try:
+        count = analyse_file(args.input, out, args.format, args.time or None, args.depth, args.workers,
+                             args.order == "input", skip, args.tt_mb, ai.parse_search_options(args.options))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"analysed {count} positions ({len(skip)} skipped from checkpoint)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
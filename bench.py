@@ -0,0 +1,275 @@
+"""Engine benchmarks.
+
+    python bench.py eval [--positions N] [--epd FILE] [--repeat R]
+
+compares the static evaluation backends on the same positions, checks that
+they agree exactly and reports the time per position for each.
+
+    python bench.py search [--depth D] [--config pvs=0,aspiration=0 ...]
+
+searches BENCH_FENS to a fixed depth once per configuration (search option
+overrides, the empty config being the defaults) and compares node counts,
+time to depth and nodes per second. Time to depth is taken from every
+completed iteration, per position and summed over the positions.
+
+    python bench.py perft [--depth D] [--check]
+
+counts leaf nodes of PERFT_POSITIONS through ai.make_move and compares them
+with the published counts; --check also verifies the incremental hash and
+material/PST score against a full recompute at every node.
+
+perft and search take --json FILE to write a machine-readable report and
+--baseline FILE to compare against an earlier one: node count changes and
+speed drops beyond --tolerance are reported and the exit status is 1.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+import chess
+
+import ai
+from batch import score_fields
+from evaluation import EVALUATORS, evaluate_batch, material_pst, material_pst_delta
+
+# Fixed positions for search benchmarks: openings, middlegames and endgames.
+BENCH_FENS = [
+    chess.STARTING_FEN,
+    "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r1bq1rk1/pp2ppbp/2np1np1/8/3NP3/2N1BP2/PPPQ2PP/R3KB1R w KQ - 3 9",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+    "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1",
+]
+
+# Standard perft positions with their known leaf counts by depth.
+PERFT_POSITIONS = [
+    (chess.STARTING_FEN, [20, 400, 8902, 197281, 4865609]),
+    ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862, 4085603]),
+    ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624]),
+    ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467, 422333]),
+    ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487]),
+]
+
+
+def perft(board, depth, hash_key=None, score=None, check=False):
+    """Number of leaf nodes depth plies below board, made and unmade the way the search does it."""
+    if hash_key is None:
+        hash_key = ai.compute_zobrist_hash(board)
+        score = material_pst(board)
+    if check:
+        assert hash_key == ai.compute_zobrist_hash(board), board.fen()
+        assert score == material_pst(board), board.fen()
+    if depth == 0:
+        return 1
+    if depth == 1 and not check:
+        return board.legal_moves.count()
+    nodes = 0
+    for move in board.legal_moves:
+        child_score = score + material_pst_delta(board, move)
+        child_key = ai.make_move(board, move, hash_key)
+        nodes += perft(board, depth - 1, child_key, child_score, check)
+        board.pop()
+    return nodes
+
+
+def bench_perft(depth, check=False):
+    """Run perft on PERFT_POSITIONS up to depth; returns the report dict."""
+    positions = []
+    for fen, counts in PERFT_POSITIONS:
+        d = min(depth, len(counts))
+        start = time.perf_counter()
+        nodes = perft(chess.Board(fen), d, check=check)
+        seconds = time.perf_counter() - start
+        positions.append({"fen": fen, "depth": d, "nodes": nodes, "expected": counts[d - 1],
+                          "time": seconds, "nps": nodes / seconds})
+    return {"kind": "perft", "positions": positions}
+
+
+def random_positions(count, seed=0, max_plies=120):
+    """Positions reached by seeded random playouts from the start position."""
+    rng = random.Random(seed)
+    boards = []
+    while len(boards) < count:
+        board = chess.Board()
+        for _ in range(rng.randrange(max_plies)):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+        boards.append(board)
+    return boards
+
+
+def load_epd(path):
+    boards = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                board, _ = chess.Board.from_epd(line)
+                boards.append(board)
+    return boards
+
+
+def bench_eval(boards, repeat=3):
+    """Time every evaluation backend over boards; returns {name: seconds per position}."""
+    reference = [EVALUATORS["squares"](board) for board in boards]
+    results = {}
+    for name, evaluate in EVALUATORS.items():
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            scores = [evaluate(board) for board in boards]
+            best = min(best, time.perf_counter() - start)
+        if scores != reference:
+            raise AssertionError(f"{name} evaluator disagrees with the reference scores")
+        results[name] = best / len(boards)
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        scores = evaluate_batch(boards)
+        best = min(best, time.perf_counter() - start)
+    if list(scores) != reference:
+        raise AssertionError("batch evaluator disagrees with the reference scores")
+    results["batch"] = best / len(boards)
+    return results
+
+
+def bench_search(fens, depth, options):
+    """Fixed-depth search of every position with cleared tables; returns per-position results."""
+    results = []
+    for fen in fens:
+        ai.clear_transposition_table()
+        ai.clear_evaluation_caches()
+        results.append(ai.search(chess.Board(fen), max_time=None, max_depth=depth, **options))
+    return results
+
+
+def search_report(fens, depth, configs):
+    """bench_search once per configuration text; returns the report dict."""
+    runs = []
+    for text in configs:
+        results = bench_search(fens, depth, ai.parse_search_options(text))
+        nodes = sum(r.nodes for r in results)
+        seconds = sum(r.time for r in results)
+        stats = ai.SearchStats.total([r.stats for r in results])
+        time_to_depth = {}
+        for r in results:
+            for info in r.iterations:
+                reached = time_to_depth.setdefault(info.depth, {"depth": info.depth, "time": 0.0, "positions": 0})
+                reached["time"] += info.elapsed
+                reached["positions"] += 1
+        runs.append({
+            "config": text, "depth": depth, "nodes": nodes, "time": seconds, "nps": nodes / seconds,
+            "eval_hit_rate": stats.eval_hit_rate, "pawn_hit_rate": stats.pawn_hit_rate,
+            "time_to_depth": [time_to_depth[d] for d in sorted(time_to_depth)],
+            "positions": [{"fen": fen, "move": r.move.uci() if r.move else None, **score_fields(r.score),
+                           "nodes": r.nodes, "time": r.time,
+                           "iterations": [{"depth": info.depth, "time": info.elapsed} for info in r.iterations]}
+                          for fen, r in zip(fens, results)],
+        })
+    return {"kind": "search", "runs": runs}
+
+
+def compare_reports(baseline, current, tolerance=0.1):
+    """Differences of current against a baseline report of the same kind, as messages.
+
+    Node counts must match exactly (any change means the tree changed);
+    nodes per second may drop by at most tolerance.
+    """
+    if baseline.get("kind") != current["kind"]:
+        return [f"baseline is a {baseline.get('kind')} report, not {current['kind']}"]
+    problems = []
+    if current["kind"] == "perft":
+        old = {(p["fen"], p["depth"]): p for p in baseline["positions"]}
+        entries = [(f"{p['fen']} depth {p['depth']}", old.get((p["fen"], p["depth"])), p)
+                   for p in current["positions"]]
+    else:
+        old = {(r["config"], r["depth"]): r for r in baseline["runs"]}
+        entries = [(f"[{r['config'] or 'defaults'}] depth {r['depth']}", old.get((r["config"], r["depth"])), r)
+                   for r in current["runs"]]
+    for name, before, after in entries:
+        if before is None:
+            continue
+        if before["nodes"] != after["nodes"]:
+            problems.append(f"{name}: nodes {before['nodes']} -> {after['nodes']}")
+        if after["nps"] < before["nps"] * (1 - tolerance):
+            problems.append(f"{name}: nps {before['nps']:.0f} -> {after['nps']:.0f} "
+                            f"({after['nps'] / before['nps'] - 1:+.0%})")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_eval = sub.add_parser("eval", help="compare static evaluation backends")
+    p_eval.add_argument("--positions", type=int, default=2000, help="random positions to generate")
+    p_eval.add_argument("--epd", help="read positions from an EPD file instead")
+    p_eval.add_argument("--seed", type=int, default=0)
+    p_eval.add_argument("--repeat", type=int, default=3, help="take the best of this many runs")
+
+    p_search = sub.add_parser("search", help="compare node counts of search configurations at fixed depth")
+    p_search.add_argument("--depth", type=int, default=4)
+    p_search.add_argument("--config", action="append",
+                          help="comma-separated option overrides, e.g. pvs=0,aspiration=0 (repeatable; '' = defaults)")
+
+    p_perft = sub.add_parser("perft", help="count move generation leaf nodes against known values")
+    p_perft.add_argument("--depth", type=int, default=3)
+    p_perft.add_argument("--check", action="store_true", help="verify incremental hash and score at every node")
+
+    for p in (p_search, p_perft):
+        p.add_argument("--json", help="write the report to this file")
+        p.add_argument("--baseline", help="compare against a report written with --json")
+        p.add_argument("--tolerance", type=float, default=0.1, help="allowed nodes-per-second drop (fraction)")
+
+    args = parser.parse_args(argv)
+    if args.command == "eval":
+        boards = load_epd(args.epd) if args.epd else random_positions(args.positions, args.seed)
+        results = bench_eval(boards, args.repeat)
+        baseline = results["squares"]
+        print(f"{len(boards)} positions, all backends agree")
+        for name, seconds in results.items():
+            print(f"{name:>10}: {seconds * 1e6:8.1f} us/position  ({baseline / seconds:4.2f}x)")
+        return 0
+
+    if args.command == "search":
+        configs = args.config if args.config is not None else ["pvs=0,aspiration=0", ""]
+        report = search_report(BENCH_FENS, args.depth, configs)
+        first = report["runs"][0]["nodes"]
+        for run in report["runs"]:
+            print(f"[{run['config'] or 'defaults'}] depth {run['depth']}: {run['nodes']} nodes "
+                  f"({run['nodes'] / first:.2f}x), {run['time']:.2f}s, {run['nps']:.0f} nps, "
+                  f"eval cache {run['eval_hit_rate']:.0%}, pawn hash {run['pawn_hit_rate']:.0%}")
+            print("    time to depth: " + "  ".join(f"{d['depth']}: {d['time']:.2f}s" for d in run["time_to_depth"]))
+            for p in run["positions"]:
+                score = f"{p['score']:9.1f}" if p["mate"] == 0 else f"{'mate' if p['mate'] > 0 else '-mate':>9}"
+                print(f"    {p['nodes']:8d}  {p['time']:6.2f}s  {p['move']}  {score}  {p['fen']}")
+        failed = False
+    else:
+        report = bench_perft(args.depth, args.check)
+        failed = False
+        for p in report["positions"]:
+            ok = p["nodes"] == p["expected"]
+            failed |= not ok
+            print(f"{'ok  ' if ok else 'FAIL'} depth {p['depth']}: {p['nodes']:9d} nodes "
+                  f"(expected {p['expected']}), {p['nps']:.0f} nps  {p['fen']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=1, allow_nan=False)
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare_reports(json.load(f), report, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        failed |= bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
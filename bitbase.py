@@ -0,0 +1,229 @@
+"""Win/draw bitbases for king and one piece against a bare king.
+
+    python bitbase.py [--dir bitbases]
+
+generates KPK, KRK and KQK by retrograde analysis and writes one bit per
+position to <dir>/k?k.bin. The side with the extra piece is stored as White;
+positions with Black holding the piece are probed through the mirrored board.
+With a single extra piece the weaker side can never win, so a set bit means
+"White wins" and a clear bit a draw (or an illegal position).
+
+Positions are indexed as side_to_move * 64**3 + wk * 64**2 + bk * 64 + piece
+(side_to_move 0 = White), so every table is 64 KiB and a probe is one byte
+lookup. Generation needs NumPy; probing does not.
+"""
+import argparse
+import os
+import sys
+
+import chess
+
+PIECE_SYMBOLS = {chess.PAWN: "p", chess.ROOK: "r", chess.QUEEN: "q"}
+
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+
+def table_path(directory, piece_type):
+    return os.path.join(directory, f"k{PIECE_SYMBOLS[piece_type]}k.bin")
+
+
+def position_index(white_to_move, wk, bk, square):
+    return (0 if white_to_move else 1) << 18 | wk << 12 | bk << 6 | square
+
+
+def _attack_table(np, piece_type):
+    """attacks[wk, p, t]: the white piece on p attacks t, with only the white king blocking."""
+    attacks = np.zeros((64, 64, 64), dtype=bool)
+    for wk in range(64):
+        occupied = chess.BB_SQUARES[wk]
+        for p in range(64):
+            if p == wk:
+                continue
+            if piece_type == chess.PAWN:
+                bb = chess.BB_PAWN_ATTACKS[chess.WHITE][p]
+            else:
+                bb = (chess.BB_RANK_ATTACKS[p][chess.BB_RANK_MASKS[p] & occupied]
+                      | chess.BB_FILE_ATTACKS[p][chess.BB_FILE_MASKS[p] & occupied])
+                if piece_type == chess.QUEEN:
+                    bb |= chess.BB_DIAG_ATTACKS[p][chess.BB_DIAG_MASKS[p] & occupied]
+            attacks[wk, p] = [bool(bb & chess.BB_SQUARES[t]) for t in range(64)]
+    return attacks
+
+
+def _rays(piece_type):
+    """Squares the piece slides over from each square, as lists per direction."""
+    deltas = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+    if piece_type == chess.QUEEN:
+        deltas += [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+    rays = []
+    for p in range(64):
+        rays.append([])
+        for df, dr in deltas:
+            f, r = chess.square_file(p) + df, chess.square_rank(p) + dr
+            ray = []
+            while 0 <= f < 8 and 0 <= r < 8:
+                ray.append(chess.square(f, r))
+                f, r = f + df, r + dr
+            rays[p].append(ray)
+    return rays
+
+
+def generate(piece_type, promotions=None):
+    """Generate the table for piece_type; returns (white_wins, black_wins) as [wk, bk, p] bool arrays.
+
+    promotions maps QUEEN/ROOK to already generated tables and is required for
+    KPK, where a promoted pawn continues as KQK or KRK with Black to move.
+    """
+    import numpy as np
+
+    squares = np.arange(64)
+    files, ranks = squares % 8, squares // 8
+    # near[a, b]: kings on a and b would touch (or coincide)
+    near = (np.abs(files[:, None] - files[None, :]) <= 1) & (np.abs(ranks[:, None] - ranks[None, :]) <= 1)
+    king_moves = [[t for t in range(64) if near[k, t] and t != k] for k in range(64)]
+    wk_axis = squares[:, None, None]
+    bk_axis = squares[None, :, None]
+    p_axis = squares[None, None, :]
+
+    attacks = _attack_table(np, piece_type)
+    valid = ~near[:, :, None] & (p_axis != wk_axis) & (p_axis != bk_axis)
+    if piece_type == chess.PAWN:
+        valid &= (p_axis >= 8) & (p_axis < 56)
+    # check[wk, bk, p]: Black's king is attacked
+    check = attacks.transpose(0, 2, 1)
+    valid_white = valid & ~check
+
+    # Static legality of every black king move, per (bk, t): arrays over (wk, p).
+    black_moves = []
+    for bk in range(64):
+        moves = []
+        for t in king_moves[bk]:
+            legal = ~near[:, t][:, None] & ~attacks[:, :, t]
+            moves.append((t, legal, legal & (squares[None, :] != t)))
+        black_moves.append(moves)
+    has_move = np.zeros((64, 64, 64), dtype=bool)
+    for bk in range(64):
+        for _, legal, _ in black_moves[bk]:
+            has_move[:, bk, :] |= legal
+    mated = valid & check & ~has_move
+
+    rays = None if piece_type == chess.PAWN else _rays(piece_type)
+    if piece_type == chess.PAWN:
+        promoted = promotions[chess.QUEEN][1] | promotions[chess.ROOK][1]
+
+    white_wins = np.zeros((64, 64, 64), dtype=bool)
+    black_wins = mated.copy()
+    while True:
+        # White to move: some move reaches a position Black loses.
+        new_white = np.zeros_like(white_wins)
+        for wk in range(64):
+            for t in king_moves[wk]:
+                # King steps to t: must not touch Black's king or land on its own piece.
+                new_white[wk] |= ~near[t][:, None] & (p_axis[0] != t) & black_wins[t]
+        if piece_type == chess.PAWN:
+            for p in range(8, 56):
+                q = p + 8
+                free = (squares[:, None] != q) & (squares[None, :] != q)
+                target = promoted[:, :, q] if q >= 56 else black_wins[:, :, q]
+                new_white[:, :, p] |= free & target
+                if p < 16:
+                    q2 = p + 16
+                    new_white[:, :, p] |= (free & (squares[:, None] != q2) & (squares[None, :] != q2)
+                                           & black_wins[:, :, q2])
+        else:
+            for p in range(64):
+                for ray in rays[p]:
+                    open_ = np.ones((64, 64), dtype=bool)
+                    for q in ray:
+                        open_ &= (squares[:, None] != q) & (squares[None, :] != q)
+                        new_white[:, :, p] |= open_ & black_wins[:, :, q]
+        new_white &= valid_white
+
+        # Black to move: checkmated, or every legal move reaches a position White wins.
+        new_black = has_move.copy()
+        for bk in range(64):
+            for t, legal, quiet in black_moves[bk]:
+                # Capturing the piece (t == p) draws, so it never counts as a loss.
+                new_black[:, bk, :] &= ~legal | (quiet & new_white[:, t, :])
+        new_black = (new_black & valid) | mated
+
+        if (new_white == white_wins).all() and (new_black == black_wins).all():
+            return white_wins, black_wins
+        white_wins, black_wins = new_white, new_black
+
+
+def pack(tables):
+    """Bit-pack (white_wins, black_wins) in position_index order."""
+    import numpy as np
+    white_wins, black_wins = tables
+    return np.packbits(np.concatenate([white_wins.ravel(), black_wins.ravel()]), bitorder="little").tobytes()
+
+
+def generate_all(directory):
+    """Generate and write every table to directory; returns {piece_type: path}."""
+    os.makedirs(directory, exist_ok=True)
+    tables = {}
+    paths = {}
+    for piece_type in (chess.QUEEN, chess.ROOK, chess.PAWN):
+        tables[piece_type] = generate(piece_type, tables)
+        paths[piece_type] = table_path(directory, piece_type)
+        with open(paths[piece_type], "wb") as f:
+            f.write(pack(tables[piece_type]))
+    return paths
+
+
+class Bitbases:
+    """The tables found in a directory, probed with probe()."""
+
+    def __init__(self, directory):
+        self.tables = {}
+        for piece_type in PIECE_SYMBOLS:
+            path = table_path(directory, piece_type)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    self.tables[piece_type] = f.read()
+
+    def __bool__(self):
+        return bool(self.tables)
+
+    def probe(self, board):
+        """WIN, DRAW or LOSS for the side to move, or None if no table covers board."""
+        occupied = board.occupied
+        if chess.popcount(occupied) != 3 or board.castling_rights:
+            return None
+        square = chess.lsb(occupied & ~board.kings)
+        table = self.tables.get(board.piece_type_at(square))
+        if table is None:
+            return None
+        if board.occupied_co[chess.WHITE] & chess.BB_SQUARES[square]:
+            white_to_move = board.turn == chess.WHITE
+            index = position_index(white_to_move, board.king(chess.WHITE), board.king(chess.BLACK), square)
+        else:
+            white_to_move = board.turn == chess.BLACK
+            index = position_index(white_to_move, chess.square_mirror(board.king(chess.BLACK)),
+                                   chess.square_mirror(board.king(chess.WHITE)), chess.square_mirror(square))
+        if not table[index >> 3] >> (index & 7) & 1:
+            return DRAW
+        return WIN if white_to_move else LOSS
+
+
+def open_bitbases(directory):
+    """Bitbases for directory, or None if it holds no tables."""
+    if not directory or not os.path.isdir(directory):
+        return None
+    return Bitbases(directory) or None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default="bitbases", help="output directory")
+    args = parser.parse_args(argv)
+    for piece_type, path in generate_all(args.dir).items():
+        print(f"wrote {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
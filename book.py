@@ -0,0 +1,115 @@
+"""Opening book in the Polyglot format.
+
+    python book.py games1.pgn games2.pgn -o book.bin [--max-ply 24]
+
+builds a book from local PGN files. A Polyglot book is a file of 16-byte
+entries (key, move, weight, learn) sorted by the Polyglot Zobrist key of the
+position, so lookups are a binary search over the memory-mapped file and
+nothing is loaded into Python objects up front. Books built elsewhere in the
+same format work as well.
+"""
+import argparse
+import os
+import struct
+import sys
+from collections import defaultdict
+
+import chess
+import chess.pgn
+import chess.polyglot
+
+ENTRY = struct.Struct(">QHHI")
+MAX_WEIGHT = 0xFFFF
+
+# Points for the side that played the move, by game result
+RESULT_POINTS = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1)}
+
+
+def encode_move(board, move):
+    """Polyglot move encoding. Castling is written as the king taking its own rook."""
+    to_square = move.to_square
+    if board.is_castling(move):
+        rook_file = 7 if chess.square_file(to_square) > chess.square_file(move.from_square) else 0
+        to_square = chess.square(rook_file, chess.square_rank(move.from_square))
+    promotion = move.promotion - 1 if move.promotion else 0
+    return to_square | (move.from_square << 6) | (promotion << 12)
+
+
+def build_book(pgn_paths, out_path, max_ply=24, min_games=1):
+    """Write a book of the moves played in the first max_ply plies of the games.
+
+    Each move is weighted by the points it scored for the side that played it
+    (2 per win, 1 per draw); moves seen in fewer than min_games games or that
+    never scored are left out. Returns the number of entries written.
+    """
+    points = defaultdict(int)
+    games = defaultdict(int)
+    for path in pgn_paths:
+        with open(path) as f:
+            while True:
+                game = chess.pgn.read_game(f)
+                if game is None:
+                    break
+                white_points, black_points = RESULT_POINTS.get(game.headers.get("Result"), (0, 0))
+                board = game.board()
+                for move in game.mainline_moves():
+                    if board.ply() >= max_ply:
+                        break
+                    entry = (chess.polyglot.zobrist_hash(board), encode_move(board, move))
+                    points[entry] += white_points if board.turn == chess.WHITE else black_points
+                    games[entry] += 1
+                    board.push(move)
+
+    entries = sorted((key, move, points[key, move]) for key, move in points
+                     if points[key, move] and games[key, move] >= min_games)
+    # Scale so the strongest move keeps its relative weight within 16 bits
+    scale = max([weight for _, _, weight in entries], default=0) / MAX_WEIGHT
+    with open(out_path, "wb") as out:
+        for key, move, weight in entries:
+            weight = max(1, round(weight / scale)) if scale > 1 else weight
+            out.write(ENTRY.pack(key, move, weight, 0))
+    return len(entries)
+
+
+class OpeningBook:
+    """A memory-mapped Polyglot book."""
+
+    def __init__(self, path):
+        self.reader = chess.polyglot.open_reader(path)
+
+    def probe(self, board, rng=None):
+        """Book move for board, chosen by weight, or None when out of book."""
+        try:
+            return self.reader.weighted_choice(board, random=rng).move
+        except IndexError:
+            return None
+
+    def moves(self, board):
+        """All book moves for board as (move, weight), best first."""
+        return [(entry.move, entry.weight) for entry in self.reader.find_all(board)]
+
+    def close(self):
+        self.reader.close()
+
+
+def open_book(path):
+    """OpeningBook for path, or None if there is no (non-empty) book there."""
+    if not path or not os.path.exists(path) or not os.path.getsize(path):
+        return None
+    return OpeningBook(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pgn", nargs="+", help="PGN files to read games from")
+    parser.add_argument("-o", "--output", default="book.bin")
+    parser.add_argument("--max-ply", type=int, default=24, help="only book moves within this many plies")
+    parser.add_argument("--min-games", type=int, default=1, help="drop moves played in fewer games")
+    args = parser.parse_args(argv)
+    count = build_book(args.pgn, args.output, args.max_ply, args.min_games)
+    print(f"wrote {count} entries to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
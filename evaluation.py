@@ -1,3 +1,6 @@
+import json
+from array import array
+
 import chess
 
 # Improved piece values
@@ -78,64 +81,313 @@ KING_TABLE = [
 ]
 
 
+PIECE_TABLES = {
+    chess.PAWN: PAWN_TABLE,
+    chess.KNIGHT: KNIGHT_TABLE,
+    chess.BISHOP: BISHOP_TABLE,
+    chess.ROOK: ROOK_TABLE,
+    chess.QUEEN: QUEEN_TABLE,
+    chess.KING: KING_TABLE
+}
+
+
 def piece_square_value(piece, square):
     """Get piece-square table value for a given piece."""
     row = 7 - chess.square_rank(square)
     col = chess.square_file(square)
     index = row * 8 + col
 
-    tables = {
-        chess.PAWN: PAWN_TABLE,
-        chess.KNIGHT: KNIGHT_TABLE,
-        chess.BISHOP: BISHOP_TABLE,
-        chess.ROOK: ROOK_TABLE,
-        chess.QUEEN: QUEEN_TABLE,
-        chess.KING: KING_TABLE
-    }
-
-    base = tables[piece.piece_type][index]
+    base = PIECE_TABLES[piece.piece_type][index]
     # For black pieces, invert perspective
     return base if piece.color == chess.WHITE else -base
 
 
-def evaluate_board(board):
+def build_material_pst_scores():
+    """Material plus piece-square value, signed from White's perspective,
+    indexed as [color][piece_type][square]."""
+    scores = [[None] * 7, [None] * 7]
+    for color in chess.COLORS:
+        for piece_type in chess.PIECE_TYPES:
+            piece = chess.Piece(piece_type, color)
+            sign = 1 if color == chess.WHITE else -1
+            scores[color][piece_type] = [
+                sign * PIECE_VALUES[piece_type] + piece_square_value(piece, square)
+                for square in chess.SQUARES
+            ]
+    return scores
+
+
+MATERIAL_PST_SCORES = build_material_pst_scores()
+
+# Centipawns per legal move of the side to move.
+MOBILITY_WEIGHT = 0.1
+# The mobility weight is kept on this grid, as every other term is, so that
+# the search's null window (ai.NULL_WINDOW) stays below the score resolution.
+MOBILITY_STEP = 0.05
+
+
+def round_mobility(weight):
+    """weight rounded to the nearest multiple of MOBILITY_STEP."""
+    return round(round(weight / MOBILITY_STEP) * MOBILITY_STEP, 2)
+
+
+def parameters():
+    """The tunable weights (piece values, piece-square tables, mobility) as a JSON-ready dict."""
+    return {
+        "piece_values": {chess.piece_name(piece_type): PIECE_VALUES[piece_type]
+                         for piece_type in chess.PIECE_TYPES if piece_type != chess.KING},
+        "tables": {chess.piece_name(piece_type): list(PIECE_TABLES[piece_type])
+                   for piece_type in chess.PIECE_TYPES},
+        "mobility": MOBILITY_WEIGHT,
+    }
+
+
+DEFAULT_PARAMETERS = parameters()
+
+
+def set_parameters(params):
+    """Evaluate with params (a dict shaped like parameters()) from now on.
+
+    Entries missing from params keep their current values. Piece values and
+    table entries are rounded to whole centipawns so that material_pst stays
+    integral, and the mobility weight to a multiple of MOBILITY_STEP. The tables are updated in place and MATERIAL_PST_SCORES is
+    rebuilt, so every evaluator sees the new weights; cached evaluations
+    have to be dropped by the caller (ai.load_evaluation_parameters does).
+    """
+    global MOBILITY_WEIGHT, _BATCH_WEIGHTS
+    piece_types = {chess.piece_name(piece_type): piece_type for piece_type in chess.PIECE_TYPES}
+    piece_values = params.get("piece_values", {})
+    tables = params.get("tables", {})
+    for name in list(piece_values) + list(tables):
+        if name not in piece_types:
+            raise ValueError(f"unknown piece {name!r}")
+    for name, table in tables.items():
+        if len(table) != 64:
+            raise ValueError(f"{name} table has {len(table)} entries, expected 64")
+    for name, value in piece_values.items():
+        PIECE_VALUES[piece_types[name]] = round(value)
+    for name, table in tables.items():
+        PIECE_TABLES[piece_types[name]][:] = [round(value) for value in table]
+    MOBILITY_WEIGHT = round_mobility(float(params.get("mobility", MOBILITY_WEIGHT)))
+    MATERIAL_PST_SCORES[:] = build_material_pst_scores()
+    _BATCH_WEIGHTS = None
+
+
+def load_parameters(path):
+    """set_parameters() from a JSON file, e.g. one written by tune.py."""
+    with open(path) as f:
+        set_parameters(json.load(f))
+
+
+def material_pst(board):
+    """Material and piece-square sum from scratch (one pass over the pieces)."""
+    value = 0
+    for square, piece in board.piece_map().items():
+        value += MATERIAL_PST_SCORES[piece.color][piece.piece_type][square]
+    return value
+
+
+def material_pst_delta(board, move):
+    """Change in material_pst(board) caused by move. Call before pushing it.
+
+    Together with material_pst this lets the search carry the score down the
+    tree and update it per move instead of rescanning all 64 squares at every
+    leaf. Covers captures, promotions, castling and en passant.
+    """
+    us = board.turn
+    ours = MATERIAL_PST_SCORES[us]
+    from_square = move.from_square
+    to_square = move.to_square
+    piece_type = board.piece_type_at(from_square)
+    delta = -ours[piece_type][from_square]
+
+    if piece_type == chess.KING and board.is_castling(move):
+        rank_start = from_square & ~7
+        if to_square > from_square:
+            king_to, rook_from, rook_to = rank_start + 6, rank_start + 7, rank_start + 5
+        else:
+            king_to, rook_from, rook_to = rank_start + 2, rank_start, rank_start + 3
+        rooks = ours[chess.ROOK]
+        return delta + ours[chess.KING][king_to] - rooks[rook_from] + rooks[rook_to]
+
+    theirs = MATERIAL_PST_SCORES[not us]
+    if piece_type == chess.PAWN and to_square == board.ep_square and board.is_en_passant(move):
+        delta -= theirs[chess.PAWN][to_square - 8 if us == chess.WHITE else to_square + 8]
+    else:
+        captured = board.piece_type_at(to_square)
+        if captured:
+            delta -= theirs[captured][to_square]
+    return delta + ours[move.promotion or piece_type][to_square]
+
+
+def material_pst_bitboard(board):
+    """Same as material_pst, walking the occupancy bitmasks piece type by piece type."""
+    value = 0
+    for color in chess.COLORS:
+        scores = MATERIAL_PST_SCORES[color]
+        for piece_type in chess.PIECE_TYPES:
+            table = scores[piece_type]
+            for square in chess.scan_forward(board.pieces_mask(piece_type, color)):
+                value += table[square]
+    return value
+
+
+# Fivefold repetition needs at least this many reversible plies (four
+# returns to the position, each at least four plies apart).
+FIVEFOLD_MIN_HALFMOVES = 16
+
+
+def terminal_score(board, move_count):
+    """Score of a finished game, or None while it goes on.
+
+    move_count is the number of legal moves, which the caller has usually
+    generated anyway; with it, mate and stalemate need no further move
+    generation. Gives the same verdict as board.is_game_over(), checking
+    the cheap draws first and repetitions only once enough reversible
+    plies have been played.
+    """
+    if not move_count:
+        if board.is_check():
+            return float("inf") if board.turn == chess.BLACK else float("-inf")
+        return 0.0
+    if board.is_insufficient_material():
+        return 0.0
+    if board.halfmove_clock >= FIVEFOLD_MIN_HALFMOVES and (board.is_seventyfive_moves()
+                                                          or board.is_fivefold_repetition()):
+        return 0.0
+    return None
+
+
+# Pawn structure, in centipawns per pawn. Passed pawn bonuses are indexed by
+# the rank counted from the pawn's own side.
+DOUBLED_PAWN_PENALTY = 10
+ISOLATED_PAWN_PENALTY = 15
+PASSED_PAWN_BONUS = [0, 5, 10, 20, 35, 60, 100, 0]
+
+
+def build_passed_pawn_masks():
+    """[color][square]: squares in front of a pawn, on its own and the adjacent files."""
+    masks = [[0] * 64, [0] * 64]
+    for square in chess.SQUARES:
+        file_ = chess.square_file(square)
+        files = 0
+        for f in range(max(0, file_ - 1), min(7, file_ + 1) + 1):
+            files |= chess.BB_FILES[f]
+        rank = chess.square_rank(square)
+        masks[chess.WHITE][square] = files & ~(chess.BB_RANKS[rank] - 1 | chess.BB_RANKS[rank]) & chess.BB_ALL
+        masks[chess.BLACK][square] = files & (chess.BB_RANKS[rank] - 1)
+    return masks
+
+
+PASSED_PAWN_MASKS = build_passed_pawn_masks()
+ADJACENT_FILES = [(chess.BB_FILES[f - 1] if f > 0 else 0) | (chess.BB_FILES[f + 1] if f < 7 else 0)
+                  for f in range(8)]
+
+
+def pawn_structure(white_pawns, black_pawns):
+    """Doubled, isolated and passed pawn terms, White-relative, from the two pawn bitboards."""
+    value = 0
+    for color, own, other in ((chess.WHITE, white_pawns, black_pawns), (chess.BLACK, black_pawns, white_pawns)):
+        score = 0
+        for file_ in range(8):
+            count = chess.popcount(own & chess.BB_FILES[file_])
+            if count:
+                score -= DOUBLED_PAWN_PENALTY * (count - 1)
+                if not own & ADJACENT_FILES[file_]:
+                    score -= ISOLATED_PAWN_PENALTY * count
+        masks = PASSED_PAWN_MASKS[color]
+        for square in chess.scan_forward(own):
+            if not other & masks[square]:
+                rank = chess.square_rank(square)
+                score += PASSED_PAWN_BONUS[rank if color == chess.WHITE else 7 - rank]
+        value += score if color == chess.WHITE else -score
+    return value
+
+
+PAWN_HASH_ENTRIES = 1 << 14
+
+
+class PawnHashTable:
+    """Fixed-size cache of pawn_structure() keyed by the two pawn bitboards.
+
+    The pawns change far less often than the rest of the position, so most
+    evaluations find their pawn structure here. Each slot holds both
+    bitboards, which makes a hit exact; an empty slot stands for the
+    pawnless structure, whose score is 0.
+    """
+
+    def __init__(self, entries=PAWN_HASH_ENTRIES):
+        if entries & (entries - 1):
+            raise ValueError("entries must be a power of two")
+        self.mask = entries - 1
+        self._white = array("Q", [0]) * entries
+        self._black = array("Q", [0]) * entries
+        self._values = array("q", [0]) * entries
+        self.probes = 0
+        self.hits = 0
+
+    def __len__(self):
+        return self.mask + 1
+
+    def clear(self):
+        entries = len(self)
+        self._white = array("Q", [0]) * entries
+        self._black = array("Q", [0]) * entries
+        self._values = array("q", [0]) * entries
+
+    def score(self, white_pawns, black_pawns):
+        """pawn_structure(white_pawns, black_pawns), computed at most once per slot."""
+        self.probes += 1
+        i = hash((white_pawns, black_pawns)) & self.mask
+        if self._white[i] == white_pawns and self._black[i] == black_pawns:
+            self.hits += 1
+            return self._values[i]
+        value = pawn_structure(white_pawns, black_pawns)
+        self._white[i] = white_pawns
+        self._black[i] = black_pawns
+        self._values[i] = value
+        return value
+
+
+pawn_hash_table = PawnHashTable()
+
+
+def pawn_score(board):
+    """Pawn structure term of board through the pawn hash table."""
+    pawns = board.pawns
+    return pawn_hash_table.score(pawns & board.occupied_co[chess.WHITE], pawns & board.occupied_co[chess.BLACK])
+
+
+def evaluate_board(board, material_pst_score=None):
     """
     More nuanced board evaluation:
     - Material
     - Piece-square placement
+    - Pawn structure (doubled, isolated and passed pawns)
     - Mobility
     - Center control
     - Basic king safety approximation
+
+    If the caller tracks material_pst incrementally it can pass the current
+    value as material_pst_score to skip the per-square scan.
     """
-    if board.is_game_over():
+    # Mobility, also telling whether the game is over
+    legal_moves = list(board.legal_moves)
+    mobility = len(legal_moves)
+    terminal = terminal_score(board, mobility)
+    if terminal is not None:
         # If game is over, evaluation should reflect results
-        if board.is_checkmate():
-            return float("inf") if board.turn == chess.BLACK else float("-inf")
-        else:
-            return 0.0  # draw
-
-    value = 0.0
+        return terminal
 
     # Material and position
-    for square in chess.SQUARES:
-        piece = board.piece_at(square)
-        if piece:
-            # Material
-            piece_val = PIECE_VALUES[piece.piece_type]
-            if piece.color == chess.BLACK:
-                piece_val = -piece_val
-            value += piece_val
-
-            # Piece-square table
-            value += piece_square_value(piece, square)
+    if material_pst_score is None:
+        material_pst_score = material_pst(board)
+    value = float(material_pst_score + pawn_score(board))
 
-    # Mobility
-    legal_moves = list(board.legal_moves)
-    mobility = len(legal_moves)
     if board.turn == chess.WHITE:
-        value += 0.1 * mobility
+        value += MOBILITY_WEIGHT * mobility
     else:
-        value -= 0.1 * mobility
+        value -= MOBILITY_WEIGHT * mobility
 
     # Center control
     center_squares = [chess.D4, chess.D5, chess.E4, chess.E5]
@@ -160,3 +412,119 @@ def evaluate_board(board):
         value += bc_dist * 0.05
 
     return value
+
+
+CENTER_SQUARES = [chess.D4, chess.D5, chess.E4, chess.E5]
+
+
+def evaluate_board_bitboard(board, material_pst_score=None):
+    """evaluate_board computed from python-chess occupancy bitmasks.
+
+    Scores are identical to evaluate_board (same terms, same order of float
+    operations); only the way the board is read differs.
+    """
+    mobility = board.legal_moves.count()
+    terminal = terminal_score(board, mobility)
+    if terminal is not None:
+        return terminal
+
+    if material_pst_score is None:
+        material_pst_score = material_pst_bitboard(board)
+    value = float(material_pst_score + pawn_score(board))
+
+    if board.turn == chess.WHITE:
+        value += MOBILITY_WEIGHT * mobility
+    else:
+        value -= MOBILITY_WEIGHT * mobility
+
+    white = board.occupied_co[chess.WHITE]
+    black = board.occupied_co[chess.BLACK]
+    for sq in CENTER_SQUARES:
+        mask = chess.BB_SQUARES[sq]
+        if white & mask:
+            value += 0.3
+        elif black & mask:
+            value -= 0.3
+
+    white_king_pos = board.king(chess.WHITE)
+    black_king_pos = board.king(chess.BLACK)
+    if white_king_pos is not None:
+        wr, wf = divmod(white_king_pos, 8)
+        value -= (abs(wf - 3.5) + abs(wr - 3.5)) * 0.05
+    if black_king_pos is not None:
+        br, bf = divmod(black_king_pos, 8)
+        value += (abs(bf - 3.5) + abs(br - 3.5)) * 0.05
+
+    return value
+
+
+EVALUATORS = {
+    "squares": evaluate_board,
+    "bitboard": evaluate_board_bitboard,
+}
+
+# evaluate_batch stacks the six White piece bitboards, then the six Black ones.
+BATCH_COLORS = (chess.WHITE, chess.BLACK)
+
+# (12, 64) weight matrix for evaluate_batch, built on first use so that
+# numpy stays an optional dependency for the GUI.
+_BATCH_WEIGHTS = None
+
+
+def _batch_weights(np):
+    global _BATCH_WEIGHTS
+    if _BATCH_WEIGHTS is None:
+        _BATCH_WEIGHTS = np.array(
+            [MATERIAL_PST_SCORES[color][piece_type] for color in BATCH_COLORS for piece_type in chess.PIECE_TYPES],
+            dtype=np.int64,
+        )
+    return _BATCH_WEIGHTS
+
+
+def evaluate_batch(boards):
+    """Evaluate many positions at once, returning a float64 NumPy array.
+
+    The twelve piece bitboards of every position are unpacked into one
+    (n, 12, 64) bit tensor so material, piece-square, center and king terms
+    are computed as array operations. Legality-dependent terms (game over,
+    mobility) still need python-chess per board, and the pawn structure
+    comes from the pawn hash table like in the scalar evaluators. Results equal evaluate_board.
+    """
+    import numpy as np
+
+    boards = list(boards)
+    n = len(boards)
+    masks = np.zeros((n, 12), dtype="<u8")
+    mobility = np.zeros(n, dtype=np.int64)
+    white_to_move = np.zeros(n, dtype=bool)
+    terminal = np.full(n, np.nan)
+    pawns = np.zeros(n, dtype=np.int64)
+    for i, board in enumerate(boards):
+        masks[i] = [board.pieces_mask(piece_type, color)
+                    for color in BATCH_COLORS for piece_type in chess.PIECE_TYPES]
+        pawns[i] = pawn_score(board)
+        white_to_move[i] = board.turn == chess.WHITE
+        mobility[i] = board.legal_moves.count()
+        score = terminal_score(board, mobility[i])
+        if score is not None:
+            terminal[i] = score
+
+    # bits[i, k, square]: row k is piece type k % 6 + 1, White rows first.
+    bits = np.unpackbits(masks.view(np.uint8).reshape(n, 12, 8), axis=2, bitorder="little")
+
+    value = (np.einsum("nks,ks->n", bits.astype(np.int64), _batch_weights(np)) + pawns).astype(np.float64)
+    value = np.where(white_to_move, value + MOBILITY_WEIGHT * mobility, value - MOBILITY_WEIGHT * mobility)
+
+    white = bits[:, :6, :].any(axis=1)
+    black = bits[:, 6:, :].any(axis=1)
+    for sq in CENTER_SQUARES:
+        value = np.where(white[:, sq], value + 0.3, np.where(black[:, sq], value - 0.3, value))
+
+    white_kings = bits[:, chess.KING - 1, :]
+    wr, wf = np.divmod(white_kings.argmax(axis=1), 8)
+    value = np.where(white_kings.any(axis=1), value - (np.abs(wf - 3.5) + np.abs(wr - 3.5)) * 0.05, value)
+    black_kings = bits[:, 6 + chess.KING - 1, :]
+    br, bf = np.divmod(black_kings.argmax(axis=1), 8)
+    value = np.where(black_kings.any(axis=1), value + (np.abs(bf - 3.5) + np.abs(br - 3.5)) * 0.05, value)
+
+    return np.where(np.isnan(terminal), value, terminal)
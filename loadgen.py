@@ -0,0 +1,127 @@
+"""Load generator for server.py.
+
+    python loadgen.py --url http://127.0.0.1:8080 --games 32 --moves 20 --time 0.2
+
+plays many games against the server at once, each on its own keep-alive
+connection: the client side plays random legal moves and asks the engine
+for a reply every time. Prints the throughput, the client-side latency
+percentiles, how many requests were rejected (503) or ran out of time (504),
+and the server's own /metrics at the end. Rejected requests are retried
+after the server's Retry-After.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from urllib.parse import urlsplit
+
+import chess
+
+from server import percentile
+
+
+class Client:
+    """One keep-alive HTTP connection speaking JSON."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, payload=None):
+        """(status, headers, decoded JSON body)."""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode() if payload is not None else b""
+        self.writer.write((f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                           f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode() + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        data = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        return status, headers, json.loads(data) if data else None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+
+async def play(host, port, moves, move_time, stats, rng):
+    """Play one game of up to moves engine replies and record every request in stats."""
+    client = Client(host, port)
+    try:
+        _, _, created = await client.request("POST", "/games", {})
+        game_id, board = created["game"], chess.Board(created["fen"])
+        for _ in range(moves):
+            move = rng.choice(list(board.legal_moves))
+            while True:
+                start = time.monotonic()
+                status, headers, reply = await client.request(
+                    "POST", f"/games/{game_id}/move", {"move": move.uci(), "time": move_time})
+                stats["status"][status] = stats["status"].get(status, 0) + 1
+                if status != 503:
+                    break
+                await asyncio.sleep(float(headers.get("retry-after", 1)))
+            if status != 200:
+                break
+            stats["latencies"].append(time.monotonic() - start)
+            board = chess.Board(reply["fen"])
+            if reply["result"] is not None:
+                break
+        await client.request("DELETE", f"/games/{game_id}")
+    finally:
+        await client.close()
+
+
+async def run(url, games, moves, move_time, seed=None):
+    """Run the load and return the collected statistics (with the server's metrics)."""
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    stats = {"status": {}, "latencies": []}
+    rng = random.Random(seed)
+    start = time.monotonic()
+    await asyncio.gather(*(play(host, port, moves, move_time, stats, random.Random(rng.random()))
+                           for _ in range(games)))
+    stats["elapsed"] = time.monotonic() - start
+    client = Client(host, port)
+    try:
+        _, _, stats["server"] = await client.request("GET", "/metrics")
+    finally:
+        await client.close()
+    return stats
+
+
+def format_report(stats):
+    latencies = stats["latencies"]
+    lines = [f"{len(latencies)} moves in {stats['elapsed']:.1f}s ({len(latencies) / stats['elapsed']:.1f} moves/s)"]
+    if latencies:
+        lines.append("latency ms: " + "  ".join(f"{name} {percentile(latencies, fraction) * 1000:.0f}"
+                                                for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))))
+    lines.append("responses: " + "  ".join(f"{status}: {count}" for status, count in sorted(stats["status"].items())))
+    lines.append("server: " + json.dumps(stats["server"]))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--games", type=int, default=16, help="concurrent games")
+    parser.add_argument("--moves", type=int, default=20, help="engine replies requested per game")
+    parser.add_argument("--time", type=float, default=0.2, help="time budget per request in seconds")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+    print(format_report(asyncio.run(run(args.url, args.games, args.moves, args.time, args.seed))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,9 @@
-import threading
+import functools
+import hashlib
+import os
 import pygame
 import chess
-from ai import get_best_move_time_limited
+from session import EngineWorker, GameSession
 
 # Constants
 SCREEN_WIDTH, SCREEN_HEIGHT = 600, 600
@@ -13,100 +15,213 @@ LAST_MOVE_HIGHLIGHT_COLOR = (0, 0, 255, 80)
 FONT_COLOR_RED = (255, 0, 0)
 FONT_COLOR_WHITE = (255, 255, 255)
 FONT_COLOR_GREEN = (0, 255, 0)
+RESTART_BUTTON_RECT = pygame.Rect(200, 400, 200, 50)
+# Longest the main loop sleeps waiting for events; bounds the clock's refresh interval.
+IDLE_WAIT_MS = 100
+# Posted by the engine worker when its move is ready, to wake the main loop.
+AI_MOVED_EVENT = pygame.USEREVENT + 1
 
 PIECE_IMAGES = {}
 
-
-def load_piece_images():
+PIECE_ASSETS = {
+    "P": "assets/pawn-w.svg",
+    "N": "assets/knight-w.svg",
+    "B": "assets/bishop-w.svg",
+    "R": "assets/rook-w.svg",
+    "Q": "assets/queen-w.svg",
+    "K": "assets/king-w.svg",
+    "p": "assets/pawn-b.svg",
+    "n": "assets/knight-b.svg",
+    "b": "assets/bishop-b.svg",
+    "r": "assets/rook-b.svg",
+    "q": "assets/queen-b.svg",
+    "k": "assets/king-b.svg",
+}
+
+# Rasterized pieces are cached here as one PNG atlas per tile size.
+SPRITE_CACHE_DIR = ".sprite_cache"
+
+
+def sprite_atlas_path(tile_size):
+    """Cache file for the atlas: keyed by the SVG contents and the tile size."""
+    digest = hashlib.sha256(str(tile_size).encode())
+    for key, path in PIECE_ASSETS.items():
+        with open(path, "rb") as f:
+            digest.update(key.encode() + f.read())
+    return os.path.join(SPRITE_CACHE_DIR, f"pieces-{tile_size}-{digest.hexdigest()[:16]}.png")
+
+
+def build_sprite_atlas(path, tile_size):
+    """Rasterize every piece SVG into a single row of tiles and save it as path."""
     import cairosvg
     from io import BytesIO
 
-    pieces = {
-        "P": "assets/pawn-w.svg",
-        "N": "assets/knight-w.svg",
-        "B": "assets/bishop-w.svg",
-        "R": "assets/rook-w.svg",
-        "Q": "assets/queen-w.svg",
-        "K": "assets/king-w.svg",
-        "p": "assets/pawn-b.svg",
-        "n": "assets/knight-b.svg",
-        "b": "assets/bishop-b.svg",
-        "r": "assets/rook-b.svg",
-        "q": "assets/queen-b.svg",
-        "k": "assets/king-b.svg",
-    }
-    for key, path in pieces.items():
-        png_data = cairosvg.svg2png(url=path)
-        raw_image = pygame.image.load(BytesIO(png_data))
-        PIECE_IMAGES[key] = pygame.transform.scale(raw_image, (TILE_SIZE, TILE_SIZE))
-
-
-def draw_board(screen, selected_square=None, possible_moves=None, last_move=None):
-    """Draw the chessboard with optional highlights."""
-    for row in range(8):
-        for col in range(8):
-            color = WHITE if (row + col) % 2 == 0 else GREY
-            rect = pygame.Rect(col * TILE_SIZE, row * TILE_SIZE, TILE_SIZE, TILE_SIZE)
-            pygame.draw.rect(screen, color, rect)
-
-    # Highlight last move
-    if last_move is not None:
-        from_sq = last_move.from_square
-        to_sq = last_move.to_square
-        from_col, from_row = chess.square_file(from_sq), chess.square_rank(from_sq)
-        to_col, to_row = chess.square_file(to_sq), chess.square_rank(to_sq)
-
-        from_rect = pygame.Rect(from_col * TILE_SIZE, (7 - from_row) * TILE_SIZE, TILE_SIZE, TILE_SIZE)
-        to_rect = pygame.Rect(to_col * TILE_SIZE, (7 - to_row) * TILE_SIZE, TILE_SIZE, TILE_SIZE)
-        s = pygame.Surface((TILE_SIZE, TILE_SIZE))
-        s.set_alpha(100)
-        s.fill(LAST_MOVE_HIGHLIGHT_COLOR)
-        screen.blit(s, from_rect)
-        screen.blit(s, to_rect)
-
-    # Highlight possible moves
-    if possible_moves:
-        for move_sq in possible_moves:
-            col, row = chess.square_file(move_sq), chess.square_rank(move_sq)
-            center = (col * TILE_SIZE + TILE_SIZE // 2, (7 - row) * TILE_SIZE + TILE_SIZE // 2)
-            pygame.draw.circle(screen, HIGHLIGHT_COLOR, center, TILE_SIZE // 4)
-
-    # Highlight selected square
-    if selected_square is not None:
-        col, row = chess.square_file(selected_square), chess.square_rank(selected_square)
-        selected_rect = pygame.Rect(col * TILE_SIZE, (7 - row) * TILE_SIZE, TILE_SIZE, TILE_SIZE)
-        pygame.draw.rect(screen, HIGHLIGHT_COLOR, selected_rect, 5)
-
-
-def draw_pieces(screen, board):
-    """Draw chess pieces on the board."""
-    for square in chess.SQUARES:
-        piece = board.piece_at(square)
-        if piece:
-            x, y = chess.square_file(square), chess.square_rank(square)
-            screen.blit(PIECE_IMAGES[piece.symbol()], (x * TILE_SIZE, (7 - y) * TILE_SIZE))
+    atlas = pygame.Surface((tile_size * len(PIECE_ASSETS), tile_size), pygame.SRCALPHA)
+    for i, svg in enumerate(PIECE_ASSETS.values()):
+        png_data = cairosvg.svg2png(url=svg, output_width=tile_size, output_height=tile_size)
+        atlas.blit(pygame.image.load(BytesIO(png_data)), (i * tile_size, 0))
+    os.makedirs(SPRITE_CACHE_DIR, exist_ok=True)
+    # Write under a temporary name so a concurrent launch never reads half a file.
+    temp_path = f"{path}.{os.getpid()}.png"
+    pygame.image.save(atlas, temp_path)
+    os.replace(temp_path, path)
+
+
+def load_piece_images():
+    """Fill PIECE_IMAGES from the cached atlas, building it only when the cache is cold."""
+    if PIECE_IMAGES:
+        return
+    path = sprite_atlas_path(TILE_SIZE)
+    if not os.path.exists(path):
+        build_sprite_atlas(path, TILE_SIZE)
+    atlas = pygame.image.load(path).convert_alpha()
+    for i, key in enumerate(PIECE_ASSETS):
+        PIECE_IMAGES[key] = atlas.subsurface(pygame.Rect(i * TILE_SIZE, 0, TILE_SIZE, TILE_SIZE))
+
+
+def square_rect(square):
+    return pygame.Rect(chess.square_file(square) * TILE_SIZE, (7 - chess.square_rank(square)) * TILE_SIZE,
+                       TILE_SIZE, TILE_SIZE)
+
+
+def squares_under(rect):
+    """Squares whose tiles intersect rect."""
+    first_col, last_col = max(0, rect.left // TILE_SIZE), min(7, (rect.right - 1) // TILE_SIZE)
+    first_row, last_row = max(0, rect.top // TILE_SIZE), min(7, (rect.bottom - 1) // TILE_SIZE)
+    return {chess.square(col, 7 - row)
+            for col in range(first_col, last_col + 1) for row in range(first_row, last_row + 1)}
+
+
+_fonts = {}
+
+
+def get_font(size):
+    font = _fonts.get(size)
+    if font is None:
+        font = _fonts[size] = pygame.font.Font(None, size)
+    return font
+
+
+@functools.lru_cache(maxsize=128)
+def render_text(text, size, color):
+    return get_font(size).render(text, True, color)
+
+
+def message_rect(message):
+    return render_text(message, 50, FONT_COLOR_RED).get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 50))
 
 
 def display_message(screen, message, color=FONT_COLOR_RED):
-    font = pygame.font.Font(None, 50)
-    text_surface = font.render(message, True, color)
-    text_rect = text_surface.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 50))
-    screen.blit(text_surface, text_rect)
+    text_surface = render_text(message, 50, color)
+    screen.blit(text_surface, text_surface.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 50)))
 
 
 def draw_button(screen, message, x, y, width, height, font_color, button_color):
-    font = pygame.font.Font(None, 36)
     button_rect = pygame.Rect(x, y, width, height)
     pygame.draw.rect(screen, button_color, button_rect, border_radius=10)
-    text_surface = font.render(message, True, font_color)
+    text_surface = render_text(message, 36, font_color)
     text_rect = text_surface.get_rect(center=(x + width // 2, y + height // 2))
     screen.blit(text_surface, text_rect)
     return button_rect
 
 
+class BoardRenderer:
+    """Draws the game screen, updating only what changed since the last frame.
+
+    The squares are drawn from a cached background. Each frame every square's
+    state (piece and highlights) is compared with the previous frame and only
+    changed squares are redrawn; overlays (clock, messages, the restart
+    button) are redrawn together with the squares beneath them. Only the
+    redrawn rectangles are passed to pygame.display.update.
+    """
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.background = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+        for square in chess.SQUARES:
+            color = WHITE if (chess.square_file(square) + chess.square_rank(square)) % 2 else GREY
+            pygame.draw.rect(self.background, color, square_rect(square))
+        self.last_move_highlight = pygame.Surface((TILE_SIZE, TILE_SIZE))
+        self.last_move_highlight.set_alpha(100)
+        self.last_move_highlight.fill(LAST_MOVE_HIGHLIGHT_COLOR)
+        self.invalidate()
+
+    def invalidate(self):
+        """Redraw everything on the next frame (e.g. after another screen was shown)."""
+        self.squares = [None] * 64
+        self.overlays = []
+        self.overlay_rects = [self.screen.get_rect()]
+
+    def overlay_rect(self, overlay):
+        kind, text, color = overlay
+        if kind == "message":
+            return message_rect(text)
+        if kind == "clock":
+            return render_text(text, 36, color).get_rect(topleft=(SCREEN_WIDTH - 150, 10))
+        return RESTART_BUTTON_RECT
+
+    def draw_overlay(self, overlay):
+        kind, text, color = overlay
+        if kind == "message":
+            display_message(self.screen, text, color)
+        elif kind == "clock":
+            self.screen.blit(render_text(text, 36, color), self.overlay_rect(overlay))
+        else:
+            draw_button(self.screen, text, *RESTART_BUTTON_RECT, (50, 50, 50), WHITE)
+
+    def draw_square(self, square, state):
+        piece, selected, target, last_move = state
+        rect = square_rect(square)
+        self.screen.blit(self.background, rect, rect)
+        if last_move:
+            self.screen.blit(self.last_move_highlight, rect)
+        if target:
+            pygame.draw.circle(self.screen, HIGHLIGHT_COLOR, rect.center, TILE_SIZE // 4)
+        if selected:
+            pygame.draw.rect(self.screen, HIGHLIGHT_COLOR, rect, 5)
+        if piece:
+            self.screen.blit(PIECE_IMAGES[piece], rect)
+
+    def render(self, board, selected_square, possible_moves, last_move, overlays):
+        """overlays: (kind, text, color) tuples drawn above the board; kind is "message", "clock" or "button"."""
+        moved = (last_move.from_square, last_move.to_square) if last_move else ()
+        states = []
+        for square in chess.SQUARES:
+            piece = board.piece_at(square)
+            states.append((piece.symbol() if piece else None, square == selected_square,
+                           square in possible_moves, square in moved))
+        dirty = {square for square in chess.SQUARES if states[square] != self.squares[square]}
+
+        overlay_rects = [self.overlay_rect(overlay) for overlay in overlays]
+        if overlays != self.overlays:
+            for rect in self.overlay_rects + overlay_rects:
+                dirty |= squares_under(rect)
+        # An overlay over a redrawn square is redrawn whole, so all squares under it are redrawn first.
+        redraw = set()
+        grown = True
+        while grown:
+            grown = False
+            for i, rect in enumerate(overlay_rects):
+                if i not in redraw and any(square_rect(square).colliderect(rect) for square in dirty):
+                    redraw.add(i)
+                    dirty |= squares_under(rect)
+                    grown = True
+
+        for square in dirty:
+            self.draw_square(square, states[square])
+        for i in sorted(redraw):
+            self.draw_overlay(overlays[i])
+        self.squares = states
+        self.overlays = overlays
+        self.overlay_rects = overlay_rects
+        if dirty:
+            pygame.display.update([square_rect(square) for square in dirty])
+
+
 def welcome_screen(screen):
+    """True to play White, False for Black, None if the window was closed."""
     screen.fill((50, 50, 50))
-    font = pygame.font.Font(None, 50)
+    font = get_font(50)
     for i in range(SCREEN_HEIGHT):
         color = (i // 5, i // 5, i // 5)
         pygame.draw.line(screen, color, (0, i), (SCREEN_WIDTH, i))
@@ -120,7 +235,7 @@ def welcome_screen(screen):
     while True:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                pygame.quit(); exit()
+                return None
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if white_button.collidepoint(event.pos):
                     return True
@@ -128,114 +243,99 @@ def welcome_screen(screen):
                     return False
 
 
-def main():
-    pygame.init()
-    load_piece_images()
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-    pygame.display.set_caption("AI Chess")
-    clock = pygame.time.Clock()
-
-    user_plays_white = welcome_screen(screen)
-    board = chess.Board()
+def play_game(screen, clock, session):
+    """Run one game until the user restarts (returns True) or quits (returns False)."""
+    user_color = session.user_color
     selected_square = None
     possible_moves = []
-    ai_thinking = False
     game_over = False
     winner_message = ""
     user_time_left = 60
     last_time_update = pygame.time.get_ticks()
-    last_move = None
-
-    def ai_thread():
-        nonlocal ai_thinking, game_over, winner_message, last_move
-        ai_thinking = True
-        ai_move = get_best_move_time_limited(board, max_time=2.0)
-        if ai_move:
-            board.push(ai_move)
-            last_move = ai_move
-        ai_thinking = False
-        if board.is_game_over():
-            game_over = True
-            result = board.result()
-            if result == "1-0":
-                winner_message = "White Wins!"
-            elif result == "0-1":
-                winner_message = "Black Wins!"
-            else:
-                winner_message = "Draw!"
-
-    if not user_plays_white:
-        threading.Thread(target=ai_thread).start()
 
-    running = True
-    while running:
-        screen.fill(GREY)
+    renderer = BoardRenderer(screen)
+    while True:
+        # Sleep until something happens; the timeout keeps the user's clock ticking on screen.
+        events = pygame.event.get()
+        if not events:
+            events = [pygame.event.wait(IDLE_WAIT_MS)]
+
+        # The engine's move is applied here, on the UI thread.
+        session.poll()
+        if session.game_over and not game_over:
+            game_over = True
+            winner_message = session.result_message()
 
         current_time = pygame.time.get_ticks()
-        if board.turn == user_plays_white and not ai_thinking and not game_over:
+        if session.user_to_move and not game_over:
             elapsed_time = (current_time - last_time_update) / 1000
             user_time_left -= elapsed_time
             last_time_update = current_time
             if user_time_left <= 0:
                 game_over = True
                 winner_message = "AI Wins! Time ran out."
+                session.close()
         else:
             if not game_over:
                 user_time_left = 60
             last_time_update = current_time
 
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
-                running = False
+                return False
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if game_over:
-                    restart_button = draw_button(screen, "Restart", 200, 400, 200, 50, (50,50,50), WHITE)
-                    if restart_button.collidepoint(event.pos):
-                        main(); return
-                elif not ai_thinking and board.turn == user_plays_white:
-                    x, y = pygame.mouse.get_pos()
+                    if RESTART_BUTTON_RECT.collidepoint(event.pos):
+                        return True
+                elif session.user_to_move:
+                    x, y = event.pos
                     col, row = x // TILE_SIZE, 7 - (y // TILE_SIZE)
                     square = chess.square(col, row)
+                    board = session.board
                     if selected_square is None:
                         selected_square = square
                         possible_moves = [m.to_square for m in board.legal_moves if m.from_square == square]
                     else:
                         move = next((m for m in board.legal_moves if m.from_square == selected_square and m.to_square == square), None)
                         if move:
-                            board.push(move)
-                            last_move = move
-                            if board.is_game_over():
+                            session.user_move(move)
+                            if session.game_over:
                                 game_over = True
-                                result = board.result()
-                                if result == "1-0":
-                                    winner_message = "White Wins!"
-                                elif result == "0-1":
-                                    winner_message = "Black Wins!"
-                                else:
-                                    winner_message = "Draw!"
-                            else:
-                                threading.Thread(target=ai_thread).start()
+                                winner_message = session.result_message()
                         selected_square = None
                         possible_moves = []
 
-        draw_board(screen, selected_square, possible_moves, last_move)
-        draw_pieces(screen, board)
-
-        if ai_thinking:
-            display_message(screen, "AI is thinking...", color=FONT_COLOR_RED)
+        overlays = []
+        if session.ai_thinking and not game_over:
+            overlays.append(("message", "AI is thinking...", FONT_COLOR_RED))
         elif not game_over:
-            font = pygame.font.Font(None, 36)
-            user_time_text = f"Time Left: {max(0, user_time_left):.1f}s"
-            user_time_surface = font.render(user_time_text, True, FONT_COLOR_GREEN)
-            screen.blit(user_time_surface, (SCREEN_WIDTH - 150, 10))
-
+            overlays.append(("clock", f"Time Left: {max(0, user_time_left):.1f}s", FONT_COLOR_GREEN))
         if game_over:
-            display_message(screen, winner_message, color=FONT_COLOR_RED)
-            restart_button = draw_button(screen, "Restart", 200, 400, 200, 50, (50,50,50), WHITE)
-
-        pygame.display.flip()
+            overlays.append(("message", winner_message, FONT_COLOR_RED))
+            overlays.append(("button", "Restart", None))
+        renderer.render(session.board, selected_square, possible_moves, session.last_move, overlays)
         clock.tick(60)
 
+
+def main():
+    pygame.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    load_piece_images()
+    pygame.display.set_caption("AI Chess")
+    clock = pygame.time.Clock()
+
+    # One engine thread for the whole process; it wakes the event loop when a move is ready.
+    engine = EngineWorker(notify=lambda: pygame.event.post(pygame.event.Event(AI_MOVED_EVENT)))
+    while True:
+        user_plays_white = welcome_screen(screen)
+        if user_plays_white is None:
+            break
+        session = GameSession(engine, user_plays_white, max_time=2.0)
+        restart = play_game(screen, clock, session)
+        session.close()
+        if not restart:
+            break
+    engine.close()
     pygame.quit()
 
 
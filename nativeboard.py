@@ -0,0 +1,720 @@
+"""Compact board for the search.
+
+NativeBoard keeps the position in plain integer bitboards inside a
+__slots__ class and makes and unmakes moves through preallocated undo slots
+indexed by ply, instead of the state snapshots python-chess takes on every
+push.
+It implements the part of the chess.Board interface the engine uses
+(move generation, push/pop, the check and capture tests, game-over
+detection and the piece accessors), so the search, the evaluators and the
+bitbases run on either board unchanged.
+
+Moves are the same chess.Move objects python-chess uses, but preallocated
+once, and they are generated in python-chess's order, so a search visits
+exactly the same tree on both boards. Only standard chess is supported.
+gives_check() works on the bitboards without making the move, from check
+squares worked out once per position; that is where most of the time goes
+when ordering moves on a chess.Board.
+
+    python nativeboard.py [depth]
+
+runs perft on the bench positions against the expected counts.
+"""
+import sys
+
+import chess
+from chess import (BB_DIAG_ATTACKS, BB_DIAG_MASKS, BB_FILE_ATTACKS, BB_FILE_MASKS, BB_KING_ATTACKS,
+                   BB_KNIGHT_ATTACKS, BB_PAWN_ATTACKS, BB_RANK_ATTACKS, BB_RANK_MASKS, BB_RAYS, BB_SQUARES,
+                   BISHOP, BLACK, KING, KNIGHT, PAWN, QUEEN, ROOK, WHITE)
+
+PROMOTION_TYPES = (QUEEN, ROOK, BISHOP, KNIGHT)
+
+# MOVES[from][to] and PROMOTIONS[from][to][piece type]: every move object the generator hands out.
+MOVES = [[chess.Move(a, b) for b in range(64)] for a in range(64)]
+PROMOTIONS = [[{piece_type: chess.Move(a, b, piece_type) for piece_type in PROMOTION_TYPES}
+               if chess.square_rank(b) in (0, 7) else None for b in range(64)] for a in range(64)]
+BETWEEN = [[chess.between(a, b) for b in range(64)] for a in range(64)]
+
+BB_BACKRANKS = (chess.BB_RANK_8, chess.BB_RANK_1)  # indexed by color
+# King destination of a castling move -> the rook's from and to squares.
+CASTLING_ROOK_MOVES = {chess.G1: chess.BB_H1 | chess.BB_F1, chess.C1: chess.BB_A1 | chess.BB_D1,
+                       chess.G8: chess.BB_H8 | chess.BB_F8, chess.C8: chess.BB_A8 | chess.BB_D8}
+BB_EP_RANKS = (chess.BB_RANK_4, chess.BB_RANK_5)   # rank a capturing pawn of color stands on
+UNDO_CHUNK = 256  # plies of undo slots allocated at a time
+
+
+def _bsr(bb):
+    return bb.bit_length() - 1
+
+
+def _scan_reversed(bb):
+    while bb:
+        square = bb.bit_length() - 1
+        yield square
+        bb ^= 1 << square
+
+
+class LegalMoveList(list):
+    """Legal moves as a list that also answers count(), like python-chess's LegalMoveGenerator."""
+
+    def count(self, *args):
+        return list.count(self, *args) if args else len(self)
+
+
+class NativeBoard:
+    """A standard chess position for the search; see the module docstring."""
+
+    __slots__ = ("pawns", "knights", "bishops", "rooks", "queens", "kings", "occupied_co", "occupied",
+                 "turn", "castling_rights", "ep_square", "halfmove_clock", "fullmove_number", "move_stack",
+                 "_undo_castling", "_undo_ep", "_undo_halfmove", "_undo_captured", "_undo_mask", "_check_info",
+                 "_root")
+
+    def __init__(self, fen=chess.STARTING_FEN):
+        self._load(chess.Board(fen))
+        self._root = fen
+
+    @classmethod
+    def from_board(cls, board):
+        """NativeBoard for a chess.Board, including its move history (for repetitions)."""
+        if board.chess960:
+            raise ValueError("NativeBoard supports standard chess only")
+        native = cls.__new__(cls)
+        root = board.root()
+        native._load(root)
+        native._root = root.fen()
+        for move in board.move_stack:
+            native.push(move)
+        return native
+
+    def _load(self, board):
+        self.pawns, self.knights, self.bishops = board.pawns, board.knights, board.bishops
+        self.rooks, self.queens, self.kings = board.rooks, board.queens, board.kings
+        self.occupied_co = [board.occupied_co[BLACK], board.occupied_co[WHITE]]
+        self.occupied = board.occupied
+        self.turn = board.turn
+        # Cleaned once here; push() keeps them clean, as python-chess does by cleaning on every push.
+        self.castling_rights = board.clean_castling_rights()
+        self.ep_square = board.ep_square
+        self.halfmove_clock = board.halfmove_clock
+        self.fullmove_number = board.fullmove_number
+        self.move_stack = []
+        # Undo slots, indexed by the ply of the move they undo (len(move_stack) before the push).
+        self._undo_castling = [0] * UNDO_CHUNK
+        self._undo_ep = [None] * UNDO_CHUNK
+        self._undo_halfmove = [0] * UNDO_CHUNK
+        self._undo_captured = [None] * UNDO_CHUNK
+        self._undo_mask = [0] * UNDO_CHUNK
+        self._check_info = None
+
+    def to_board(self):
+        """The equivalent chess.Board, with the same move history."""
+        board = chess.Board(self._root)
+        for move in self.move_stack:
+            board.push(move)
+        return board
+
+    def copy(self):
+        native = NativeBoard.__new__(NativeBoard)
+        for name in self.__slots__:
+            setattr(native, name, getattr(self, name))
+        native.occupied_co = list(self.occupied_co)
+        native.move_stack = list(self.move_stack)
+        native._undo_castling = list(self._undo_castling)
+        native._undo_ep = list(self._undo_ep)
+        native._undo_halfmove = list(self._undo_halfmove)
+        native._undo_captured = list(self._undo_captured)
+        native._undo_mask = list(self._undo_mask)
+        return native
+
+    def fen(self):
+        return self.to_board().fen()
+
+    def __repr__(self):
+        return f"NativeBoard({self.fen()!r})"
+
+    # Pieces
+
+    def piece_type_at(self, square):
+        mask = BB_SQUARES[square]
+        if not self.occupied & mask:
+            return None
+        if self.pawns & mask:
+            return PAWN
+        if self.knights & mask:
+            return KNIGHT
+        if self.bishops & mask:
+            return BISHOP
+        if self.rooks & mask:
+            return ROOK
+        if self.queens & mask:
+            return QUEEN
+        return KING
+
+    def piece_at(self, square):
+        piece_type = self.piece_type_at(square)
+        if piece_type is None:
+            return None
+        return chess.Piece(piece_type, bool(self.occupied_co[WHITE] & BB_SQUARES[square]))
+
+    def piece_map(self):
+        return {square: self.piece_at(square) for square in chess.scan_forward(self.occupied)}
+
+    def pieces_mask(self, piece_type, color):
+        return self._type_mask(piece_type) & self.occupied_co[color]
+
+    def _type_mask(self, piece_type):
+        return (self.pawns, self.knights, self.bishops, self.rooks, self.queens, self.kings)[piece_type - 1]
+
+    def king(self, color):
+        mask = self.kings & self.occupied_co[color]
+        return _bsr(mask) if mask else None
+
+    def ply(self):
+        return 2 * (self.fullmove_number - 1) + (self.turn == BLACK)
+
+    # Attacks
+
+    def attackers_mask(self, color, square, occupied=None):
+        if occupied is None:
+            occupied = self.occupied
+        queens_and_rooks = self.queens | self.rooks
+        queens_and_bishops = self.queens | self.bishops
+        attackers = ((BB_KING_ATTACKS[square] & self.kings)
+                     | (BB_KNIGHT_ATTACKS[square] & self.knights)
+                     | (BB_RANK_ATTACKS[square][BB_RANK_MASKS[square] & occupied] & queens_and_rooks)
+                     | (BB_FILE_ATTACKS[square][BB_FILE_MASKS[square] & occupied] & queens_and_rooks)
+                     | (BB_DIAG_ATTACKS[square][BB_DIAG_MASKS[square] & occupied] & queens_and_bishops)
+                     | (BB_PAWN_ATTACKS[not color][square] & self.pawns))
+        return attackers & self.occupied_co[color]
+
+    def is_attacked_by(self, color, square, occupied=None):
+        return bool(self.attackers_mask(color, square, occupied))
+
+    def attacks_mask(self, square):
+        mask = BB_SQUARES[square]
+        if self.pawns & mask:
+            return BB_PAWN_ATTACKS[bool(self.occupied_co[WHITE] & mask)][square]
+        if self.knights & mask:
+            return BB_KNIGHT_ATTACKS[square]
+        if self.kings & mask:
+            return BB_KING_ATTACKS[square]
+        attacks = 0
+        occupied = self.occupied
+        if self.bishops & mask or self.queens & mask:
+            attacks = BB_DIAG_ATTACKS[square][BB_DIAG_MASKS[square] & occupied]
+        if self.rooks & mask or self.queens & mask:
+            attacks |= (BB_RANK_ATTACKS[square][BB_RANK_MASKS[square] & occupied]
+                        | BB_FILE_ATTACKS[square][BB_FILE_MASKS[square] & occupied])
+        return attacks
+
+    def checkers_mask(self):
+        king = self.king(self.turn)
+        return 0 if king is None else self.attackers_mask(not self.turn, king)
+
+    def is_check(self):
+        return bool(self.checkers_mask())
+
+    def _slider_blockers(self, king, slider_color=None):
+        """Our pieces that are the only piece between king and a slider of slider_color.
+
+        With our king and the enemy sliders (the default) these are the pinned
+        pieces; with the enemy king and our sliders, the pieces that give a
+        discovered check by leaving the line.
+        """
+        if slider_color is None:
+            slider_color = not self.turn
+        queens_and_rooks = self.queens | self.rooks
+        queens_and_bishops = self.queens | self.bishops
+        snipers = (((BB_RANK_ATTACKS[king][0] | BB_FILE_ATTACKS[king][0]) & queens_and_rooks)
+                   | (BB_DIAG_ATTACKS[king][0] & queens_and_bishops))
+        blockers = 0
+        occupied = self.occupied
+        for sniper in _scan_reversed(snipers & self.occupied_co[slider_color]):
+            b = BETWEEN[king][sniper] & occupied
+            if b and not b & (b - 1):
+                blockers |= b
+        return blockers & self.occupied_co[self.turn]
+
+    # Move generation
+
+    @property
+    def legal_moves(self):
+        return LegalMoveList(self._legal_move_list())
+
+    def generate_legal_moves(self):
+        return iter(self._legal_move_list())
+
+    def _legal_move_list(self):
+        turn = self.turn
+        king_mask = self.kings & self.occupied_co[turn]
+        if not king_mask:
+            return self.generate_pseudo_legal_moves()
+        king = _bsr(king_mask)
+        checkers = self.attackers_mask(not turn, king)
+        moves = list(self._generate_evasions(king, checkers)) if checkers else self.generate_pseudo_legal_moves()
+        # Only king moves, moves of pinned pieces and en passant captures can be illegal.
+        blockers = self._slider_blockers(king)
+        suspects = king_mask | blockers
+        ep_square = self.ep_square
+        if ep_square is not None:
+            suspects |= self.pawns & self.occupied_co[turn] & BB_PAWN_ATTACKS[not turn][ep_square]
+        return [move for move in moves
+                if not BB_SQUARES[move.from_square] & suspects or self._is_safe(move, king, blockers)]
+
+    def _is_safe(self, move, king, blockers):
+        from_square, to_square = move.from_square, move.to_square
+        if from_square == king:
+            # Castling is only generated when it is safe.
+            return to_square - from_square in (2, -2) or not self.attackers_mask(not self.turn, to_square)
+        if self.ep_square == to_square and self.pawns & BB_SQUARES[from_square] \
+                and not self.occupied & BB_SQUARES[to_square]:
+            return self._ep_safe(king, from_square, to_square)
+        return not blockers & BB_SQUARES[from_square] or bool(BB_RAYS[from_square][to_square] & BB_SQUARES[king])
+
+    def _ep_safe(self, king, from_square, to_square):
+        captured = to_square + (-8 if self.turn == WHITE else 8)
+        occupied = self.occupied ^ BB_SQUARES[from_square] ^ BB_SQUARES[to_square] ^ BB_SQUARES[captured]
+        them = self.occupied_co[not self.turn] & ~BB_SQUARES[captured]
+        queens_and_rooks = (self.queens | self.rooks) & them
+        queens_and_bishops = (self.queens | self.bishops) & them
+        return not ((BB_RANK_ATTACKS[king][BB_RANK_MASKS[king] & occupied] & queens_and_rooks)
+                    | (BB_FILE_ATTACKS[king][BB_FILE_MASKS[king] & occupied] & queens_and_rooks)
+                    | (BB_DIAG_ATTACKS[king][BB_DIAG_MASKS[king] & occupied] & queens_and_bishops))
+
+    def _generate_evasions(self, king, checkers):
+        turn = self.turn
+        sliders = checkers & (self.bishops | self.rooks | self.queens)
+        attacked = 0
+        for checker in _scan_reversed(sliders):
+            attacked |= BB_RAYS[king][checker] & ~BB_SQUARES[checker]
+        moves = MOVES[king]
+        for to_square in _scan_reversed(BB_KING_ATTACKS[king] & ~self.occupied_co[turn] & ~attacked):
+            yield moves[to_square]
+        checker = _bsr(checkers)
+        if BB_SQUARES[checker] == checkers:
+            target = BETWEEN[king][checker] | checkers
+            yield from self.generate_pseudo_legal_moves(~self.kings, target)
+            ep_square = self.ep_square
+            if ep_square is not None and not BB_SQUARES[ep_square] & target:
+                if ep_square + (-8 if turn == WHITE else 8) == checker:
+                    yield from self._generate_ep(~0, ~0)
+
+    def generate_pseudo_legal_moves(self, from_mask=chess.BB_ALL, to_mask=chess.BB_ALL):
+        """Pseudo-legal moves in the order python-chess generates them, as a list."""
+        turn = self.turn
+        ours = self.occupied_co[turn]
+        occupied = self.occupied
+        pawns = self.pawns
+        knights, kings = self.knights, self.kings
+        diagonal, straight = self.bishops | self.queens, self.rooks | self.queens
+        targets = ~ours & to_mask
+        result = []
+        append = result.append
+
+        # Piece moves, including plain king steps
+        pieces = ours & ~pawns & from_mask
+        while pieces:
+            from_square = pieces.bit_length() - 1
+            mask = 1 << from_square
+            pieces ^= mask
+            if knights & mask:
+                attacks = BB_KNIGHT_ATTACKS[from_square]
+            elif kings & mask:
+                attacks = BB_KING_ATTACKS[from_square]
+            else:
+                attacks = 0
+                if diagonal & mask:
+                    attacks = BB_DIAG_ATTACKS[from_square][BB_DIAG_MASKS[from_square] & occupied]
+                if straight & mask:
+                    attacks |= (BB_RANK_ATTACKS[from_square][BB_RANK_MASKS[from_square] & occupied]
+                                | BB_FILE_ATTACKS[from_square][BB_FILE_MASKS[from_square] & occupied])
+            attacks &= targets
+            moves = MOVES[from_square]
+            while attacks:
+                to_square = attacks.bit_length() - 1
+                append(moves[to_square])
+                attacks ^= 1 << to_square
+
+        if from_mask & kings and self.castling_rights & BB_BACKRANKS[turn]:
+            result.extend(self._generate_castling(to_mask))
+
+        our_pawns = pawns & ours & from_mask
+        if not our_pawns:
+            return result
+        theirs = self.occupied_co[not turn] & to_mask
+        pawn_attacks = BB_PAWN_ATTACKS[turn]
+        for from_square in _scan_reversed(our_pawns):
+            captures = pawn_attacks[from_square] & theirs
+            while captures:
+                to_square = captures.bit_length() - 1
+                captures ^= 1 << to_square
+                promotions = PROMOTIONS[from_square][to_square]
+                if promotions is not None:
+                    result.extend(promotions.values())
+                else:
+                    append(MOVES[from_square][to_square])
+
+        if turn == WHITE:
+            single_moves = our_pawns << 8 & ~occupied
+            double_moves = single_moves << 8 & ~occupied & (chess.BB_RANK_3 | chess.BB_RANK_4)
+            step = -8
+        else:
+            single_moves = our_pawns >> 8 & ~occupied
+            double_moves = single_moves >> 8 & ~occupied & (chess.BB_RANK_6 | chess.BB_RANK_5)
+            step = 8
+        for to_square in _scan_reversed(single_moves & to_mask):
+            from_square = to_square + step
+            promotions = PROMOTIONS[from_square][to_square]
+            if promotions is not None:
+                result.extend(promotions.values())
+            else:
+                append(MOVES[from_square][to_square])
+        for to_square in _scan_reversed(double_moves & to_mask):
+            append(MOVES[to_square + 2 * step][to_square])
+
+        if self.ep_square is not None:
+            result.extend(self._generate_ep(from_mask, to_mask))
+        return result
+
+    def _generate_ep(self, from_mask, to_mask):
+        ep_square = self.ep_square
+        ep_mask = BB_SQUARES[ep_square]
+        if not ep_mask & to_mask or ep_mask & self.occupied:
+            return
+        turn = self.turn
+        if not self.pawns & self.occupied_co[not turn] & BB_SQUARES[ep_square + (-8 if turn == WHITE else 8)]:
+            return
+        capturers = (self.pawns & self.occupied_co[turn] & from_mask
+                     & BB_PAWN_ATTACKS[not turn][ep_square] & BB_EP_RANKS[turn])
+        for capturer in _scan_reversed(capturers):
+            yield MOVES[capturer][ep_square]
+
+    def _generate_castling(self, to_mask):
+        turn = self.turn
+        backrank = BB_BACKRANKS[turn]
+        king = self.occupied_co[turn] & self.kings & backrank
+        king &= -king
+        if not king:
+            return
+        king_square = _bsr(king)
+        occupied = self.occupied
+        for candidate in _scan_reversed(self.clean_castling_rights() & backrank & to_mask):
+            rook = BB_SQUARES[candidate]
+            a_side = rook < king
+            king_to = (chess.BB_FILE_C if a_side else chess.BB_FILE_G) & backrank
+            rook_to = (chess.BB_FILE_D if a_side else chess.BB_FILE_F) & backrank
+            king_path = BETWEEN[king_square][_bsr(king_to)]
+            rook_path = BETWEEN[candidate][_bsr(rook_to)]
+            if (occupied ^ king ^ rook) & (king_path | rook_path | king_to | rook_to):
+                continue
+            if self._attacked_for_king(king_path | king, occupied ^ king):
+                continue
+            if self._attacked_for_king(king_to, occupied ^ king ^ rook ^ rook_to):
+                continue
+            yield MOVES[king_square][_bsr(king_to)]
+
+    def _attacked_for_king(self, path, occupied):
+        them = not self.turn
+        for square in _scan_reversed(path):
+            if self.attackers_mask(them, square, occupied):
+                return True
+        return False
+
+    def clean_castling_rights(self):
+        return self.castling_rights
+
+    # Move properties
+
+    def is_en_passant(self, move):
+        return (self.ep_square == move.to_square and bool(self.pawns & BB_SQUARES[move.from_square])
+                and abs(move.to_square - move.from_square) in (7, 9)
+                and not self.occupied & BB_SQUARES[move.to_square])
+
+    def is_capture(self, move):
+        return bool(BB_SQUARES[move.to_square] & self.occupied_co[not self.turn]) or self.is_en_passant(move)
+
+    def is_castling(self, move):
+        if self.kings & BB_SQUARES[move.from_square]:
+            diff = (move.from_square & 7) - (move.to_square & 7)
+            return abs(diff) > 1 or bool(self.rooks & self.occupied_co[self.turn] & BB_SQUARES[move.to_square])
+        return False
+
+    def is_zeroing(self, move):
+        touched = BB_SQUARES[move.from_square] ^ BB_SQUARES[move.to_square]
+        return bool(touched & self.pawns or touched & self.occupied_co[not self.turn])
+
+    def _compute_check_info(self):
+        """(enemy king, check squares by piece type, discovered check candidates) for gives_check."""
+        turn = self.turn
+        king = self.king(not turn)
+        if king is None:
+            return None, None, 0
+        occupied = self.occupied
+        diagonal = BB_DIAG_ATTACKS[king][BB_DIAG_MASKS[king] & occupied]
+        straight = (BB_RANK_ATTACKS[king][BB_RANK_MASKS[king] & occupied]
+                    | BB_FILE_ATTACKS[king][BB_FILE_MASKS[king] & occupied])
+        check_squares = (0, BB_PAWN_ATTACKS[not turn][king], BB_KNIGHT_ATTACKS[king], diagonal, straight,
+                         diagonal | straight, 0)
+        return king, check_squares, self._slider_blockers(king, turn)
+
+    def gives_check(self, move):
+        """Whether move checks the opponent, from the bitboards without making it.
+
+        Plain moves are answered from the check squares and discovered check
+        candidates of the position, worked out once per position; castling,
+        en passant and promotions take the full test.
+        """
+        info = self._check_info
+        if info is None:
+            info = self._check_info = self._compute_check_info()
+        king, check_squares, discoverers = info
+        if king is None:
+            return False
+        from_square, to_square = move.from_square, move.to_square
+        from_mask, to_mask = BB_SQUARES[from_square], BB_SQUARES[to_square]
+        piece_type = self.piece_type_at(from_square)
+        if not move.promotion and not (piece_type == KING and to_square - from_square in (2, -2)) \
+                and not (piece_type == PAWN and self.is_en_passant(move)):
+            if check_squares[piece_type] & to_mask:
+                return True
+            return bool(discoverers & from_mask) and not BB_RAYS[king][from_square] & to_mask
+        turn = self.turn
+        ours = self.occupied_co[turn] & ~from_mask
+        occupied = self.occupied & ~from_mask | to_mask
+        rooks_and_queens = (self.rooks | self.queens) & ours
+        bishops_and_queens = (self.bishops | self.queens) & ours
+
+        if piece_type == KING and to_square - from_square in (2, -2):
+            rook_move = CASTLING_ROOK_MOVES[to_square]
+            occupied ^= rook_move
+            rooks_and_queens ^= rook_move
+        else:
+            if piece_type == PAWN and self.is_en_passant(move):
+                occupied &= ~BB_SQUARES[to_square + (-8 if turn == WHITE else 8)]
+            new_type = move.promotion or piece_type
+            if new_type == PAWN:
+                if BB_PAWN_ATTACKS[turn][to_square] & BB_SQUARES[king]:
+                    return True
+            elif new_type == KNIGHT:
+                if BB_KNIGHT_ATTACKS[to_square] & BB_SQUARES[king]:
+                    return True
+            if new_type in (ROOK, QUEEN):
+                rooks_and_queens |= to_mask
+            if new_type in (BISHOP, QUEEN):
+                bishops_and_queens |= to_mask
+
+        return bool((BB_RANK_ATTACKS[king][BB_RANK_MASKS[king] & occupied] & rooks_and_queens)
+                    | (BB_FILE_ATTACKS[king][BB_FILE_MASKS[king] & occupied] & rooks_and_queens)
+                    | (BB_DIAG_ATTACKS[king][BB_DIAG_MASKS[king] & occupied] & bishops_and_queens))
+
+    # Make and unmake
+
+    def _remove(self, piece_type, mask):
+        if piece_type == PAWN:
+            self.pawns ^= mask
+        elif piece_type == KNIGHT:
+            self.knights ^= mask
+        elif piece_type == BISHOP:
+            self.bishops ^= mask
+        elif piece_type == ROOK:
+            self.rooks ^= mask
+        elif piece_type == QUEEN:
+            self.queens ^= mask
+        else:
+            self.kings ^= mask
+
+    _add = _remove
+
+    def push(self, move):
+        """Make move (legal or null). Undone with pop()."""
+        turn = self.turn
+        ep_square = self.ep_square
+        self._check_info = None
+        ply = len(self.move_stack)
+        if ply == len(self._undo_mask):
+            self._grow_undo()
+        self._undo_castling[ply] = self.castling_rights
+        self._undo_ep[ply] = ep_square
+        self._undo_halfmove[ply] = self.halfmove_clock
+        self.move_stack.append(move)
+        self.ep_square = None
+        self.halfmove_clock += 1
+        if turn == BLACK:
+            self.fullmove_number += 1
+        if not move:
+            self._undo_captured[ply] = None
+            self.turn = not turn
+            return
+
+        from_square, to_square = move.from_square, move.to_square
+        from_mask, to_mask = BB_SQUARES[from_square], BB_SQUARES[to_square]
+        occupied_co = self.occupied_co
+        them = not turn
+        piece_type = self.piece_type_at(from_square)
+        captured_type = self.piece_type_at(to_square) if occupied_co[them] & to_mask else None
+        capture_mask = to_mask
+        if piece_type == PAWN or captured_type:
+            self.halfmove_clock = 0
+
+        self.castling_rights &= ~to_mask & ~from_mask
+        if piece_type == KING:
+            self.castling_rights &= ~BB_BACKRANKS[turn]
+            if to_square - from_square in (2, -2):
+                # Castling: the rook jumps over the king.
+                rook_move = CASTLING_ROOK_MOVES[to_square]
+                self.rooks ^= rook_move
+                occupied_co[turn] ^= rook_move
+        elif piece_type == PAWN:
+            diff = to_square - from_square
+            if diff == 16 or diff == -16:
+                self.ep_square = from_square + diff // 2
+            elif to_square == ep_square and not captured_type and diff not in (8, -8):
+                captured_type = PAWN
+                capture_mask = BB_SQUARES[to_square - 8 if turn == WHITE else to_square + 8]
+
+        if captured_type:
+            self._remove(captured_type, capture_mask)
+            occupied_co[them] ^= capture_mask
+        self._remove(piece_type, from_mask)
+        self._add(move.promotion or piece_type, to_mask)
+        occupied_co[turn] ^= from_mask | to_mask
+        self.occupied = occupied_co[WHITE] | occupied_co[BLACK]
+        self.turn = them
+        self._undo_captured[ply] = captured_type
+        self._undo_mask[ply] = capture_mask
+
+    def _grow_undo(self):
+        self._undo_castling += [0] * UNDO_CHUNK
+        self._undo_ep += [None] * UNDO_CHUNK
+        self._undo_halfmove += [0] * UNDO_CHUNK
+        self._undo_captured += [None] * UNDO_CHUNK
+        self._undo_mask += [0] * UNDO_CHUNK
+
+    def pop(self):
+        """Unmake the last move and return it."""
+        move = self.move_stack.pop()
+        self._check_info = None
+        ply = len(self.move_stack)
+        self.castling_rights = self._undo_castling[ply]
+        self.ep_square = self._undo_ep[ply]
+        self.halfmove_clock = self._undo_halfmove[ply]
+        turn = not self.turn
+        self.turn = turn
+        if turn == BLACK:
+            self.fullmove_number -= 1
+        if not move:
+            return move
+
+        from_square, to_square = move.from_square, move.to_square
+        from_mask, to_mask = BB_SQUARES[from_square], BB_SQUARES[to_square]
+        occupied_co = self.occupied_co
+        moved_type = self.piece_type_at(to_square)
+        self._remove(moved_type, to_mask)
+        self._add(PAWN if move.promotion else moved_type, from_mask)
+        occupied_co[turn] ^= from_mask | to_mask
+        if moved_type == KING and to_square - from_square in (2, -2):
+            rook_move = CASTLING_ROOK_MOVES[to_square]
+            self.rooks ^= rook_move
+            occupied_co[turn] ^= rook_move
+        captured_type = self._undo_captured[ply]
+        if captured_type:
+            capture_mask = self._undo_mask[ply]
+            self._add(captured_type, capture_mask)
+            occupied_co[not turn] ^= capture_mask
+        self.occupied = occupied_co[WHITE] | occupied_co[BLACK]
+        return move
+
+    # Game end
+
+    def is_insufficient_material(self):
+        return self.has_insufficient_material(WHITE) and self.has_insufficient_material(BLACK)
+
+    def has_insufficient_material(self, color):
+        ours = self.occupied_co[color]
+        if ours & (self.pawns | self.rooks | self.queens):
+            return False
+        if ours & self.knights:
+            return chess.popcount(ours) <= 2 and not self.occupied_co[not color] & ~self.kings & ~self.queens
+        if ours & self.bishops:
+            same_color = not self.bishops & chess.BB_DARK_SQUARES or not self.bishops & chess.BB_LIGHT_SQUARES
+            return bool(same_color) and not self.pawns and not self.knights
+        return True
+
+    def is_checkmate(self):
+        return self.is_check() and not any(self.generate_legal_moves())
+
+    def is_stalemate(self):
+        return not self.is_check() and not any(self.generate_legal_moves())
+
+    def is_seventyfive_moves(self):
+        return self.halfmove_clock >= 150 and any(self.generate_legal_moves())
+
+    def has_legal_en_passant(self):
+        if self.ep_square is None or not any(self._generate_ep(chess.BB_ALL, chess.BB_ALL)):
+            return False
+        return any(self.is_en_passant(move) for move in self.generate_legal_moves())
+
+    def _transposition_key(self):
+        # As in python-chess, the en passant square only counts when the capture is legal.
+        return (self.pawns, self.knights, self.bishops, self.rooks, self.queens, self.kings,
+                self.occupied_co[WHITE], self.occupied_co[BLACK], self.turn, self.clean_castling_rights(),
+                self.ep_square if self.has_legal_en_passant() else None)
+
+    def is_repetition(self, count=3):
+        """Whether the position occurred count times, looking back to the last irreversible move."""
+        key = self._transposition_key()
+        switchyard = []
+        try:
+            while count > 1 and len(self.move_stack) >= count - 1:
+                rights = self.castling_rights
+                move = self.pop()
+                switchyard.append(move)
+                if (not move or self.is_zeroing(move) or self.castling_rights != rights
+                        or self.has_legal_en_passant()):
+                    break
+                if self._transposition_key() == key:
+                    count -= 1
+        finally:
+            while switchyard:
+                self.push(switchyard.pop())
+        return count <= 1
+
+    def is_fivefold_repetition(self):
+        return self.is_repetition(5)
+
+    def is_game_over(self):
+        if not any(self.generate_legal_moves()):
+            return True
+        return self.is_insufficient_material() or self.is_seventyfive_moves() or self.is_fivefold_repetition()
+
+
+def perft(board, depth):
+    """Leaf nodes of the legal move tree below board (a NativeBoard)."""
+    if depth <= 1:
+        return board.legal_moves.count() if depth == 1 else 1
+    nodes = 0
+    for move in board.legal_moves:
+        board.push(move)
+        nodes += perft(board, depth - 1)
+        board.pop()
+    return nodes
+
+
+def main(argv=None):
+    import time
+    from bench import PERFT_POSITIONS
+
+    argv = sys.argv[1:] if argv is None else argv
+    depth = int(argv[0]) if argv else 3
+    failed = False
+    for fen, counts in PERFT_POSITIONS:
+        start = time.perf_counter()
+        nodes = perft(NativeBoard(fen), depth)
+        ok = depth > len(counts) or nodes == counts[depth - 1]
+        failed |= not ok
+        print(f"{'ok  ' if ok else 'FAIL'} depth {depth}: {nodes:9d} nodes {time.perf_counter() - start:6.2f}s  {fen}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
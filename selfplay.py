@@ -0,0 +1,363 @@
+"""Engine-vs-engine self-play matches.
+
+    python selfplay.py "new:time=0.1" "base:time=0.1,lmr=0" --games 200 --workers 8 \\
+        --pgn games.pgn --sprt 0 5
+
+plays two engine configurations against each other on a pool of worker
+processes. An engine is given as name:settings, where settings are
+comma-separated search limits (time=<seconds>, nodes=<count>,
+depth=<plies>), search option overrides as accepted by batch.py and
+bench.py (lmr=0, null_move=0, ...) and eval=<file> to evaluate with the
+weights in a parameter file written by tune.py. Node-limited matches are reproducible
+and independent of machine load, which makes them the better choice on a
+busy machine.
+
+Every opening of the suite (built in, or a FEN/EPD file given with
+--openings) is played twice with colours reversed. Games are adjudicated
+as a win once both engines agree on a large score for several moves, and
+as a draw once both see a level position for several moves. Finished games
+are appended to the PGN file, and a running Elo estimate with its 95%
+error margin (and, with --sprt, the log-likelihood ratio) is printed after
+every game. The SPRT stops the match as soon as it accepts either
+hypothesis.
+"""
+import argparse
+import math
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import chess
+import chess.pgn
+
+import ai
+import evaluation
+from batch import read_positions
+from transposition import TranspositionTable
+
+# Short, balanced openings after a few moves each, both sides to move.
+OPENINGS = [
+    "rnbqkbnr/pp1ppppp/8/2p5/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2",
+    "rnbqkb1r/pppp1ppp/5n2/4p3/2P5/2N5/PP1PPPPP/R1BQKBNR w KQkq - 2 3",
+    "r1bqkbnr/pppp1ppp/2n5/1B2p3/4P3/5N2/PPPP1PPP/RNBQK2R b KQkq - 3 3",
+    "rnbqkb1r/ppp1pppp/5n2/3p4/3P1B2/5N2/PPP1PPPP/RN1QKB1R b KQkq - 3 3",
+    "rnbqkbnr/pp2pppp/2p5/3p4/3PP3/8/PPP2PPP/RNBQKBNR w KQkq - 0 3",
+    "rnbqkb1r/pppppp1p/5np1/8/2PP4/8/PP2PPPP/RNBQKBNR w KQkq - 0 3",
+    "rnbqkbnr/ppp2ppp/4p3/3p4/3PP3/8/PPP2PPP/RNBQKBNR w KQkq - 0 3",
+    "rnbqkb1r/pp2pppp/3p1n2/8/3NP3/8/PPP2PPP/RNBQKB1R w KQkq - 1 5",
+    "r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R b KQkq - 3 3",
+    "rnbqkbnr/pppp1ppp/8/4p3/2P5/8/PP1PPPPP/RNBQKBNR w KQkq - 0 2",
+]
+
+# Adjudication defaults: scores in centipawns, counted in moves of both sides.
+RESIGN_SCORE = 1000
+RESIGN_MOVES = 4
+DRAW_SCORE = 10
+DRAW_MOVES = 8
+DRAW_MIN_PLY = 60
+MAX_PLIES = 400
+
+LIMITS = {"time": ("max_time", float), "nodes": ("max_nodes", int), "depth": ("max_depth", int)}
+
+
+def parse_engine(text):
+    """'name:time=0.1,lmr=0' -> engine dict with name, search limits and search options."""
+    name, _, settings = text.rpartition(":")
+    if not name:
+        name, settings = settings, ""
+    engine = {"name": name, "max_time": None, "max_nodes": None, "max_depth": ai.MAX_SEARCH_DEPTH, "options": {},
+              "eval_file": None}
+    options = []
+    for item in filter(None, settings.split(",")):
+        key, _, value = item.partition("=")
+        if key in LIMITS:
+            field, convert = LIMITS[key]
+            engine[field] = convert(value)
+        elif key == "eval":
+            engine["eval_file"] = value
+        else:
+            options.append(item)
+    engine["options"] = ai.parse_search_options(",".join(options))
+    if engine["max_time"] is None and engine["max_nodes"] is None and engine["max_depth"] == ai.MAX_SEARCH_DEPTH:
+        raise ValueError(f"engine {name!r} needs a time, nodes or depth limit")
+    return engine
+
+
+def read_openings(path):
+    """Opening FENs from a FEN or EPD file."""
+    return [record["fen"] for _, record in read_positions(path)]
+
+
+# Parameter file the evaluation of this process currently uses (None: built in).
+_eval_file = None
+
+
+def use_evaluation(path):
+    """Switch this process to the evaluation weights of path, if it is not using them already.
+
+    Only the evaluation caches are emptied: each engine's transposition
+    table holds scores of its own evaluation.
+    """
+    global _eval_file
+    if path != _eval_file:
+        if path is None:
+            evaluation.set_parameters(evaluation.DEFAULT_PARAMETERS)
+        else:
+            evaluation.load_parameters(path)
+        ai.clear_evaluation_caches()
+        _eval_file = path
+
+
+# Transposition tables of the two engines of a game, made on first use with
+# the size of the process's own table.
+_engine_tables = []
+
+
+def engine_table(index):
+    """This process's transposition table for the index-th engine of a game (0 or 1)."""
+    while len(_engine_tables) <= index:
+        _engine_tables.append(TranspositionTable(ai.transposition_table.size_mb))
+    return _engine_tables[index]
+
+
+def play_game(fen, white, black, adjudication=None):
+    """Play one game from fen between two engine dicts; returns the game record.
+
+    The record holds the result ("1-0", "0-1" or "1/2-1/2"), how the game
+    ended, the start FEN and the moves in UCI notation. Each engine searches
+    with its own transposition table, emptied at the start of the game, so
+    neither probes entries stored under the other's search settings.
+    Engines with different eval files switch weights before each of their
+    moves, which empties the evaluation cache they share.
+    """
+    settings = {"resign_score": RESIGN_SCORE, "resign_moves": RESIGN_MOVES, "draw_score": DRAW_SCORE,
+                "draw_moves": DRAW_MOVES, "draw_min_ply": DRAW_MIN_PLY, "max_plies": MAX_PLIES,
+                **(adjudication or {})}
+    tables = {chess.WHITE: engine_table(0), chess.BLACK: engine_table(1)}
+    for table in tables.values():
+        table.clear()
+    process_table = ai.transposition_table
+    try:
+        return _play(fen, white, black, tables, settings)
+    finally:
+        ai.transposition_table = process_table
+
+
+def _play(fen, white, black, tables, settings):
+    board = chess.Board(fen)
+    # Recent White-relative scores, one per ply, for adjudication.
+    scores = []
+    result = termination = None
+    while result is None:
+        outcome = board.outcome(claim_draw=True)
+        if outcome is not None:
+            result, termination = outcome.result(), outcome.termination.name.lower()
+            break
+        if len(board.move_stack) >= settings["max_plies"]:
+            result, termination = "1/2-1/2", "max plies"
+            break
+        engine = white if board.turn == chess.WHITE else black
+        ai.transposition_table = tables[board.turn]
+        use_evaluation(engine.get("eval_file"))
+        searched = ai.search(board, engine["max_time"], engine["max_depth"], max_nodes=engine["max_nodes"],
+                             **engine["options"])
+        board.push(searched.move)
+        if searched.depth:
+            # A forced move is played without a search and carries no score.
+            scores.append(searched.score)
+        result, termination = adjudicate(scores, len(board.move_stack), settings)
+    return {"fen": fen, "white": white["name"], "black": black["name"], "result": result,
+            "termination": termination, "moves": [move.uci() for move in board.move_stack]}
+
+
+def adjudicate(scores, ply, settings):
+    """(result, termination) once the recent scores settle the game, else (None, None).
+
+    A resign_score of None turns resignation off, mate scores included.
+    """
+    window = 2 * settings["resign_moves"]
+    recent = scores[-window:]
+    resign_score = settings["resign_score"]
+    if resign_score is not None and len(recent) == window:
+        if all(score >= resign_score for score in recent):
+            return "1-0", "adjudication"
+        if all(score <= -resign_score for score in recent):
+            return "0-1", "adjudication"
+    window = 2 * settings["draw_moves"]
+    recent = scores[-window:]
+    if ply >= settings["draw_min_ply"] and len(recent) == window:
+        if all(abs(score) <= settings["draw_score"] for score in recent):
+            return "1/2-1/2", "adjudication"
+    return None, None
+
+
+def game_to_pgn(record, round_number=None):
+    """chess.pgn.Game for a play_game() record."""
+    board = chess.Board(record["fen"])
+    for uci in record["moves"]:
+        board.push_uci(uci)
+    game = chess.pgn.Game.from_board(board)
+    game.headers["Event"] = "Self-play"
+    game.headers["White"] = record["white"]
+    game.headers["Black"] = record["black"]
+    game.headers["Round"] = str(round_number) if round_number is not None else "?"
+    game.headers["Result"] = record["result"]
+    game.headers["Termination"] = record["termination"]
+    return game
+
+
+def score_for(record, name):
+    """Points name scored in the game: 1, 0.5 or 0."""
+    if record["result"] == "1/2-1/2":
+        return 0.5
+    winner = record["white"] if record["result"] == "1-0" else record["black"]
+    return 1.0 if winner == name else 0.0
+
+
+def elo(score):
+    """Elo difference for an expected score strictly between 0 and 1."""
+    return -400 * math.log10(1 / score - 1)
+
+
+def elo_estimate(wins, draws, losses):
+    """(Elo difference, 95% error margin) from a win/draw/loss count."""
+    games = wins + draws + losses
+    if not games:
+        return 0.0, float("inf")
+    score = (wins + draws / 2) / games
+    if score in (0.0, 1.0):
+        return (float("inf") if score else float("-inf")), float("inf")
+    variance = (wins + draws / 4) / games - score ** 2
+    margin = 1.96 * math.sqrt(variance / games)
+    low, high = max(score - margin, 1e-9), min(score + margin, 1 - 1e-9)
+    return elo(score), (elo(high) - elo(low)) / 2
+
+
+def sprt(wins, draws, losses, elo0, elo1, alpha=0.05, beta=0.05):
+    """Log-likelihood ratio of H1 (elo1) against H0 (elo0) and its (lower, upper) bounds.
+
+    Uses the normal approximation to the trinomial (W/D/L) distribution on
+    logistic Elo; LLR >= upper accepts H1, LLR <= lower accepts H0.
+    """
+    bounds = (math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha))
+    games = wins + draws + losses
+    if not games or wins + losses == 0:
+        return 0.0, bounds
+    score = (wins + draws / 2) / games
+    variance = ((wins + draws / 4) / games - score ** 2) / games
+    if variance <= 0:
+        return 0.0, bounds
+    s0 = 1 / (1 + 10 ** (-elo0 / 400))
+    s1 = 1 / (1 + 10 ** (-elo1 / 400))
+    return (s1 - s0) * (2 * score - s0 - s1) / (2 * variance), bounds
+
+
+def schedule(openings, games):
+    """(fen, a_plays_white) for games games, each opening twice with colours reversed."""
+    pairs = []
+    while len(pairs) < games:
+        for fen in openings:
+            pairs.append((fen, True))
+            pairs.append((fen, False))
+    return pairs[:games]
+
+
+def run_match(engine_a, engine_b, openings=OPENINGS, games=100, workers=None, pgn_out=None, sprt_bounds=None,
+              adjudication=None, tt_size_mb=ai.TT_SIZE_MB, report=None):
+    """Play engine_a against engine_b; returns (wins, draws, losses) from engine_a's side.
+
+    sprt_bounds=(elo0, elo1) stops the match once the SPRT decides. report,
+    if given, is called with the running (wins, draws, losses) after every
+    game. At most a few games per worker are queued at a time, so an early
+    stop does not wait for the whole schedule.
+    """
+    workers = workers or os.cpu_count() or 1
+    window = 2 * workers
+    pending = iter(enumerate(schedule(openings, games), 1))
+    wins = draws = losses = 0
+    with ProcessPoolExecutor(workers, initializer=ai.resize_transposition_table, initargs=(tt_size_mb,)) as executor:
+        in_flight = {}
+
+        def fill():
+            for round_number, (fen, a_white) in pending:
+                white, black = (engine_a, engine_b) if a_white else (engine_b, engine_a)
+                in_flight[executor.submit(play_game, fen, white, black, adjudication)] = round_number
+                if len(in_flight) >= window:
+                    break
+
+        fill()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                round_number = in_flight.pop(future)
+                record = future.result()
+                points = score_for(record, engine_a["name"])
+                wins += points == 1.0
+                draws += points == 0.5
+                losses += points == 0.0
+                if pgn_out is not None:
+                    print(game_to_pgn(record, round_number), file=pgn_out, end="\n\n")
+                    pgn_out.flush()
+                if report is not None:
+                    report(wins, draws, losses)
+            if sprt_bounds is not None:
+                llr, (lower, upper) = sprt(wins, draws, losses, *sprt_bounds)
+                if llr <= lower or llr >= upper:
+                    for future in in_flight:
+                        future.cancel()
+                    break
+            fill()
+    return wins, draws, losses
+
+
+def format_status(wins, draws, losses, sprt_bounds=None):
+    """One status line: games, W/D/L, Elo with error margin and the SPRT state."""
+    difference, margin = elo_estimate(wins, draws, losses)
+    line = f"games {wins + draws + losses}: +{wins} ={draws} -{losses}  elo {difference:+.1f} +/- {margin:.1f}"
+    if sprt_bounds is not None:
+        llr, (lower, upper) = sprt(wins, draws, losses, *sprt_bounds)
+        line += f"  llr {llr:.2f} [{lower:.2f}, {upper:.2f}]"
+        if llr >= upper:
+            line += " H1 accepted"
+        elif llr <= lower:
+            line += " H0 accepted"
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("engine_a", help="engine under test, e.g. new:time=0.1")
+    parser.add_argument("engine_b", help="reference engine, e.g. base:time=0.1,lmr=0")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, help="worker processes (default: all cores)")
+    parser.add_argument("--openings", help="FEN or EPD file of start positions (default: built-in suite)")
+    parser.add_argument("--pgn", help="append finished games to this PGN file")
+    parser.add_argument("--sprt", nargs=2, type=float, metavar=("ELO0", "ELO1"),
+                        help="stop once the SPRT accepts elo0 or elo1")
+    parser.add_argument("--resign-score", type=int, default=RESIGN_SCORE, help="centipawns, 0 = never")
+    parser.add_argument("--draw-score", type=int, default=DRAW_SCORE, help="centipawns, -1 = never")
+    parser.add_argument("--max-plies", type=int, default=MAX_PLIES)
+    parser.add_argument("--tt-mb", type=int, default=ai.TT_SIZE_MB, help="transposition table size per worker")
+    args = parser.parse_args(argv)
+
+    engine_a, engine_b = parse_engine(args.engine_a), parse_engine(args.engine_b)
+    if engine_a["name"] == engine_b["name"]:
+        parser.error("the two engines need different names")
+    openings = read_openings(args.openings) if args.openings else OPENINGS
+    adjudication = {"resign_score": args.resign_score or None, "draw_score": args.draw_score,
+                    "max_plies": args.max_plies}
+    sprt_bounds = tuple(args.sprt) if args.sprt else None
+    pgn_out = open(args.pgn, "a") if args.pgn else None
+    try:
+        wins, draws, losses = run_match(
+            engine_a, engine_b, openings, args.games, args.workers, pgn_out, sprt_bounds, adjudication,
+            args.tt_mb, report=lambda *wdl: print(format_status(*wdl, sprt_bounds), file=sys.stderr))
+    finally:
+        if pgn_out is not None:
+            pgn_out.close()
+    print(f"{engine_a['name']} vs {engine_b['name']}: {format_status(wins, draws, losses, sprt_bounds)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""HTTP engine server for many concurrent games.
+
+    python server.py --port 8080 --workers 4
+
+serves JSON over HTTP/1.1 (keep-alive) with asyncio:
+
+    POST   /games                 {"fen": ...}            -> {"game": id, "fen": ...}
+    POST   /games/<id>/move       {"move": "e2e4", "time": 1.0}
+                                  plays the client's move (if given), then the
+                                  engine's reply -> {"move", "score", "depth",
+                                  "nodes", "fen", "result"}
+    DELETE /games/<id>
+    GET    /metrics               queue, rejection and latency figures
+
+Searches run in a fixed pool of engine processes. A game is assigned to the
+least loaded worker when it is created and stays there, so its searches keep
+hitting that process's transposition table. The time budget of a request
+covers its wait in the queue as well: the search gets what is left, and a
+request whose budget ran out before it was searched is answered with 504.
+At most --max-queue searches may be queued or running at once; further move
+requests are answered with 503 and a Retry-After header right away.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import chess
+
+import ai
+
+DEFAULT_MOVE_TIME = 1.0
+MAX_MOVE_TIME = 10.0
+# Latencies kept for the percentiles in /metrics.
+LATENCY_WINDOW = 1000
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error",
+               503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def search_move(fen, moves, deadline, options):
+    """Search the position after the UCI moves from fen until the wall-clock deadline.
+
+    The moves are replayed so the search sees the game's history (and with
+    it repetitions). Returns None if the deadline has already passed. The
+    result includes when the search started, so the server can tell how
+    long the request waited for the worker.
+    """
+    started = time.time()
+    if started >= deadline:
+        return None
+    board = chess.Board(fen)
+    for move in moves:
+        board.push_uci(move)
+    result = ai.search(board, deadline - started, **options)
+    score = None if math.isinf(result.score) else round(result.score, 2)
+    return {"move": result.move.uci() if result.move else None, "score": score,
+            "depth": result.depth, "nodes": result.nodes, "started": started}
+
+
+class Game:
+    def __init__(self, game_id, board, worker):
+        self.id = game_id
+        self.board = board
+        self.worker = worker
+        # Move requests of one game are served one at a time, in order.
+        self.lock = asyncio.Lock()
+
+
+def percentile(values, fraction):
+    """The value at fraction (0..1) of the sorted values, or None if there are none."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class EngineServer:
+    """Games, the worker pool and the metrics; handle() serves one connection."""
+
+    def __init__(self, workers=1, max_queue=None, tt_size_mb=ai.TT_SIZE_MB, max_time=MAX_MOVE_TIME, options=None):
+        self.tt_size_mb = tt_size_mb
+        self.executors = [self.new_executor() for _ in range(workers)]
+        self.max_queue = max_queue or 4 * workers
+        self.max_time = max_time
+        self.options = options or {}
+        self.games = {}
+        self._ids = itertools.count(1)
+        self.worker_games = [0] * workers
+        self.worker_queued = [0] * workers
+        self.requests = self.rejected = self.timeouts = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.queue_waits = deque(maxlen=LATENCY_WINDOW)
+
+    def new_executor(self):
+        return ProcessPoolExecutor(1, initializer=ai.resize_transposition_table, initargs=(self.tt_size_mb,))
+
+    @property
+    def queued(self):
+        return sum(self.worker_queued)
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown(cancel_futures=True)
+
+    def new_game(self, body):
+        try:
+            board = chess.Board(body.get("fen", chess.STARTING_FEN))
+        except ValueError as error:
+            raise HTTPError(400, f"bad fen: {error}")
+        worker = min(range(len(self.executors)), key=lambda i: (self.worker_games[i], self.worker_queued[i]))
+        game = Game(str(next(self._ids)), board, worker)
+        self.games[game.id] = game
+        self.worker_games[worker] += 1
+        return {"game": game.id, "fen": board.fen()}
+
+    def end_game(self, game_id):
+        game = self.get_game(game_id)
+        del self.games[game_id]
+        self.worker_games[game.worker] -= 1
+        return {"game": game_id}
+
+    def get_game(self, game_id):
+        game = self.games.get(game_id)
+        if game is None:
+            raise HTTPError(404, f"no game {game_id}")
+        return game
+
+    async def move(self, game_id, body):
+        game = self.get_game(game_id)
+        try:
+            budget = float(body.get("time", DEFAULT_MOVE_TIME))
+        except (TypeError, ValueError):
+            budget = math.nan
+        if not math.isfinite(budget) or budget <= 0:
+            raise HTTPError(400, "time must be a positive number of seconds")
+        budget = min(budget, self.max_time)
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise HTTPError(503, "engine queue is full")
+        start = time.time()
+        self.worker_queued[game.worker] += 1
+        try:
+            async with game.lock:
+                board = game.board
+                ply = len(board.move_stack)
+                if "move" in body:
+                    try:
+                        move = chess.Move.from_uci(str(body["move"]))
+                    except ValueError:
+                        move = None
+                    if move is None or move not in board.legal_moves:
+                        raise HTTPError(400, f"illegal move {body['move']}")
+                    board.push(move)
+                try:
+                    if board.is_game_over():
+                        return self.position(board)
+                    searched = await self.search(game, start + budget)
+                    self.queue_waits.append(searched.pop("started") - start)
+                    board.push_uci(searched["move"])
+                    return {**searched, **self.position(board)}
+                except BaseException:
+                    # No reply: take the client's move back so the request can be retried.
+                    while len(board.move_stack) > ply:
+                        board.pop()
+                    raise
+        finally:
+            self.worker_queued[game.worker] -= 1
+            self.requests += 1
+            self.latencies.append(time.time() - start)
+
+    async def search(self, game, deadline):
+        board = game.board
+        loop = asyncio.get_running_loop()
+        try:
+            searched = await loop.run_in_executor(self.executors[game.worker], search_move, board.root().fen(),
+                                                  [move.uci() for move in board.move_stack], deadline, self.options)
+        except BrokenProcessPool:
+            # The worker process died; later requests get a fresh one (with an empty table).
+            self.executors[game.worker].shutdown(wait=False)
+            self.executors[game.worker] = self.new_executor()
+            raise HTTPError(500, "engine worker failed")
+        except Exception as error:
+            raise HTTPError(500, f"engine worker failed: {error}")
+        if searched is None:
+            self.timeouts += 1
+            raise HTTPError(504, "time budget spent waiting for a worker")
+        return searched
+
+    @staticmethod
+    def position(board):
+        return {"fen": board.fen(), "result": board.result() if board.is_game_over() else None}
+
+    def metrics(self):
+        def ms(value):
+            return None if value is None else round(value * 1000, 1)
+
+        return {"games": len(self.games), "requests": self.requests, "rejected": self.rejected,
+                "timeouts": self.timeouts, "queued": self.queued, "max_queue": self.max_queue,
+                "workers": [{"games": games, "queued": queued}
+                            for games, queued in zip(self.worker_games, self.worker_queued)],
+                "latency_ms": {name: ms(percentile(self.latencies, fraction))
+                               for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))},
+                "queue_wait_ms": {"p50": ms(percentile(self.queue_waits, 0.5)),
+                                  "p99": ms(percentile(self.queue_waits, 0.99))}}
+
+    async def route(self, method, path, body):
+        parts = path.strip("/").split("/")
+        if parts == ["games"] and method == "POST":
+            return self.new_game(body)
+        if len(parts) == 2 and parts[0] == "games" and method == "DELETE":
+            return self.end_game(parts[1])
+        if len(parts) == 3 and parts[0] == "games" and parts[2] == "move" and method == "POST":
+            return await self.move(parts[1], body)
+        if parts == ["metrics"] and method == "GET":
+            return self.metrics()
+        raise HTTPError(404, f"no route for {method} {path}")
+
+    async def handle(self, reader, writer):
+        """Serve HTTP requests on one connection until the client closes it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                    length = int(headers.get("content-length", 0))
+                    if length < 0:
+                        raise ValueError("negative content length")
+                except ValueError:
+                    # Without a request line or a body length the stream cannot be followed: answer and close.
+                    writer.write(format_response(400, {"error": "malformed request"}, close=True))
+                    await writer.drain()
+                    break
+                raw = await reader.readexactly(length) if length else b""
+                status, extra = 200, {}
+                try:
+                    try:
+                        body = json.loads(raw) if raw else {}
+                    except ValueError:
+                        raise HTTPError(400, "body is not JSON")
+                    if not isinstance(body, dict):
+                        raise HTTPError(400, "body must be a JSON object")
+                    response = await self.route(method, path, body)
+                except HTTPError as error:
+                    status, response = error.status, {"error": str(error)}
+                    if status == 503:
+                        extra["Retry-After"] = "1"
+                close = headers.get("connection", "").lower() == "close"
+                writer.write(format_response(status, response, extra, close))
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def format_response(status, payload, headers=None, close=False):
+    body = json.dumps(payload).encode()
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}", "Content-Type: application/json",
+             f"Content-Length: {len(body)}", f"Connection: {'close' if close else 'keep-alive'}"]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+async def serve(host, port, engine, ready=None):
+    """Serve engine on host:port until cancelled; ready, if given, gets the bound port."""
+    server = await asyncio.start_server(engine.handle, host, port)
+    if ready is not None:
+        ready(server.sockets[0].getsockname()[1])
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=1, help="engine processes")
+    parser.add_argument("--max-queue", type=int, help="searches queued or running before 503 (default: 4 per worker)")
+    parser.add_argument("--max-time", type=float, default=MAX_MOVE_TIME, help="cap on a request's time budget")
+    parser.add_argument("--tt-mb", type=int, default=ai.TT_SIZE_MB, help="transposition table size per worker")
+    parser.add_argument("--options", default="", help="search option overrides, e.g. lmr=0,null_move=0")
+    args = parser.parse_args(argv)
+
+    engine = EngineServer(args.workers, args.max_queue, args.tt_mb, args.max_time,
+                          ai.parse_search_options(args.options))
+    try:
+        asyncio.run(serve(args.host, args.port, engine,
+                          ready=lambda port: print(f"listening on {args.host}:{port}", file=sys.stderr)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
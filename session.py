@@ -0,0 +1,188 @@
+"""Game sessions and the engine worker behind them.
+
+The GUI owns one EngineWorker for the life of the process: a single thread
+that takes requests from a queue (search a move, ponder, start a new game)
+and hands results back through another queue. Every request carries its own
+copy of the position, so the engine never touches the board the UI draws
+from, and its own stop event, so it can be cancelled. A GameSession holds
+the board of one game and applies the engine's moves on the UI thread when
+it polls.
+"""
+import itertools
+import queue
+import threading
+
+import chess
+
+import ai
+
+
+class EngineWorker:
+    """One long-lived engine thread serving requests in order.
+
+    notify, if given, is called from the worker thread whenever a result is
+    ready (e.g. to wake up an event loop that then calls poll()).
+    """
+
+    def __init__(self, notify=None):
+        self.notify = notify
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self._ids = itertools.count(1)
+        self._active = {}  # request id -> (kind, stop event) for requests not finished yet
+        self._lock = threading.Lock()
+        self._ponder = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _submit(self, kind, board=None, max_time=None):
+        request_id = next(self._ids)
+        stop_event = threading.Event()
+        with self._lock:
+            self._active[request_id] = (kind, stop_event)
+        self.requests.put((request_id, kind, board, max_time, stop_event))
+        return request_id
+
+    def new_game(self):
+        """Cancel everything outstanding and start the next game with an empty transposition table."""
+        self.cancel_all()
+        return self._submit("new_game")
+
+    def ponder(self, board):
+        """Search on the opponent's time from board (opponent to move) until the next move request."""
+        return self._submit("ponder", board.copy())
+
+    def best_move(self, board, max_time):
+        """Request a move for board; the result arrives through poll() under the returned id."""
+        # Whatever is being pondered now has served its purpose.
+        with self._lock:
+            for kind, stop_event in self._active.values():
+                if kind == "ponder":
+                    stop_event.set()
+        return self._submit("move", board.copy(), max_time)
+
+    def cancel(self, request_id):
+        with self._lock:
+            _, stop_event = self._active.get(request_id, (None, None))
+        if stop_event is not None:
+            stop_event.set()
+
+    def cancel_all(self):
+        with self._lock:
+            for _, stop_event in self._active.values():
+                stop_event.set()
+
+    def poll(self):
+        """(request id, move) pairs finished since the last call."""
+        finished = []
+        while True:
+            try:
+                finished.append(self.results.get_nowait())
+            except queue.Empty:
+                return finished
+
+    def close(self):
+        self.cancel_all()
+        self.requests.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            request_id, kind, board, max_time, stop_event = request
+            try:
+                if stop_event.is_set():
+                    move = None
+                elif kind == "new_game":
+                    self._ponder = None
+                    ai.clear_transposition_table()
+                    move = None
+                elif kind == "ponder":
+                    self._ponder = ai.PonderSearch(board, stop_event, background=False)
+                    self._ponder.run()
+                    continue
+                else:
+                    ponder, self._ponder = self._ponder, None
+                    if ponder is not None:
+                        move = ponder.best_move(board, max_time, stop_event=stop_event)
+                    else:
+                        move = ai.get_best_move_time_limited(board, max_time, stop_event=stop_event)
+                if kind == "move" and not stop_event.is_set():
+                    self.results.put((request_id, move))
+                    if self.notify is not None:
+                        self.notify()
+            finally:
+                with self._lock:
+                    self._active.pop(request_id, None)
+
+
+RESULT_MESSAGES = {"1-0": "White Wins!", "0-1": "Black Wins!"}
+
+
+class GameSession:
+    """One game of the user against the engine.
+
+    The board is only changed on the caller's (UI) thread: by user_move()
+    and by poll(), which applies the engine's answer once it has arrived.
+    """
+
+    def __init__(self, engine, user_plays_white=True, max_time=2.0, ponder=True):
+        self.engine = engine
+        self.user_color = chess.WHITE if user_plays_white else chess.BLACK
+        self.max_time = max_time
+        self.use_ponder = ponder
+        self.board = chess.Board()
+        self.last_move = None
+        self.pending = None
+        engine.new_game()
+        if not user_plays_white:
+            self._request_move()
+
+    @property
+    def ai_thinking(self):
+        return self.pending is not None
+
+    @property
+    def user_to_move(self):
+        return self.board.turn == self.user_color and not self.ai_thinking and not self.game_over
+
+    @property
+    def game_over(self):
+        return self.board.is_game_over()
+
+    def result_message(self):
+        return RESULT_MESSAGES.get(self.board.result(), "Draw!")
+
+    def user_move(self, move):
+        """Play the user's move and ask the engine for its reply; False if the move is not allowed now."""
+        if not self.user_to_move or move not in self.board.legal_moves:
+            return False
+        self.board.push(move)
+        self.last_move = move
+        if not self.game_over:
+            self._request_move()
+        return True
+
+    def _request_move(self):
+        self.pending = self.engine.best_move(self.board, self.max_time)
+
+    def poll(self):
+        """Apply the engine's move if it has arrived; returns True if the board changed."""
+        changed = False
+        for request_id, move in self.engine.poll():
+            if request_id != self.pending or move is None:
+                continue
+            self.board.push(move)
+            self.last_move = move
+            self.pending = None
+            changed = True
+            if self.use_ponder and not self.game_over:
+                self.engine.ponder(self.board)
+        return changed
+
+    def close(self):
+        """Stop all engine work for this game (the worker itself keeps running)."""
+        self.engine.cancel_all()
+        self.pending = None
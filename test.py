@@ -1,7 +1,13 @@
 import unittest
 import chess
-from evaluation import evaluate_board
-from ai import get_best_move_time_limited
+from evaluation import evaluate_board, evaluate_board_bitboard, evaluate_batch, material_pst, material_pst_delta
+import json
+import os
+import random
+import time
+import ai
+from ai import get_best_move_time_limited, compute_zobrist_hash, make_move
+from transposition import TranspositionTable, TT_EXACT, TT_ALPHA, encode_move
 
 class TestChessAI(unittest.TestCase):
 
@@ -76,5 +82,983 @@ class TestChessAI(unittest.TestCase):
         move = get_best_move_time_limited(board, max_time=1.0)
         self.assertIsNone(move, "AI should not return a move in a stalemate position")
 
+
+class TestIncrementalEvaluation(unittest.TestCase):
+
+    def test_incremental_material_pst_matches_full_evaluation(self):
+        fens = [
+            chess.STARTING_FEN,
+            "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+            "n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1",
+            "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+        ]
+        rng = random.Random(11)
+        for fen in fens:
+            for _ in range(5):
+                board = chess.Board(fen)
+                score = material_pst(board)
+                for _ in range(60):
+                    moves = list(board.legal_moves)
+                    if not moves:
+                        break
+                    move = rng.choice(moves)
+                    score += material_pst_delta(board, move)
+                    board.push(move)
+                    self.assertEqual(score, material_pst(board), board.fen())
+                    self.assertEqual(evaluate_board(board, score), evaluate_board(board))
+
+class TestBitboardEvaluation(unittest.TestCase):
+
+    def test_backends_agree_with_evaluate_board(self):
+        rng = random.Random(5)
+        boards = [
+            chess.Board("7k/5Q2/6K1/8/8/8/8/8 b - - 0 1"),  # stalemate
+            chess.Board("rnb1kbnr/pppp1ppp/8/4p3/6Pq/5P2/PPPPP2P/RNBQKBNR w KQkq - 1 3"),  # mate
+        ]
+        for _ in range(40):
+            board = chess.Board()
+            for _ in range(rng.randrange(100)):
+                moves = list(board.legal_moves)
+                if not moves:
+                    break
+                board.push(rng.choice(moves))
+            boards.append(board)
+        expected = [evaluate_board(board) for board in boards]
+        self.assertEqual([evaluate_board_bitboard(board) for board in boards], expected)
+        self.assertEqual(list(evaluate_batch(boards)), expected)
+
+class TestEvaluationCaches(unittest.TestCase):
+
+    def test_pawn_structure_terms(self):
+        import evaluation
+        # White: isolated a-pawn, doubled e-pawns, passed d-pawn on the fifth rank; Black: a7 and h7.
+        board = chess.Board("4k3/p6p/8/3P4/4P3/8/P3P3/4K3 w - - 0 1")
+        white = board.pawns & board.occupied_co[chess.WHITE]
+        black = board.pawns & board.occupied_co[chess.BLACK]
+        expected_white = (-evaluation.ISOLATED_PAWN_PENALTY - evaluation.DOUBLED_PAWN_PENALTY
+                          + evaluation.PASSED_PAWN_BONUS[4] + evaluation.PASSED_PAWN_BONUS[3]
+                          + evaluation.PASSED_PAWN_BONUS[1])
+        expected_black = -2 * evaluation.ISOLATED_PAWN_PENALTY + evaluation.PASSED_PAWN_BONUS[1]
+        self.assertEqual(evaluation.pawn_structure(white, black), expected_white - expected_black)
+        # Mirroring the position negates the score.
+        mirror = board.mirror()
+        self.assertEqual(evaluation.pawn_structure(mirror.pawns & mirror.occupied_co[chess.WHITE],
+                                                   mirror.pawns & mirror.occupied_co[chess.BLACK]),
+                         -evaluation.pawn_structure(white, black))
+
+    def test_pawn_hash_table(self):
+        import evaluation
+        table = evaluation.PawnHashTable(16)
+        board = chess.Board()
+        white, black = board.pawns & board.occupied_co[chess.WHITE], board.pawns & board.occupied_co[chess.BLACK]
+        self.assertEqual(table.score(white, black), evaluation.pawn_structure(white, black))
+        self.assertEqual(table.score(white, black), evaluation.pawn_structure(white, black))
+        self.assertEqual(table.score(0, 0), 0)
+        self.assertEqual((table.probes, table.hits), (3, 2))
+
+    def test_terminal_score_matches_game_over(self):
+        from evaluation import terminal_score
+        fivefold = chess.Board()
+        for _ in range(4):
+            for uci in ("g1f3", "g8f6", "f3g1", "f6g8"):
+                fivefold.push_uci(uci)
+        boards = [
+            chess.Board(),
+            chess.Board("7k/5Q2/6K1/8/8/8/8/8 b - - 0 1"),     # stalemate
+            chess.Board("7k/6Q1/6K1/8/8/8/8/8 b - - 0 1"),     # checkmate
+            chess.Board("8/8/4k3/8/8/3NK3/8/8 w - - 0 1"),     # insufficient material
+            chess.Board("8/8/4k3/8/8/3RK3/8/8 w - - 150 120"), # seventy-five moves
+            fivefold,
+        ]
+        for board in boards:
+            score = terminal_score(board, board.legal_moves.count())
+            self.assertEqual(score is not None, board.is_game_over(), board.fen())
+            if board.is_checkmate():
+                self.assertEqual(score, float("inf") if board.turn == chess.BLACK else float("-inf"))
+
+    def test_evaluation_cache_in_search(self):
+        ai.clear_transposition_table()
+        ai.clear_evaluation_caches()
+        board = chess.Board("r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4")
+        result = ai.search(board, max_time=None, max_depth=4)
+        self.assertGreater(result.stats.eval_hits, 0)
+        self.assertGreater(result.stats.pawn_hit_rate, 0.5)
+        key = compute_zobrist_hash(board)
+        self.assertEqual(ai.cached_evaluation(board, key), evaluate_board(board))
+        self.assertEqual(ai.evaluation_cache.probe(key), evaluate_board(board))
+
+class TestMoveOrdering(unittest.TestCase):
+
+    def test_captures_ordered_by_mvv_lva(self):
+        # White pawn and queen can both take the black queen
+        board = chess.Board("4k3/8/8/3q4/2P4r/8/8/3QK3 w - - 0 1")
+        moves = ai.order_moves(board)
+        self.assertEqual(moves[0], chess.Move.from_uci("c4d5"))
+        self.assertEqual(moves[1], chess.Move.from_uci("d1d5"))
+        self.assertEqual(len(board.move_stack), 0)
+
+    def test_tt_move_then_killers_first(self):
+        board = chess.Board()
+        key = compute_zobrist_hash(board)
+        ctx = ai.SearchContext()
+        tt_move = chess.Move.from_uci("b1c3")
+        killer = chess.Move.from_uci("g2g3")
+        ai.store_transposition(key, 1, 0.0, TT_EXACT, tt_move)
+        ctx.record_cutoff(board, killer, 3)
+        moves = ai.order_moves(board, key, ctx)
+        self.assertEqual(moves[:2], [tt_move, killer])
+        self.assertEqual(ctx.history[(chess.WHITE * 64 + chess.G2) * 64 + chess.G3], 9)
+
+class TestNativeBoard(unittest.TestCase):
+
+    def test_perft_matches_published_counts(self):
+        from bench import PERFT_POSITIONS
+        from nativeboard import NativeBoard, perft
+        for fen, counts in PERFT_POSITIONS:
+            self.assertEqual(perft(NativeBoard(fen), 2), counts[1], fen)
+
+    def test_random_games_match_python_chess(self):
+        from nativeboard import NativeBoard
+        rng = random.Random(7)
+        for _ in range(10):
+            board = chess.Board()
+            native = NativeBoard.from_board(board)
+            while not board.is_game_over() and board.ply() < 150:
+                moves = list(board.legal_moves)
+                self.assertEqual(list(native.legal_moves), moves, board.fen())
+                self.assertEqual([native.gives_check(m) for m in moves], [board.gives_check(m) for m in moves])
+                self.assertEqual(native.is_check(), board.is_check())
+                move = rng.choice(moves)
+                board.push(move)
+                native.push(move)
+                self.assertEqual(native.fen(), board.fen())
+            self.assertEqual(native.is_game_over(), board.is_game_over())
+            while board.move_stack:
+                board.pop()
+                native.pop()
+            self.assertEqual(native.fen(), board.fen())
+
+    def test_repetition_ignores_unusable_en_passant_square(self):
+        from nativeboard import NativeBoard
+        board = chess.Board()
+        board.push_uci("e2e4")
+        for _ in range(4):
+            for uci in ("g8f6", "g1f3", "f6g8", "f3g1"):
+                board.push_uci(uci)
+        native = NativeBoard.from_board(board)
+        self.assertTrue(board.is_fivefold_repetition())
+        self.assertTrue(native.is_fivefold_repetition())
+        self.assertEqual(ai.terminal_score(native, native.legal_moves.count()),
+                         ai.terminal_score(board, board.legal_moves.count()))
+        # A legal en passant capture makes the position before it unrepeatable.
+        board = chess.Board("4k3/8/8/8/3p4/8/4P3/4K2N w - - 0 1")
+        board.push_uci("e2e4")
+        for _ in range(2):
+            for uci in ("e8d8", "h1g3", "d8e8", "g3h1"):
+                board.push_uci(uci)
+        native = NativeBoard.from_board(board)
+        self.assertEqual((native.is_repetition(2), native.is_repetition(3)), (True, False))
+        self.assertEqual((board.is_repetition(2), board.is_repetition(3)), (True, False))
+
+    def test_undo_slots_grow_past_a_chunk(self):
+        from nativeboard import UNDO_CHUNK, NativeBoard
+        board = chess.Board()
+        native = NativeBoard()
+        shuffle = [chess.Move.from_uci(uci) for uci in ("g1f3", "g8f6", "f3g1", "f6g8")]
+        for i in range(UNDO_CHUNK + 10):
+            board.push(shuffle[i % 4])
+            native.push(shuffle[i % 4])
+        copy = native.copy()
+        while native.move_stack:
+            native.pop()
+        self.assertEqual(native.fen(), chess.STARTING_FEN)
+        board.pop()
+        copy.pop()
+        self.assertEqual(copy.fen(), board.fen())
+
+    def test_search_is_unchanged(self):
+        board = chess.Board("r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4")
+        results = []
+        for native in (False, True):
+            ai.clear_transposition_table()
+            ai.clear_evaluation_caches()
+            result = ai.search(board, None, 3, native_board=native)
+            results.append((result.move, result.score, result.nodes))
+        self.assertEqual(results[0], results[1])
+
+class TestTimeManagement(unittest.TestCase):
+
+    def test_search_respects_hard_limit(self):
+        board = chess.Board("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+        for max_time in (0.3, 1.0):
+            ai.clear_transposition_table()
+            start = time.monotonic()
+            move = get_best_move_time_limited(board, max_time=max_time)
+            self.assertIn(move, board.legal_moves)
+            self.assertLess(time.monotonic() - start, max_time + 0.25)
+
+    def test_expired_deadline_aborts_search(self):
+        ctx = ai.SearchContext(ai.TimeManager(0.0))
+        ctx.nodes = ai.TIME_CHECK_INTERVAL - 1
+        with self.assertRaises(ai.SearchTimeout):
+            ai.minimax_alpha_beta(chess.Board(), 3, float("-inf"), float("inf"), True, ctx=ctx)
+
+    def test_single_legal_move_returned_immediately(self):
+        board = chess.Board("k7/8/1K6/8/8/8/8/2R5 b - - 0 1")
+        self.assertEqual(list(board.legal_moves), [chess.Move.from_uci("a8b8")])
+        start = time.monotonic()
+        self.assertEqual(get_best_move_time_limited(board, max_time=1.0), chess.Move.from_uci("a8b8"))
+        self.assertLess(time.monotonic() - start, 0.1)
+
+class TestPrincipalVariationSearch(unittest.TestCase):
+
+    FENS = [
+        "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4",
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    ]
+
+    def test_pvs_and_aspiration_match_plain_alpha_beta(self):
+        for fen in self.FENS:
+            results = []
+            for options in ({"pvs": False, "aspiration": False}, {"pvs": True, "aspiration": False}, {}):
+                ai.clear_transposition_table()
+                results.append(ai.search(chess.Board(fen), max_time=None, max_depth=3, **options))
+            self.assertEqual(len({round(r.score, 6) for r in results}), 1, fen)
+
+    def test_mate_in_one_at_every_depth(self):
+        board = chess.Board("6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1")
+        result = ai.search(board, max_time=None, max_depth=4)
+        self.assertEqual(result.move, chess.Move.from_uci("d1d8"))
+        self.assertEqual(result.score, float("inf"))
+
+    def test_minimax_wrapper_scores_from_whites_point_of_view(self):
+        # Black to move wins the undefended queen
+        board = chess.Board("4k3/8/8/3q4/8/8/Q7/4K3 b - - 0 1")
+        ai.clear_transposition_table()
+        self.assertLess(ai.minimax_alpha_beta(board, 2, float("-inf"), float("inf"), False), -500)
+
+class TestSelectiveSearch(unittest.TestCase):
+
+    OFF = {"null_move": False, "lmr": False, "futility": False, "razoring": False}
+
+    def test_selective_features_reduce_nodes(self):
+        board = chess.Board("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+        ai.clear_transposition_table()
+        full = ai.search(board, max_time=None, max_depth=4, **self.OFF)
+        ai.clear_transposition_table()
+        selective = ai.search(board, max_time=None, max_depth=4)
+        self.assertLess(selective.nodes, full.nodes)
+        self.assertIn(selective.move, board.legal_moves)
+
+    def test_each_feature_switches_individually(self):
+        board = chess.Board("r1bq1rk1/pp2ppbp/2np1np1/8/3NP3/2N1BP2/PPPQ2PP/R3KB1R w KQ - 3 9")
+        nodes = set()
+        for feature in self.OFF:
+            ai.clear_transposition_table()
+            nodes.add(ai.search(board, max_time=None, max_depth=4, **dict(self.OFF, **{feature: True})).nodes)
+        self.assertEqual(len(nodes), len(self.OFF))
+
+    def test_null_move_hash(self):
+        board = chess.Board("rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3")
+        key = ai.make_null_move(board, compute_zobrist_hash(board))
+        self.assertEqual(key, compute_zobrist_hash(board))
+
+    def test_finds_mate_with_pruning_enabled(self):
+        # Back-rank mate in one; forward pruning must not hide it
+        board = chess.Board("6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1")
+        self.assertEqual(ai.search(board, max_time=None, max_depth=5).move, chess.Move.from_uci("d1d8"))
+
+class TestParallelSearch(unittest.TestCase):
+
+    def tearDown(self):
+        ai.close_parallel_searches()
+
+    def test_workers_share_the_transposition_table(self):
+        board = chess.Board("r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4")
+        result = ai.search(board, max_time=None, max_depth=3, workers=2)
+        self.assertIn(result.move, board.legal_moves)
+        self.assertEqual(result.depth, 3)
+        # Entries written by the worker processes are visible to the parent
+        entry = ai.get_parallel_search(2).table.probe(compute_zobrist_hash(board))
+        self.assertIsNotNone(entry)
+        self.assertGreaterEqual(entry[0], 3)
+
+    def test_time_limited_parallel_move(self):
+        board = chess.Board()
+        start = time.monotonic()
+        move = get_best_move_time_limited(board, max_time=0.5, workers=2)
+        self.assertIn(move, board.legal_moves)
+        self.assertLess(time.monotonic() - start, 1.5)
+
+    def test_stop_event_iterations_and_stale_results(self):
+        import threading
+        board = chess.Board()
+        stop_event = threading.Event()
+        iterations = []
+        threading.Timer(0.5, stop_event.set).start()
+        start = time.monotonic()
+        result = ai.search(board, max_time=None, workers=2, stop_event=stop_event, on_iteration=iterations.append)
+        self.assertLess(time.monotonic() - start, 3.0)
+        self.assertIn(result.move, board.legal_moves)
+        self.assertEqual([info.depth for info in iterations], list(range(1, len(iterations) + 1)))
+        # Whatever the stopped search still reports is not taken for the next one.
+        other = chess.Board("6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1")
+        self.assertEqual(ai.search(other, max_time=None, max_depth=2, workers=2).move, chess.Move.from_uci("d1d8"))
+        self.assertLessEqual(ai.search(board, max_time=None, max_depth=64, workers=2, max_nodes=2000).nodes, 6000)
+
+class TestBatchAnalysis(unittest.TestCase):
+
+    def test_forced_move_is_searched(self):
+        import batch
+        batch._init_worker(None, 4, 1, {})
+        try:
+            record = batch.analyse(0, {"fen": "7k/8/6K1/8/8/8/8/R7 b - - 0 1"})
+        finally:
+            ai.resize_transposition_table(ai.TT_SIZE_MB)
+        self.assertEqual(record["move"], "h8g8")
+        self.assertEqual((record["score"], record["mate"]), (None, 1))
+        self.assertGreater(record["depth"], 0)
+
+    def test_analyse_file_and_resume(self):
+        import json
+        import tempfile
+        import batch
+        fens = [
+            chess.STARTING_FEN,
+            "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1",
+            "7k/5Q2/6K1/8/8/8/8/8 b - - 0 1",
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "positions.fen")
+            output = os.path.join(tmp, "out.jsonl")
+            with open(source, "w") as f:
+                f.write("\n".join(fens) + "\n")
+            with open(output, "w") as out:
+                batch.analyse_file(source, out, max_time=None, max_depth=2, workers=2)
+            with open(output) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual([r["index"] for r in records], [0, 1, 2])
+            self.assertEqual(records[1]["move"], "d1d8")
+            self.assertEqual(records[1]["mate"], 1)
+            self.assertIsNone(records[2]["move"])
+
+            # Drop the last result and resume: only that position is redone
+            with open(output, "w") as f:
+                f.write("\n".join(json.dumps(r) for r in records[:2]) + "\n")
+            with open(output, "a") as out:
+                count = batch.analyse_file(source, out, max_time=None, max_depth=2, workers=1,
+                                           skip=batch.completed_indices(output))
+            self.assertEqual(count, 1)
+            self.assertEqual(batch.completed_indices(output), {0, 1, 2})
+
+            # A run killed mid-write: the partial record is cut off before appending.
+            with open(output) as f:
+                lines = f.read().splitlines()
+            with open(output, "w") as f:
+                f.write(lines[0] + "\n" + lines[1][:10])
+            self.assertEqual(batch.drop_partial_line(output), 10)
+            with open(output, "a") as out:
+                batch.analyse_file(source, out, max_time=None, max_depth=2, workers=1,
+                                   skip=batch.completed_indices(output))
+            with open(output) as f:
+                self.assertEqual(sorted(json.loads(line)["index"] for line in f), [0, 1, 2])
+            self.assertEqual(batch.drop_partial_line(output), 0)
+
+class TestTuning(unittest.TestCase):
+
+    def test_parse_labeled_formats(self):
+        import tune
+        fen = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+        self.assertEqual(tune.parse_labeled(f"{fen} [0.5]")[1], 0.5)
+        self.assertEqual(tune.parse_labeled(f"{fen} 1-0")[1], 1.0)
+        board, result = tune.parse_labeled(f'{chess.Board(fen).epd()} c9 "0-1";')
+        self.assertEqual((board.epd(), result), (chess.Board(fen).epd(), 0.0))
+        self.assertIsNone(tune.parse_labeled("# comment"))
+        with self.assertRaises(ValueError):
+            tune.parse_labeled(fen)
+
+    def test_extracted_features_reproduce_evaluation(self):
+        import tempfile
+        import numpy as np
+        import evaluation
+        import tune
+        rng = random.Random(5)
+        boards, lines = [], []
+        while len(boards) < 30:
+            board = chess.Board()
+            for _ in range(rng.randrange(1, 60)):
+                if board.is_game_over():
+                    break
+                board.push(rng.choice(list(board.legal_moves)))
+            if board.is_game_over():
+                continue
+            boards.append(board)
+            lines.append(f"{board.fen()} [{rng.choice(['0.0', '0.5', '1.0'])}]")
+        lines.append("7k/6Q1/6K1/8/8/8/8/8 b - - 0 1 1-0")  # mate: not scored by the tuned terms
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "positions.epd")
+            with open(source, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            meta = tune.extract(source, os.path.join(tmp, "features"), workers=2, chunk_lines=8)
+            self.assertEqual((meta["positions"], meta["skipped"]), (30, 1))
+            records = tune.open_positions(os.path.join(tmp, "features"))
+            weights = tune.weights_from_parameters(evaluation.parameters())
+            scores = tune.evaluate_records(weights, records)
+            for board, score in zip(boards, scores):
+                self.assertAlmostEqual(score, evaluate_board(board), places=9)
+
+            # Analytic gradient against a central difference
+            loss, grad = tune.gradient(weights, records, 1.0)
+            self.assertAlmostEqual(loss, tune.loss(weights, records, 1.0))
+            for i in (1, tune.TABLES_START + 3 * 64 + 10, tune.MOBILITY_INDEX):
+                step = np.zeros(tune.WEIGHTS)
+                step[i] = 1e-4
+                numeric = (tune.loss(weights + step, records, 1.0) - tune.loss(weights - step, records, 1.0)) / 2e-4
+                self.assertAlmostEqual(grad[i], numeric, places=7)
+            tuned = tune.fit(records, weights, 1.0, epochs=5)
+            self.assertLess(tune.loss(tuned, records, 1.0), loss)
+            tuned[tune.MOBILITY_INDEX] = 0.1234
+            self.assertEqual(tune.parameters_from_weights(tuned)["mobility"], 0.1)
+
+    def test_load_parameters_keeps_evaluators_in_sync(self):
+        import tempfile
+        import evaluation
+        params = evaluation.parameters()
+        params["piece_values"]["knight"] = 350
+        params["tables"]["pawn"] = [value + 3 for value in params["tables"]["pawn"]]
+        params["mobility"] = 0.4873  # kept on the 0.05 grid the null window relies on
+        board = chess.Board("r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3")
+        before = evaluate_board(board)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "evaluation.json")
+            with open(path, "w") as f:
+                json.dump(params, f)
+            try:
+                ai.load_evaluation_parameters(path)
+                self.assertEqual(evaluation.PIECE_VALUES[chess.KNIGHT], 350)
+                self.assertEqual(evaluation.MOBILITY_WEIGHT, 0.5)
+                self.assertNotEqual(evaluate_board(board), before)
+                self.assertEqual(evaluate_board(board), evaluate_board_bitboard(board))
+                self.assertEqual(evaluate_batch([board])[0], evaluate_board(board))
+                move = chess.Move.from_uci("f3e5")
+                after = board.copy()
+                after.push(move)
+                self.assertEqual(material_pst(board) + material_pst_delta(board, move), material_pst(after))
+            finally:
+                ai.load_evaluation_parameters(None)
+        self.assertEqual(evaluate_board(board), before)
+        with self.assertRaises(ValueError):
+            evaluation.set_parameters({"tables": {"pawn": [0] * 63}})
+
+class TestSelfPlay(unittest.TestCase):
+
+    def test_statistics(self):
+        import selfplay
+        self.assertEqual(selfplay.elo_estimate(10, 0, 10)[0], 0.0)
+        difference, margin = selfplay.elo_estimate(60, 20, 20)
+        self.assertAlmostEqual(difference, selfplay.elo(0.7))
+        self.assertGreater(margin, 0)
+        llr, (lower, upper) = selfplay.sprt(600, 200, 200, 0, 10)
+        self.assertGreater(llr, upper)
+        llr, _ = selfplay.sprt(200, 200, 600, 0, 10)
+        self.assertLess(llr, lower)
+
+    def test_adjudication(self):
+        import selfplay
+        settings = {"resign_score": 500, "resign_moves": 2, "draw_score": 10, "draw_moves": 2, "draw_min_ply": 10}
+        self.assertEqual(selfplay.adjudicate([0, 600, 700, 800], 4, settings), (None, None))
+        self.assertEqual(selfplay.adjudicate([600, 700, 800, 900], 4, settings), ("1-0", "adjudication"))
+        self.assertEqual(selfplay.adjudicate([-600, -700, -800, -900], 4, settings), ("0-1", "adjudication"))
+        self.assertEqual(selfplay.adjudicate([5, 0, -5, 0], 4, settings), (None, None))
+        self.assertEqual(selfplay.adjudicate([5, 0, -5, 0], 10, settings), ("1/2-1/2", "adjudication"))
+        # --resign-score 0: no resignation, not even against a mate score.
+        settings["resign_score"] = None
+        self.assertEqual(selfplay.adjudicate([float("inf")] * 4, 4, settings), (None, None))
+        self.assertEqual(selfplay.adjudicate([float("-inf")] * 4, 4, settings), (None, None))
+
+    def test_match_writes_pgn(self):
+        import io
+        import chess.pgn
+        import selfplay
+        a = selfplay.parse_engine("a:depth=1")
+        b = selfplay.parse_engine("b:depth=1,futility=0")
+        self.assertEqual(b["options"], {"futility": False})
+        pgn = io.StringIO()
+        wins, draws, losses = selfplay.run_match(a, b, selfplay.OPENINGS[:1], games=2, workers=1, pgn_out=pgn,
+                                                 adjudication={"max_plies": 12})
+        self.assertEqual(wins + draws + losses, 2)
+        pgn.seek(0)
+        games = [chess.pgn.read_game(pgn) for _ in range(2)]
+        self.assertEqual({game.headers["White"] for game in games}, {"a", "b"})
+        self.assertEqual(games[0].headers["FEN"], selfplay.OPENINGS[0])
+
+    def test_engines_keep_separate_transposition_tables(self):
+        import selfplay
+        process_table = ai.transposition_table
+        fen = selfplay.OPENINGS[0]  # Black to move
+        a = selfplay.parse_engine("a:depth=2")
+        b = selfplay.parse_engine("b:depth=2,lmr=0")
+        selfplay.play_game(fen, a, b, {"max_plies": 2})
+        self.assertIs(ai.transposition_table, process_table)
+        root = compute_zobrist_hash(chess.Board(fen))
+        self.assertIsNotNone(selfplay.engine_table(1).probe(root))
+        self.assertIsNone(selfplay.engine_table(0).probe(root))
+
+class TestOpeningBook(unittest.TestCase):
+
+    PGN = """[Result "1-0"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. O-O Nf6 1-0
+
+[Result "1/2-1/2"]
+
+1. e4 c5 2. Nf3 d6 1/2-1/2
+
+[Result "0-1"]
+
+1. d4 d5 0-1
+"""
+
+    def setUp(self):
+        import tempfile
+        import book
+        self.tmp = tempfile.TemporaryDirectory()
+        pgn = os.path.join(self.tmp.name, "games.pgn")
+        with open(pgn, "w") as f:
+            f.write(self.PGN)
+        self.path = os.path.join(self.tmp.name, "book.bin")
+        self.count = book.build_book([pgn], self.path)
+        ai.set_opening_book(self.path)
+
+    def tearDown(self):
+        ai.set_opening_book(None)
+        self.tmp.cleanup()
+
+    def test_book_moves_and_weights(self):
+        book = ai.get_opening_book()
+        board = chess.Board()
+        # 1. e4 scored a win and a draw, 1. d4 only lost and is left out
+        self.assertEqual(book.moves(board), [(chess.Move.from_uci("e2e4"), 3)])
+        self.assertEqual(get_best_move_time_limited(board, max_time=2.0), chess.Move.from_uci("e2e4"))
+
+    def test_castling_round_trip(self):
+        board = chess.Board()
+        for san in ["e4", "e5", "Nf3", "Nc6", "Bc4", "Bc5"]:
+            board.push_san(san)
+        self.assertEqual(ai.get_opening_book().probe(board), chess.Move.from_uci("e1g1"))
+
+    def test_out_of_book_falls_back_to_search(self):
+        board = chess.Board("6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1")
+        self.assertIsNone(ai.get_opening_book().probe(board))
+        self.assertEqual(get_best_move_time_limited(board, max_time=1.0), chess.Move.from_uci("d1d8"))
+
+class TestBitbases(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import tempfile
+        import bitbase
+        cls.tmp = tempfile.TemporaryDirectory()
+        bitbase.generate_all(cls.tmp.name)
+        ai.set_bitbase_dir(cls.tmp.name)
+        cls.bitbases = ai.get_bitbases()
+
+    @classmethod
+    def tearDownClass(cls):
+        ai.set_bitbase_dir(None)
+        cls.tmp.cleanup()
+
+    def test_known_results(self):
+        from bitbase import WIN, DRAW, LOSS
+        cases = {
+            "4k3/8/4K3/4P3/8/8/8/8 b - - 0 1": LOSS,   # king on the sixth in front of the pawn
+            "8/8/8/8/8/4k3/4P3/4K3 w - - 0 1": DRAW,   # opposition held
+            "k7/8/K7/P7/8/8/8/8 w - - 0 1": DRAW,      # rook pawn
+            "7k/5Q2/6K1/8/8/8/8/8 b - - 0 1": DRAW,    # stalemate
+            "8/8/8/3k4/8/8/8/r3K3 w - - 0 1": LOSS,    # Black holds the rook
+            "8/8/8/8/8/4K3/4p3/4k3 b - - 0 1": WIN,
+        }
+        for fen, result in cases.items():
+            self.assertEqual(self.bitbases.probe(chess.Board(fen)), result, fen)
+        self.assertIsNone(self.bitbases.probe(chess.Board()))
+
+    def test_results_are_consistent_with_successors(self):
+        # Won positions have a move to a lost one; lost positions only have moves to won ones.
+        from bitbase import WIN, DRAW, LOSS
+        rng = random.Random(3)
+        checked = 0
+        while checked < 300:
+            board = chess.Board(None)
+            squares = rng.sample(range(64), 3)
+            board.set_piece_at(squares[0], chess.Piece(chess.KING, chess.WHITE))
+            board.set_piece_at(squares[1], chess.Piece(chess.KING, chess.BLACK))
+            board.set_piece_at(squares[2], chess.Piece(rng.choice([chess.PAWN, chess.ROOK, chess.QUEEN]),
+                                                       rng.choice(chess.COLORS)))
+            board.turn = rng.choice(chess.COLORS)
+            if not board.is_valid() or board.is_game_over():
+                continue
+            children = []
+            for move in board.legal_moves:
+                board.push(move)
+                if board.is_checkmate():
+                    children.append(LOSS)
+                else:
+                    children.append(self.bitbases.probe(board) or DRAW)
+                board.pop()
+            expected = WIN if LOSS in children else LOSS if all(c == WIN for c in children) else DRAW
+            self.assertEqual(self.bitbases.probe(board), expected, board.fen())
+            checked += 1
+
+    def test_search_uses_bitbases(self):
+        board = chess.Board("8/8/8/3k4/8/8/8/R3K3 w - - 0 1")
+        result = ai.search(board, max_time=None, max_depth=3)
+        self.assertGreater(result.score, ai.BITBASE_WIN_SCORE - 100)
+        board.push(result.move)
+        self.assertEqual(self.bitbases.probe(board), -1)
+        drawn = ai.search(chess.Board("k7/8/K7/P7/8/8/8/8 w - - 0 1"), max_time=None, max_depth=3)
+        self.assertEqual(drawn.score, 0.0)
+
+class TestPondering(unittest.TestCase):
+
+    def test_stop_event_ends_search(self):
+        import threading
+        stop = threading.Event()
+        stop.set()
+        start = time.time()
+        result = ai.search(chess.Board(), max_time=None, stop_event=stop)
+        self.assertLess(time.time() - start, 1.0)
+        self.assertIn(result.move, chess.Board().legal_moves)
+
+    def test_ponder_hit_and_miss(self):
+        board = chess.Board("r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4")
+        board.push(ai.get_best_move_time_limited(board, max_time=0.5, use_book=False))
+        ponder = ai.PonderSearch(board)
+        self.assertIsNotNone(ponder.move)
+        time.sleep(0.5)
+        hit = board.copy()
+        hit.push(ponder.move)
+        start = time.time()
+        move = ponder.best_move(hit, max_time=0.5, use_book=False)
+        self.assertLess(time.time() - start, 0.2)
+        self.assertEqual(move, ponder.result.move)
+
+        ponder = ai.PonderSearch(board)
+        miss = board.copy()
+        miss.push(next(m for m in board.legal_moves if m != ponder.move))
+        self.assertFalse(ponder.hit(miss))
+        self.assertIn(ponder.best_move(miss, max_time=0.3, use_book=False), miss.legal_moves)
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_perft_counts(self):
+        import bench
+        for fen, counts in bench.PERFT_POSITIONS:
+            self.assertEqual(bench.perft(chess.Board(fen), 2, check=True), counts[1], fen)
+        self.assertEqual(bench.perft(chess.Board(), 3), 8902)
+
+    def test_compare_reports(self):
+        import bench
+        baseline = bench.search_report(bench.BENCH_FENS[-2:], 2, [""])
+        # The last bench position is a mate in one, which must still be valid JSON.
+        current = json.loads(json.dumps(baseline, allow_nan=False))
+        self.assertEqual((current["runs"][0]["positions"][-1]["score"], current["runs"][0]["positions"][-1]["mate"]),
+                         (None, 1))
+        self.assertEqual([d["depth"] for d in current["runs"][0]["time_to_depth"]], [1, 2])
+        self.assertEqual(bench.compare_reports(baseline, current), [])
+        current["runs"][0]["nodes"] += 1
+        current["runs"][0]["nps"] = baseline["runs"][0]["nps"] / 2
+        self.assertEqual(len(bench.compare_reports(baseline, current)), 2)
+        self.assertEqual(len(bench.compare_reports(bench.bench_perft(1), current)), 1)
+
+class TestSearchStatistics(unittest.TestCase):
+
+    def test_iteration_callback_and_counters(self):
+        iterations = []
+        ai.clear_transposition_table()
+        result = ai.search(chess.Board(), max_time=None, max_depth=4, on_iteration=iterations.append)
+        self.assertEqual([info.depth for info in iterations], [1, 2, 3, 4])
+        self.assertEqual(iterations, result.iterations)
+        self.assertEqual(iterations[-1].move, result.move)
+        self.assertEqual(sum(info.stats.nodes for info in iterations), result.nodes)
+        self.assertEqual(result.stats.nodes, result.nodes)
+        stats = result.stats
+        self.assertGreater(stats.tt_probes, 0)
+        self.assertLessEqual(stats.tt_cutoffs, stats.tt_hits)
+        self.assertLessEqual(stats.tt_hits, stats.tt_probes)
+        self.assertLessEqual(stats.first_move_cutoffs, stats.beta_cutoffs)
+        self.assertGreater(stats.first_move_cutoff_rate, 0.5)
+        self.assertEqual(iterations[0].branching_factor, 0.0)
+        self.assertGreater(iterations[-1].branching_factor, 0.0)
+
+    def test_profile_search(self):
+        import pstats
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            ai.PROFILE_SEARCH = os.path.join(tmp, "search.prof")
+            try:
+                ai.search(chess.Board(), max_time=None, max_depth=2)
+            finally:
+                path, ai.PROFILE_SEARCH = ai.PROFILE_SEARCH, None
+            functions = {name for _, _, name in pstats.Stats(path).stats}
+            self.assertIn("negamax", functions)
+
+class TestUCI(unittest.TestCase):
+
+    def test_time_allocation(self):
+        import uci
+        self.assertAlmostEqual(uci.allocate_time(uci.parse_go(["movetime", "500"]), chess.WHITE), 0.45)
+        params = uci.parse_go(["wtime", "30000", "btime", "2000", "winc", "1000", "binc", "0"])
+        self.assertAlmostEqual(uci.allocate_time(params, chess.WHITE), 30 / 30 + 0.8 - 0.05)
+        self.assertAlmostEqual(uci.allocate_time(params, chess.BLACK), 2 / 30 - 0.05)
+        self.assertIsNone(uci.allocate_time(uci.parse_go(["infinite"]), chess.WHITE))
+        self.assertIsNone(uci.allocate_time(uci.parse_go(["depth", "3"]), chess.WHITE))
+        self.assertIsNone(uci.allocate_time(uci.parse_go(["mate", "2"]), chess.WHITE))
+        self.assertAlmostEqual(uci.allocate_time(uci.parse_go([]), chess.WHITE), uci.DEFAULT_MOVE_TIME - 0.05)
+        self.assertEqual(uci.search_depth(uci.parse_go(["mate", "2"])), 3)
+        self.assertEqual(uci.search_depth(uci.parse_go(["depth", "2", "mate", "3"])), 2)
+
+    def test_session(self):
+        import uci
+        lines = []
+        engine = uci.UCIEngine(output=lines.append)
+        engine.handle("uci")
+        self.assertEqual(lines[-1], "uciok")
+        engine.handle("position startpos moves e2e4 e7e5")
+        engine.handle("go depth 2")
+        engine.thread.join()  # let it finish; wait() would stop it
+        engine.wait()
+        self.assertTrue(lines[-1].startswith("bestmove "))
+        self.assertIn(chess.Move.from_uci(lines[-1].split()[1]), engine.board.legal_moves)
+        self.assertTrue(any(line.startswith("info depth 2 ") for line in lines))
+
+        # An infinite search only answers after stop; isready is answered meanwhile.
+        engine.handle("position fen 6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1")
+        engine.handle("go infinite")
+        time.sleep(0.2)
+        engine.handle("isready")
+        self.assertEqual(lines[-1], "readyok")
+        engine.handle("stop")
+        self.assertEqual(lines[-1], "bestmove d1d8")
+
+        # A bare go answers on its own after the default move time; go mate 1 after one ply.
+        for command in ("go", "go mate 1"):
+            engine.handle(command)
+            engine.thread.join(timeout=uci.DEFAULT_MOVE_TIME + 2)
+            self.assertFalse(engine.thread.is_alive(), command)
+            self.assertEqual(lines[-1], "bestmove d1d8")
+
+        # Illegal moves or a bad FEN are reported and the previous position is kept.
+        fen = engine.board.fen()
+        for command in ("position startpos moves e2e4 e2e4", "position startpos moves zz", "position fen nonsense"):
+            engine.handle(command)
+            self.assertTrue(lines[-1].startswith("info string "), command)
+            self.assertEqual(engine.board.fen(), fen)
+        self.assertFalse(engine.handle("quit"))
+
+    def test_node_limit(self):
+        ai.clear_transposition_table()
+        result = ai.search(chess.Board(), max_time=None, max_nodes=1000)
+        self.assertLess(result.nodes, 1000 + ai.TIME_CHECK_INTERVAL)
+        self.assertIsNotNone(result.move)
+
+class TestGameSession(unittest.TestCase):
+
+    def setUp(self):
+        import session
+        self.engine = session.EngineWorker()
+        self.addCleanup(self.engine.close)
+
+    def wait_for_reply(self, game, timeout=5.0):
+        deadline = time.time() + timeout
+        while not game.poll():
+            self.assertLess(time.time(), deadline, "engine did not reply")
+            time.sleep(0.01)
+
+    def test_engine_replies_through_poll(self):
+        import session
+        game = session.GameSession(self.engine, user_plays_white=True, max_time=0.2)
+        self.assertFalse(game.user_move(chess.Move.from_uci("e2e5")))
+        self.assertTrue(game.user_move(chess.Move.from_uci("e2e4")))
+        self.assertTrue(game.ai_thinking)
+        self.assertFalse(game.user_to_move)
+        self.wait_for_reply(game)
+        self.assertEqual(len(game.board.move_stack), 2)
+        self.assertTrue(game.user_to_move)
+        # The engine is pondering now; the next reply still arrives.
+        self.assertTrue(game.user_move(next(iter(game.board.legal_moves))))
+        self.wait_for_reply(game)
+        self.assertEqual(len(game.board.move_stack), 4)
+
+    def test_new_game_clears_table_and_cancels(self):
+        import session
+        game = session.GameSession(self.engine, user_plays_white=False, max_time=30.0)
+        time.sleep(0.2)
+        game.close()
+        self.assertEqual(self.engine.poll(), [])
+        session.GameSession(self.engine, user_plays_white=True)
+        deadline = time.time() + 5.0
+        while ai.transposition_table.hashfull():
+            self.assertLess(time.time(), deadline, "table was not cleared")
+            time.sleep(0.01)
+        self.assertEqual(self.engine.poll(), [])
+
+class TestEngineServer(unittest.TestCase):
+
+    def test_games_and_backpressure(self):
+        import asyncio
+        import loadgen
+        import server
+
+        async def scenario():
+            engine = server.EngineServer(workers=1, max_queue=1)
+            listener = await asyncio.start_server(engine.handle, "127.0.0.1", 0)
+            port = listener.sockets[0].getsockname()[1]
+            try:
+                client = loadgen.Client("127.0.0.1", port)
+                status, _, created = await client.request("POST", "/games", {})
+                self.assertEqual(status, 200)
+                status, _, reply = await client.request("POST", f"/games/{created['game']}/move", {"move": "e2e5"})
+                self.assertEqual(status, 400)
+                for budget in ("nan", "inf", "soon", -1, 0):
+                    status, _, reply = await client.request("POST", f"/games/{created['game']}/move",
+                                                            {"move": "e2e4", "time": budget})
+                    self.assertEqual(status, 400, budget)
+                status, _, reply = await client.request("POST", f"/games/{created['game']}/move",
+                                                        {"move": "e2e4", "time": 0.2})
+                self.assertEqual(status, 200)
+                board = chess.Board()
+                board.push_uci("e2e4")
+                self.assertIn(chess.Move.from_uci(reply["move"]), board.legal_moves)
+                self.assertEqual(chess.Board(reply["fen"]).turn, chess.WHITE)
+                await client.close()
+
+                # Three games racing for a queue of one: the extra requests are turned away and retried.
+                stats = await loadgen.run(f"http://127.0.0.1:{port}", games=3, moves=2, move_time=0.1, seed=1)
+                self.assertEqual(len(stats["latencies"]), 6)
+                self.assertGreater(stats["status"].get(503, 0), 0)
+                self.assertEqual(stats["server"]["rejected"], stats["status"][503])
+                self.assertEqual(stats["server"]["games"], 1)
+            finally:
+                listener.close()
+                await listener.wait_closed()
+                engine.close()
+
+        asyncio.run(scenario())
+
+    def test_failed_requests_leave_the_game_unchanged(self):
+        import asyncio
+        import loadgen
+        import server
+
+        async def scenario():
+            engine = server.EngineServer(workers=1)
+            listener = await asyncio.start_server(engine.handle, "127.0.0.1", 0)
+            port = listener.sockets[0].getsockname()[1]
+            try:
+                client = loadgen.Client("127.0.0.1", port)
+                status, _, reply = await client.request("POST", "/games", [])
+                self.assertEqual(status, 400)
+                _, _, created = await client.request("POST", "/games", {})
+                path = f"/games/{created['game']}/move"
+
+                # A worker that died: 500, the client's move is taken back and the retry is served.
+                engine.executors[0].submit(os._exit, 1)
+                status, _, reply = await client.request("POST", path, {"move": "e2e4", "time": 0.2})
+                self.assertEqual(status, 500)
+                self.assertEqual(engine.games[created["game"]].board.move_stack, [])
+
+                async def late(game, deadline):
+                    raise server.HTTPError(504, "time budget spent waiting for a worker")
+
+                engine.search, search = late, engine.search
+                status, _, reply = await client.request("POST", path, {"move": "e2e4", "time": 0.2})
+                self.assertEqual(status, 504)
+                engine.search = search
+                status, _, reply = await client.request("POST", path, {"move": "e2e4", "time": 0.2})
+                self.assertEqual(status, 200)
+                self.assertEqual(len(engine.games[created["game"]].board.move_stack), 2)
+                await client.close()
+
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(b"garbage\r\n\r\n")
+                self.assertIn(b" 400 ", await reader.readline())
+                writer.close()
+            finally:
+                listener.close()
+                await listener.wait_closed()
+                engine.close()
+
+        asyncio.run(scenario())
+
+    def test_search_sees_game_history(self):
+        import server
+        # White, a queen down, can draw by returning to the start position for the fifth time.
+        fen = "k7/8/8/8/8/8/q7/6NK b - - 0 1"
+        moves = ["a8b8", "g1f3", "b8a8", "f3g1"] * 3 + ["a8b8", "g1f3", "b8a8"]
+        result = server.search_move(fen, moves, time.time() + 5, {"max_depth": 2})
+        self.assertEqual((result["move"], result["score"]), ("f3g1", 0))
+
+class TestZobristHashing(unittest.TestCase):
+
+    def test_incremental_hash_matches_full_recompute(self):
+        # Random playouts from positions with castling, en passant and promotions available
+        fens = [
+            chess.STARTING_FEN,
+            "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+            "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+            "n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1",
+            "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+        ]
+        rng = random.Random(7)
+        for fen in fens:
+            for _ in range(5):
+                board = chess.Board(fen)
+                h = compute_zobrist_hash(board)
+                for _ in range(60):
+                    moves = list(board.legal_moves)
+                    if not moves:
+                        break
+                    h = make_move(board, rng.choice(moves), h)
+                    self.assertEqual(h, compute_zobrist_hash(board), board.fen())
+
+    def test_search_with_debug_cross_check(self):
+        board = chess.Board("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+        ai.ZOBRIST_DEBUG = True
+        try:
+            ai.minimax_alpha_beta(board, 2, float("-inf"), float("inf"), True)
+        finally:
+            ai.ZOBRIST_DEBUG = False
+
+
+class TestTranspositionTable(unittest.TestCase):
+
+    def test_store_and_probe_round_trip(self):
+        tt = TranspositionTable(1)
+        move = chess.Move.from_uci("e7e8q")
+        tt.store(0x1234567890ABCDEF, 5, -12.5, TT_EXACT, move)
+        self.assertEqual(tt.probe(0x1234567890ABCDEF), (5, -12.5, TT_EXACT, encode_move(move)))
+        self.assertEqual(tt.probe_move(0x1234567890ABCDEF), move)
+        self.assertIsNone(tt.probe(0x1234567890ABCDEE))
+
+    def test_depth_preferred_slot_survives_shallow_stores(self):
+        tt = TranspositionTable(1)
+        deep, shallow_a, shallow_b = 1, 1 + (tt.mask + 1), 1 + 2 * (tt.mask + 1)
+        tt.store(deep, 8, 1.0, TT_EXACT)
+        tt.store(shallow_a, 2, 2.0, TT_EXACT)
+        tt.store(shallow_b, 1, 3.0, TT_EXACT)
+        self.assertIsNotNone(tt.probe(deep))
+        self.assertIsNone(tt.probe(shallow_a))
+        self.assertEqual(tt.probe(shallow_b)[1], 3.0)
+        # After aging, the deep entry from the previous search is replaceable
+        tt.new_search()
+        tt.store(shallow_a, 1, 2.0, TT_EXACT)
+        self.assertIsNone(tt.probe(deep))
+
+    def test_memory_is_bounded(self):
+        tt = TranspositionTable(1)
+        for key in range(1, 200000, 7):
+            tt.store(key * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF, 1, 0.0, TT_ALPHA)
+        self.assertLessEqual(len(tt._buffer), 1024 * 1024)
+
 if __name__ == "__main__":
     unittest.main()
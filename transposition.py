@@ -0,0 +1,185 @@
+from array import array
+
+import chess
+
+# Entry flags. Names follow the alpha-beta convention used in ai.py:
+# ALPHA entries are upper bounds (failed low), BETA entries lower bounds.
+TT_EMPTY = 0
+TT_EXACT = 1
+TT_ALPHA = 2
+TT_BETA = 3
+
+DEFAULT_SIZE_MB = 16
+
+# Every entry is three 64-bit words: check, data, value.
+#   check = key ^ data ^ value bits, so a torn or foreign entry never verifies
+#   data  = flag (2 bits) | depth (8) | generation (8) | best move (15)
+#   value = the score as an IEEE double (keeps +/-inf for mates)
+# Buckets hold two entries: slot 0 is depth-preferred, slot 1 always-replace.
+ENTRY_WORDS = 3
+BUCKET_WORDS = 2 * ENTRY_WORDS
+BUCKET_BYTES = BUCKET_WORDS * 8
+
+_DEPTH_SHIFT = 2
+_GENERATION_SHIFT = 10
+_MOVE_SHIFT = 18
+
+
+def encode_move(move):
+    """Pack a move into 15 bits (from, to, promotion piece type)."""
+    if move is None:
+        return 0
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def decode_move(code):
+    if not code:
+        return None
+    return chess.Move(code & 63, (code >> 6) & 63, (code >> 12) or None)
+
+
+class TranspositionTable:
+    """Fixed-size, preallocated transposition table.
+
+    Entries live in one flat buffer indexed by the low bits of the Zobrist key,
+    so memory is bounded by size_mb no matter how long the process runs. An
+    existing buffer (e.g. shared memory) can be passed in instead of allocating.
+    """
+
+    def __init__(self, size_mb=DEFAULT_SIZE_MB, buffer=None):
+        if buffer is None:
+            buffer = bytearray(self.buffer_size(size_mb))
+        bucket_count = len(buffer) // BUCKET_BYTES
+        if not bucket_count or bucket_count & (bucket_count - 1):
+            raise ValueError("buffer must hold a power-of-two number of buckets")
+        self.mask = bucket_count - 1
+        self.generation = 0
+        self._buffer = buffer
+        self._view = memoryview(buffer)[:bucket_count * BUCKET_BYTES]
+        self._words = self._view.cast("Q")
+        self._values = self._view.cast("d")
+
+    @staticmethod
+    def buffer_size(size_mb):
+        """Bytes a table of size_mb megabytes occupies (rounded down to a power of two)."""
+        bucket_count = 1
+        while bucket_count * 2 * BUCKET_BYTES <= size_mb * 1024 * 1024:
+            bucket_count *= 2
+        return bucket_count * BUCKET_BYTES
+
+    @property
+    def size_mb(self):
+        """Size in megabytes; a table made with this size has the same number of buckets."""
+        return len(self._view) / (1024 * 1024)
+
+    def release(self):
+        """Drop the views into the buffer, e.g. before closing shared memory."""
+        self._words.release()
+        self._values.release()
+        self._view.release()
+        if isinstance(self._buffer, memoryview):
+            self._buffer.release()
+
+    def __len__(self):
+        """Number of entry slots."""
+        return (self.mask + 1) * 2
+
+    def new_search(self):
+        """Age the table: entries from earlier searches become replaceable."""
+        self.generation = (self.generation + 1) & 0xFF
+
+    def clear(self):
+        view = self._words.cast("B")
+        view[:] = bytes(len(view))
+        self.generation = 0
+
+    def probe(self, hash_key):
+        """Return (depth, value, flag, move_code) for hash_key, or None."""
+        words = self._words
+        i = (hash_key & self.mask) * BUCKET_WORDS
+        for j in (i, i + ENTRY_WORDS):
+            data = words[j + 1]
+            if data and words[j] ^ data ^ words[j + 2] == hash_key:
+                return ((data >> _DEPTH_SHIFT) & 0xFF, self._values[j + 2],
+                        data & 3, data >> _MOVE_SHIFT)
+        return None
+
+    def probe_move(self, hash_key):
+        """Best move stored for hash_key, or None."""
+        entry = self.probe(hash_key)
+        return decode_move(entry[3]) if entry else None
+
+    def store(self, hash_key, depth, value, flag, move=None):
+        words = self._words
+        i = (hash_key & self.mask) * BUCKET_WORDS
+        move_code = encode_move(move)
+
+        data = words[i + 1]
+        stored_key = words[i] ^ data ^ words[i + 2]
+        if (not data or stored_key == hash_key
+                or (data >> _GENERATION_SHIFT) & 0xFF != self.generation
+                or depth >= (data >> _DEPTH_SHIFT) & 0xFF):
+            j = i
+        else:
+            j = i + ENTRY_WORDS
+            data = words[j + 1]
+            stored_key = words[j] ^ data ^ words[j + 2]
+        if not move_code and data and stored_key == hash_key:
+            # Keep the old best move rather than forgetting it on a fail low.
+            move_code = data >> _MOVE_SHIFT
+
+        data = (flag | (max(0, min(depth, 0xFF)) << _DEPTH_SHIFT)
+                | (self.generation << _GENERATION_SHIFT) | (move_code << _MOVE_SHIFT))
+        self._values[j + 2] = value
+        words[j + 1] = data
+        words[j] = hash_key ^ data ^ words[j + 2]
+
+    def hashfull(self, sample=1000):
+        """Permille of sampled slots written during the current search."""
+        words = self._words
+        buckets = min(sample, self.mask + 1)
+        used = 0
+        for b in range(buckets):
+            for j in (b * BUCKET_WORDS, b * BUCKET_WORDS + ENTRY_WORDS):
+                data = words[j + 1]
+                if data and (data >> _GENERATION_SHIFT) & 0xFF == self.generation:
+                    used += 1
+        return used * 1000 // (buckets * 2)
+
+
+DEFAULT_EVAL_CACHE_MB = 4
+
+
+class EvaluationCache:
+    """Fixed-size cache of static evaluations keyed by Zobrist hash.
+
+    One always-replace slot per index, with the full key and the score kept
+    in two parallel arrays, so a probe is two array reads. Scores depend on
+    the position alone, so entries stay valid across searches and games.
+    """
+
+    def __init__(self, size_mb=DEFAULT_EVAL_CACHE_MB):
+        entries = 1
+        while entries * 2 * 16 <= size_mb * 1024 * 1024:
+            entries *= 2
+        self.mask = entries - 1
+        self._keys = array("Q", [0]) * entries
+        self._values = array("d", [0.0]) * entries
+
+    def __len__(self):
+        return self.mask + 1
+
+    def clear(self):
+        self._keys = array("Q", [0]) * len(self)
+
+    def probe(self, hash_key):
+        """Cached score for hash_key, or None."""
+        i = hash_key & self.mask
+        if self._keys[i] == hash_key:
+            return self._values[i]
+        return None
+
+    def store(self, hash_key, value):
+        i = hash_key & self.mask
+        self._keys[i] = hash_key
+        self._values[i] = value
@@ -0,0 +1,367 @@
+"""Texel tuning of the evaluation weights.
+
+    python tune.py extract positions.epd -o features --workers 8
+    python tune.py fit features -o evaluation.json --epochs 300
+
+extract streams a file of labeled positions, one per line: a FEN or EPD
+followed by the game result, either as an EPD operation (c9 "1-0"), a bare
+result (1-0, 0-1, 1/2-1/2) or a score in brackets ([1.0], [0.5], [0.0]).
+Chunks of lines are turned into features on a pool of worker processes and
+appended to features/positions.bin, a flat array of fixed-size records
+(see RECORD), so the dataset never has to fit in memory. Finished games and
+lines that cannot be parsed are skipped.
+
+fit maps that file with numpy.memmap and minimises the Texel loss, the mean
+squared difference between the result and sigmoid(K * eval), over the
+piece values, piece-square tables and mobility weight of evaluation.py.
+The loss and its gradient are computed with array operations a chunk of
+records at a time, and the weights are updated with Adam once per pass
+over the data. K is fitted to the starting weights first unless given. The
+result is written as a parameter file that evaluation.load_parameters (and
+ai.load_evaluation_parameters, uci.py's EvalFile option and selfplay.py's
+eval= setting) can load. Needs NumPy.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import chess
+import numpy as np
+
+import evaluation
+
+POSITIONS_FILE = "positions.bin"
+META_FILE = "meta.json"
+CHUNK_LINES = 10000
+# Records per array operation while fitting.
+FIT_CHUNK = 1 << 16
+
+# A position as a feature record. pieces lists one signed column per piece,
+# +c for White and -c for Black, where c = 1 + (piece_type - 1) * 64 + index
+# and index is the piece-square table entry the piece uses; unused slots are 0.
+# mobility is the legal move count, negative with Black to move. offset holds
+# everything evaluate_board adds on top of the tuned terms (pawn structure,
+# center control, king placement).
+MAX_PIECES = 32
+RECORD = np.dtype([("pieces", "<i2", (MAX_PIECES,)), ("mobility", "<i2"), ("offset", "<f8"), ("result", "<f4")])
+
+# Weight vector: piece values pawn..queen, the six tables, the mobility weight.
+TUNED_PIECES = [chess.PAWN, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN]
+TABLES_START = len(TUNED_PIECES)
+MOBILITY_INDEX = TABLES_START + 6 * 64
+WEIGHTS = MOBILITY_INDEX + 1
+COLUMNS = 1 + 6 * 64
+
+RESULTS = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5}
+LABEL = re.compile(r'(?:c9\s+)?"?(1-0|0-1|1/2-1/2)"?\s*;?\s*$|\[\s*(\d*\.?\d+)\s*\]\s*$')
+
+
+def parse_labeled(line):
+    """(board, result) for one dataset line, None for blank and comment lines.
+
+    Raises ValueError when the line has no result or no valid position.
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    match = LABEL.search(line)
+    if match is None:
+        raise ValueError(f"no result in {line!r}")
+    result = RESULTS[match.group(1)] if match.group(1) else float(match.group(2))
+    text = line[:match.start()].strip().rstrip(";|,").strip()
+    fields = text.split()
+    if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit():
+        board = chess.Board(" ".join(fields[:6]))
+    else:
+        board, _ = chess.Board.from_epd(text)
+    return board, result
+
+
+def position_record(board, result, record):
+    """Fill record with the features of board; False if board is not scored by the tuned terms."""
+    mobility = board.legal_moves.count()
+    piece_map = board.piece_map()
+    if evaluation.terminal_score(board, mobility) is not None or len(piece_map) > MAX_PIECES:
+        return False
+    pieces = record["pieces"]
+    pieces[:] = 0
+    for slot, (square, piece) in enumerate(piece_map.items()):
+        index = (7 - chess.square_rank(square)) * 8 + chess.square_file(square)
+        column = 1 + (piece.piece_type - 1) * 64 + index
+        pieces[slot] = column if piece.color == chess.WHITE else -column
+    signed_mobility = mobility if board.turn == chess.WHITE else -mobility
+    record["mobility"] = signed_mobility
+    record["offset"] = (evaluation.evaluate_board(board) - evaluation.material_pst(board)
+                        - evaluation.MOBILITY_WEIGHT * signed_mobility)
+    record["result"] = result
+    return True
+
+
+def extract_chunk(lines):
+    """(records, skipped) for a list of dataset lines."""
+    records = np.zeros(len(lines), dtype=RECORD)
+    count = skipped = 0
+    for line in lines:
+        try:
+            parsed = parse_labeled(line)
+        except ValueError:
+            skipped += 1
+            continue
+        if parsed is None:
+            continue
+        if position_record(*parsed, records[count]):
+            count += 1
+        else:
+            skipped += 1
+    return records[:count], skipped
+
+
+def read_chunks(path, size):
+    with open(path) as f:
+        chunk = []
+        for line in f:
+            chunk.append(line)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def extract(path, out_dir, workers=None, chunk_lines=CHUNK_LINES, progress=None):
+    """Turn the labeled positions in path into out_dir/positions.bin; returns the metadata.
+
+    Chunks are extracted on workers processes and written in input order;
+    at most two chunks per worker are in flight, so memory use does not
+    grow with the size of the dataset.
+    """
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(out_dir, exist_ok=True)
+    count = skipped = 0
+    start = time.monotonic()
+    with open(os.path.join(out_dir, POSITIONS_FILE), "wb") as out, ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+
+        def write_next():
+            nonlocal count, skipped
+            records, chunk_skipped = pending.popleft().result()
+            out.write(records.tobytes())
+            count += len(records)
+            skipped += chunk_skipped
+            if progress is not None:
+                progress(count, skipped, time.monotonic() - start)
+
+        for chunk in read_chunks(path, chunk_lines):
+            pending.append(pool.submit(extract_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                write_next()
+        while pending:
+            write_next()
+    meta = {"source": os.path.abspath(path), "positions": count, "skipped": skipped,
+            "record": RECORD.descr, "mobility_weight": evaluation.MOBILITY_WEIGHT}
+    with open(os.path.join(out_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def open_positions(directory):
+    """The extracted records of directory as a read-only memmap."""
+    path = os.path.join(directory, POSITIONS_FILE)
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=RECORD)
+    return np.memmap(path, dtype=RECORD, mode="r")
+
+
+def weights_from_parameters(params):
+    weights = np.zeros(WEIGHTS)
+    for i, piece_type in enumerate(TUNED_PIECES):
+        weights[i] = params["piece_values"][chess.piece_name(piece_type)]
+    for piece_type in chess.PIECE_TYPES:
+        start = TABLES_START + (piece_type - 1) * 64
+        weights[start:start + 64] = params["tables"][chess.piece_name(piece_type)]
+    weights[MOBILITY_INDEX] = params["mobility"]
+    return weights
+
+
+def parameters_from_weights(weights):
+    """A parameter file dict; values and tables are rounded to whole centipawns,
+    the mobility weight to a multiple of evaluation.MOBILITY_STEP."""
+    tables = {}
+    for piece_type in chess.PIECE_TYPES:
+        start = TABLES_START + (piece_type - 1) * 64
+        tables[chess.piece_name(piece_type)] = [int(round(value)) for value in weights[start:start + 64]]
+    return {"piece_values": {chess.piece_name(piece_type): int(round(weights[i]))
+                             for i, piece_type in enumerate(TUNED_PIECES)},
+            "tables": tables, "mobility": evaluation.round_mobility(float(weights[MOBILITY_INDEX]))}
+
+
+def signed_columns(weights):
+    """Score of every signed pieces entry, indexed by entry + COLUMNS - 1.
+
+    Column c scores its piece value plus its table entry; -c is the same
+    for Black, negated, and 0 (an empty slot) scores nothing.
+    """
+    columns = weights[TABLES_START:MOBILITY_INDEX].copy()
+    for i in range(len(TUNED_PIECES)):
+        columns[i * 64:(i + 1) * 64] += weights[i]
+    return np.concatenate([-columns[::-1], [0.0], columns])
+
+
+def evaluate_records(weights, records, scores=None):
+    """evaluate_board of every record under weights, White-relative."""
+    if scores is None:
+        scores = signed_columns(weights)
+    return (records["offset"] + scores[records["pieces"].astype(np.intp) + (COLUMNS - 1)].sum(axis=1)
+            + weights[MOBILITY_INDEX] * records["mobility"])
+
+
+def win_probability(score, k):
+    with np.errstate(over="ignore"):
+        return 1.0 / (1.0 + np.power(10.0, -k * score / 400.0))
+
+
+def chunks(records, size=FIT_CHUNK):
+    for start in range(0, len(records), size):
+        yield np.asarray(records[start:start + size])
+
+
+def loss(weights, records, k):
+    """Mean squared error between the results and the predicted win probabilities."""
+    scores = signed_columns(weights)
+    total = 0.0
+    for chunk in chunks(records):
+        error = chunk["result"] - win_probability(evaluate_records(weights, chunk, scores), k)
+        total += float(np.dot(error, error))
+    return total / max(len(records), 1)
+
+
+def gradient(weights, records, k):
+    """(loss, gradient of the loss by weights), one pass over records."""
+    scores = signed_columns(weights)
+    signed = np.zeros(2 * COLUMNS - 1)
+    mobility = 0.0
+    total = 0.0
+    for chunk in chunks(records):
+        p = win_probability(evaluate_records(weights, chunk, scores), k)
+        error = p - chunk["result"]
+        total += float(np.dot(error, error))
+        # d loss / d eval for every record, before the 1/n.
+        d_eval = 2.0 * error * p * (1.0 - p) * (k * math.log(10) / 400.0)
+        signed += np.bincount((chunk["pieces"].astype(np.intp) + (COLUMNS - 1)).ravel(),
+                              weights=np.repeat(d_eval, MAX_PIECES), minlength=2 * COLUMNS - 1)
+        mobility += float(np.dot(d_eval, chunk["mobility"]))
+    n = max(len(records), 1)
+    # Black entries count negatively; drop the empty slot.
+    columns = signed[COLUMNS:] - signed[COLUMNS - 2::-1]
+    grad = np.zeros(WEIGHTS)
+    grad[TABLES_START:MOBILITY_INDEX] = columns
+    for i in range(len(TUNED_PIECES)):
+        grad[i] = columns[i * 64:(i + 1) * 64].sum()
+    grad[MOBILITY_INDEX] = mobility
+    return total / n, grad / n
+
+
+def fit_k(weights, records, low=0.1, high=5.0, iterations=40):
+    """The K minimising the loss of weights, by golden-section search."""
+    scores = np.concatenate([evaluate_records(weights, chunk) for chunk in chunks(records)])
+    results = np.asarray(records["result"])
+
+    def k_loss(k):
+        error = results - win_probability(scores, k)
+        return float(np.dot(error, error))
+
+    ratio = (math.sqrt(5) - 1) / 2
+    a, b = low, high
+    c, d = b - ratio * (b - a), a + ratio * (b - a)
+    for _ in range(iterations):
+        if k_loss(c) < k_loss(d):
+            b = d
+        else:
+            a = c
+        c, d = b - ratio * (b - a), a + ratio * (b - a)
+    return (a + b) / 2
+
+
+# Adam step sizes: one centipawn for piece values and table entries, less
+# for the mobility weight, which multiplies a count of thirty-odd moves.
+LEARNING_RATE = 1.0
+MOBILITY_LEARNING_RATE = 0.01
+
+
+def fit(records, weights, k, epochs=200, learning_rate=LEARNING_RATE, progress=None):
+    """Adam on the full-batch Texel loss; returns the tuned weights."""
+    weights = weights.copy()
+    rates = np.full(WEIGHTS, learning_rate)
+    rates[MOBILITY_INDEX] = learning_rate * MOBILITY_LEARNING_RATE / LEARNING_RATE
+    beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+    m = np.zeros(WEIGHTS)
+    v = np.zeros(WEIGHTS)
+    for epoch in range(1, epochs + 1):
+        value, grad = gradient(weights, records, k)
+        m = beta1 * m + (1 - beta1) * grad
+        v = beta2 * v + (1 - beta2) * grad * grad
+        weights -= rates * (m / (1 - beta1 ** epoch)) / (np.sqrt(v / (1 - beta2 ** epoch)) + epsilon)
+        if progress is not None:
+            progress(epoch, value)
+    return weights
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    extract_parser = commands.add_parser("extract", help="extract features from labeled positions")
+    extract_parser.add_argument("positions", help="one FEN/EPD with its result per line")
+    extract_parser.add_argument("-o", "--output", default="features", help="feature directory")
+    extract_parser.add_argument("--workers", type=int, help="extraction processes (default: all cores)")
+    extract_parser.add_argument("--chunk", type=int, default=CHUNK_LINES, help="lines per worker task")
+    fit_parser = commands.add_parser("fit", help="tune the weights on extracted features")
+    fit_parser.add_argument("features", help="feature directory written by extract")
+    fit_parser.add_argument("-o", "--output", default="evaluation.json", help="parameter file to write")
+    fit_parser.add_argument("--start", help="parameter file to start from (default: the built-in weights)")
+    fit_parser.add_argument("--epochs", type=int, default=200)
+    fit_parser.add_argument("--lr", type=float, default=LEARNING_RATE, help="Adam step size in centipawns")
+    fit_parser.add_argument("--k", type=float, help="sigmoid scale (default: fitted to the starting weights)")
+    args = parser.parse_args(argv)
+
+    if args.command == "extract":
+        def report(count, skipped, elapsed):
+            print(f"\r{count} positions, {skipped} skipped, {count / max(elapsed, 1e-9):.0f}/s",
+                  end="", file=sys.stderr)
+
+        meta = extract(args.positions, args.output, args.workers, args.chunk, report)
+        print(file=sys.stderr)
+        print(f"{meta['positions']} positions in {args.output}")
+        return 0
+
+    if args.start:
+        evaluation.load_parameters(args.start)
+    records = open_positions(args.features)
+    if not len(records):
+        print(f"no positions in {args.features}", file=sys.stderr)
+        return 1
+    weights = weights_from_parameters(evaluation.parameters())
+    k = args.k if args.k is not None else fit_k(weights, records)
+    print(f"{len(records)} positions, K = {k:.4f}, loss {loss(weights, records, k):.6f}")
+    start = time.monotonic()
+
+    def report(epoch, value):
+        if epoch == 1 or epoch % 10 == 0 or epoch == args.epochs:
+            print(f"epoch {epoch:4d}  loss {value:.6f}  {time.monotonic() - start:6.1f}s")
+
+    weights = fit(records, weights, k, args.epochs, args.lr, report)
+    params = parameters_from_weights(weights)
+    print(f"final loss {loss(weights_from_parameters(params), records, k):.6f} (rounded weights)")
+    with open(args.output, "w") as f:
+        json.dump(params, f, indent=2)
+    print(f"wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
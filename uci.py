@@ -0,0 +1,213 @@
+"""UCI front end for the engine, without the GUI.
+
+    python uci.py
+
+speaks the Universal Chess Interface on stdin/stdout, so the engine can be
+run by tournament managers and other UCI tools. Searches run on a worker
+thread: `stop` ends the current one cooperatively (the search polls a stop
+event together with its clock) and `isready` is answered at once even while
+searching. Only ai.py is imported, never pygame or cairosvg.
+"""
+import sys
+import threading
+
+import chess
+
+import ai
+
+ENGINE_NAME = "AI Chess"
+ENGINE_AUTHOR = "syang0624"
+
+# Share of the remaining clock spent on one move when no movestogo is given.
+DEFAULT_MOVES_TO_GO = 30
+# Kept in reserve for process and pipe overhead on every timed move.
+MOVE_OVERHEAD = 0.05
+# Seconds per move for a go without any limit (no clock, depth, nodes or mate).
+DEFAULT_MOVE_TIME = 1.0
+
+
+def parse_go(tokens):
+    """'go' arguments -> dict of the limits given (times in seconds)."""
+    params = {}
+    i = 0
+    while i < len(tokens):
+        name = tokens[i]
+        if name in ("infinite", "ponder"):
+            params[name] = True
+        elif name in ("wtime", "btime", "winc", "binc", "movetime") and i + 1 < len(tokens):
+            params[name] = int(tokens[i + 1]) / 1000
+            i += 1
+        elif name in ("depth", "nodes", "movestogo", "mate") and i + 1 < len(tokens):
+            params[name] = int(tokens[i + 1])
+            i += 1
+        i += 1
+    return params
+
+
+def allocate_time(params, turn):
+    """Seconds to search for the given go parameters, or None for no time limit."""
+    if params.get("infinite") or params.get("ponder"):
+        return None
+    if "movetime" in params:
+        return max(0.01, params["movetime"] - MOVE_OVERHEAD)
+    remaining = params.get("wtime" if turn == chess.WHITE else "btime")
+    if remaining is None:
+        if any(limit in params for limit in ("depth", "nodes", "mate")):
+            return None
+        # A bare go still has to answer without waiting for stop.
+        return DEFAULT_MOVE_TIME - MOVE_OVERHEAD
+    increment = params.get("winc" if turn == chess.WHITE else "binc", 0.0)
+    budget = remaining / params.get("movestogo", DEFAULT_MOVES_TO_GO) + increment * 0.8
+    return max(0.01, min(budget, remaining / 2) - MOVE_OVERHEAD)
+
+
+def search_depth(params):
+    """Depth limit for the go parameters; mate N needs at most 2N - 1 plies."""
+    depth = params.get("depth", ai.MAX_SEARCH_DEPTH)
+    if "mate" in params:
+        depth = min(depth, max(1, 2 * params["mate"] - 1))
+    return depth
+
+
+def format_score(score, turn):
+    """UCI score of a White-relative search score, from the side to move."""
+    if score in (float("inf"), float("-inf")):
+        # Mates are not scored by distance; report them as mate in one either way.
+        winning = (score > 0) == (turn == chess.WHITE)
+        return "mate 1" if winning else "mate -1"
+    return f"cp {round(score if turn == chess.WHITE else -score)}"
+
+
+class UCIEngine:
+    """Handles UCI commands; output is a function that writes one line."""
+
+    def __init__(self, output=print):
+        self.output = output
+        self.board = chess.Board()
+        self.use_book = True
+        self.nodes = 0
+        self.thread = None
+        self.stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def send(self, line):
+        with self._lock:
+            self.output(line)
+
+    def handle(self, line):
+        """Process one command line; returns False on quit."""
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send(f"option name Hash type spin default {ai.TT_SIZE_MB} min 1 max 4096")
+            self.send("option name OwnBook type check default true")
+            self.send("option name EvalFile type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.set_option(args)
+        elif command == "ucinewgame":
+            self.wait()
+            ai.clear_transposition_table()
+        elif command == "position":
+            self.wait()
+            self.set_position(args)
+        elif command == "go":
+            self.wait()
+            self.go(parse_go(args))
+        elif command in ("stop", "ponderhit"):
+            # Pondering is searched like an infinite search; a hit just ends it.
+            self.wait()
+        elif command == "quit":
+            self.wait()
+            return False
+        return True
+
+    def set_option(self, args):
+        text = " ".join(args)
+        name, _, value = text.partition(" value ")
+        name = name.replace("name", "", 1).strip().lower()
+        if name == "hash":
+            self.wait()
+            ai.resize_transposition_table(int(value))
+        elif name == "ownbook":
+            self.use_book = value.strip().lower() == "true"
+        elif name == "evalfile":
+            self.wait()
+            path = value.strip()
+            ai.load_evaluation_parameters(path if path and path != "<empty>" else None)
+
+    def set_position(self, args):
+        if not args:
+            return
+        try:
+            if args[0] == "startpos":
+                board = chess.Board()
+                rest = args[1:]
+            elif args[0] == "fen":
+                fen_end = args.index("moves") if "moves" in args else len(args)
+                board = chess.Board(" ".join(args[1:fen_end]))
+                rest = args[fen_end:]
+            else:
+                return
+            if rest and rest[0] == "moves":
+                for uci in rest[1:]:
+                    board.push_uci(uci)
+        except ValueError as error:
+            # A bad position must not take the engine down; the previous one stays.
+            self.send(f"info string ignoring position: {error}")
+            return
+        self.board = board
+
+    def go(self, params):
+        self.stop_event = threading.Event()
+        board = self.board.copy()
+        self.thread = threading.Thread(target=self._search, args=(board, params), daemon=True)
+        self.thread.start()
+
+    def _search(self, board, params):
+        self.nodes = 0
+        move = None
+        if self.use_book and not params.get("infinite"):
+            book = ai.get_opening_book()
+            move = book.probe(board) if book is not None else None
+        if move is None:
+            result = ai.search(board, allocate_time(params, board.turn), search_depth(params),
+                               stop_event=self.stop_event, max_nodes=params.get("nodes"),
+                               on_iteration=lambda info: self.report(info, board.turn))
+            move = result.move
+        if params.get("infinite") or params.get("ponder"):
+            # UCI forbids answering an infinite or ponder search before stop.
+            self.stop_event.wait()
+        self.send(f"bestmove {move.uci() if move else '0000'}")
+
+    def report(self, info, turn):
+        self.nodes += info.stats.nodes
+        elapsed = max(info.elapsed, 1e-6)
+        self.send(f"info depth {info.depth} score {format_score(info.score, turn)} nodes {self.nodes} "
+                  f"nps {round(self.nodes / elapsed)} time {round(elapsed * 1000)} "
+                  f"hashfull {ai.transposition_table.hashfull()} pv {info.move.uci()}")
+
+    def wait(self):
+        """Stop a running search and wait until its bestmove has been sent."""
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+
+def main():
+    engine = UCIEngine(output=lambda line: print(line, flush=True))
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())